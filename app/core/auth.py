@@ -1,18 +1,167 @@
+import mmap
+import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, AsyncGenerator, Optional
 import jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import select, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, object_session
 
 from .config import settings
-from .database import get_db
+from .database import AsyncSessionLocal, read_session
+from .metrics import Observed
+from .passwords import pwd_context, password_hasher
 from ..models import User
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
+class TTLCache:
+    # bounded LRU whose entries also expire; only touched from the event
+    # loop, so it needs no locking
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+class Generations:
+    # per-user invalidation counters in a memory-mapped file that every worker
+    # on the host maps, one int64 slot per user id modulo SLOTS. Two workers
+    # bumping the same slot at once may both write the same value, which is
+    # still a change from what either had cached
+
+    SLOTS = 1 << 16
+
+    def __init__(self, path: str):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.SLOTS * 8:
+                os.ftruncate(fd, self.SLOTS * 8)
+            self._mmap = mmap.mmap(fd, self.SLOTS * 8)
+        finally:
+            os.close(fd)
+        self._counters = memoryview(self._mmap).cast("q")
+
+    def get(self, user_id: int) -> int:
+        return self._counters[user_id % self.SLOTS]
+
+    def bump(self, user_id: int):
+        slot = user_id % self.SLOTS
+        self._counters[slot] += 1
+
+class PrincipalCache(TTLCache):
+    # with a generations file, invalidating a user in one worker drops the
+    # entry in every worker on the host at its next lookup; without one,
+    # invalidation is local to the process (see auth_cache_ttl)
+
+    def __init__(self, maxsize: int, ttl: float, generations: Optional[Generations] = None):
+        super().__init__(maxsize, ttl)
+        self.generations = generations
+
+    def generation(self, user_id: int) -> int:
+        # read before loading the row, so a change committed during the load
+        # leaves the entry already outdated
+        return self.generations.get(user_id) if self.generations is not None else 0
+
+    def get(self, key) -> Optional[Any]:
+        item = super().get(key)
+        if item is None:
+            return None
+        value, generation = item
+        if generation != self.generation(key):
+            super().invalidate(key)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return value
+
+    def set(self, key, value, ttl: Optional[float] = None, generation: Optional[int] = None):
+        super().set(key, (value, self.generation(key) if generation is None else generation), ttl)
+
+    def invalidate(self, key):
+        super().invalidate(key)
+        if self.generations is not None:
+            self.generations.bump(key)
+
+# user id -> column snapshot of an authenticated, active user
+principal_cache = PrincipalCache(
+    settings.auth_cache_size, settings.auth_cache_ttl,
+    Generations(settings.auth_generations_path) if settings.auth_generations_path else None
+)
+# token -> verified claims, kept until the token expires
+token_cache = TTLCache(settings.auth_token_cache_size, settings.access_token_expire_minutes * 60)
+
+PRINCIPAL_FIELDS = ("id", "username", "balance", "is_active", "created_at")
+
+AUTH_CACHES = {"principal": principal_cache, "token": token_cache}
+Observed(
+    "auth_cache_hits_total", "Authentication cache lookups answered from the cache", "counter",
+    lambda: {(name,): cache.hits for name, cache in AUTH_CACHES.items()}, ("cache",)
+)
+Observed(
+    "auth_cache_misses_total", "Authentication cache lookups that fell through", "counter",
+    lambda: {(name,): cache.misses for name, cache in AUTH_CACHES.items()}, ("cache",)
+)
+Observed(
+    "auth_cache_entries", "Entries held by each authentication cache", "gauge",
+    lambda: {(name,): len(cache) for name, cache in AUTH_CACHES.items()}, ("cache",)
+)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target):
+    # any ORM change to a user (balance, deactivation) drops its cached copy.
+    # This fires at flush, and a request in between can cache the row as it
+    # was before the commit, so the id is dropped again once committed
+    principal_cache.invalidate(target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_users", set()).add(target.id)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for user_id in session.info.pop("changed_users", ()):
+        principal_cache.invalidate(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back(session):
+    session.info.pop("changed_users", None)
+
 class AuthService:
     
     @staticmethod
@@ -36,11 +185,24 @@ class AuthService:
         return encoded_jwt
 
     @staticmethod
-    def verify_token(token: str) -> Optional[str]:
+    def create_user_token(user: User) -> str:
+        # the id claim lets requests find the cached principal without a lookup
+        return AuthService.create_access_token(data={"sub": user.username, "uid": user.id})
+
+    @staticmethod
+    def decode_token(token: str) -> dict:
+        payload = token_cache.get(token)
+        if payload is not None:
+            expires = payload.get("exp")
+            if expires is None or expires > time.time():
+                return payload
+            token_cache.invalidate(token)
         try:
             payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-            username: str = payload.get("sub")
-            return username
+            # a token without exp never expires, so it keeps the cache's own ttl
+            expires = payload.get("exp")
+            token_cache.set(token, payload, ttl=expires - time.time() if expires is not None else None)
+            return payload
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -54,6 +216,14 @@ class AuthService:
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+    @staticmethod
+    def verify_token(token: str) -> Optional[str]:
+        return AuthService.decode_token(token).get("sub")
+
+    @staticmethod
+    async def get_password_hash_async(password: str) -> str:
+        return await password_hasher.hash(password)
+
     @staticmethod
     def authenticate_user(db: Session, username: str, password: str) -> Optional[User]:
         user = db.query(User).filter(User.username == username).first()
@@ -63,30 +233,83 @@ class AuthService:
             return None
         return user
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    username = AuthService.verify_token(credentials.credentials)
+    @staticmethod
+    async def get_user_by_username(db: AsyncSession, username: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.username == username))
+        return result.scalars().first()
+
+    @staticmethod
+    async def authenticate_user_async(db: AsyncSession, username: str, password: str) -> Optional[User]:
+        user = await AuthService.get_user_by_username(db, username)
+        if not user:
+            return None
+        verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+        if not verified:
+            return None
+        if new_hash is not None:
+            # hashed at an older cost; upgraded now that the password is known
+            user.hashed_password = new_hash
+            await db.commit()
+        return user
+
+async def get_principal(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    # column snapshot of the token's user, answered from the principal cache
+    # when warm. A miss looks the user up in a short session of its own, so the
+    # pooled connection goes back before the route runs instead of being held
+    # for the whole request, and the route's get_async_db session is untouched
+    payload = AuthService.decode_token(credentials.credentials)
+    username = payload.get("sub")
     if username is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    user_id = payload.get("uid")
+    principal = principal_cache.get(user_id) if user_id is not None else None
+    if principal is None:
+        generation = principal_cache.generation(user_id) if user_id is not None else None
+        async with AsyncSessionLocal() as db:
+            if user_id is not None:
+                user = await db.get(User, user_id)
+            else:
+                user = await AuthService.get_user_by_username(db, username)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        principal = {field: getattr(user, field) for field in PRINCIPAL_FIELDS}
+        principal_cache.set(user.id, principal, generation=generation)
+    return principal
+
+async def get_current_user(principal: dict = Depends(get_principal)) -> User:
+    # the returned user is a detached snapshot, so anything that writes the
+    # account loads its own row
+    if not principal["is_active"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Inactive user"
+        )
     
-    user = db.query(User).filter(User.username == username).first()
+    return User(**principal)
+
+async def get_read_db(current_user: User = Depends(get_current_user)) -> AsyncGenerator[AsyncSession, None]:
+    # replica session for read-only routes, or the primary while the user's own
+    # recent writes may not have replicated yet. Principal lookups above stay on
+    # the primary, since a stale balance would otherwise be cached
+    async with read_session(current_user.id) as db:
+        yield db
+
+async def load_user(db: AsyncSession, principal: User) -> User:
+    # the session-bound row behind a cached principal, for writes to the account
+    user = await db.get(User, principal.id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
-    if not user.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Inactive user"
-        )
-    
     return user
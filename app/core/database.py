@@ -1,19 +1,301 @@
-from sqlalchemy import create_engine
+import asyncio
+import time
+from contextvars import ContextVar
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import await_only
+from typing import AsyncGenerator, Dict, Generator, List, Optional
 from .config import settings
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=False
-)
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+# run on every replica connection so a misrouted write fails instead of diverging
+READ_ONLY_STATEMENTS = {
+    "sqlite": "PRAGMA query_only=ON",
+    "mysql": "SET SESSION TRANSACTION READ ONLY",
+    "postgresql": "SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY",
+}
+
+# set by a caller that wants the time its task spends in async engine
+# statements added up (see metrics.trade_timer)
+statement_time: ContextVar[Optional[List[float]]] = ContextVar("statement_time", default=None)
+
+def to_async_url(database_url: str) -> str:
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+class PoolStats:
+    # checkout counts and the time callers spent waiting for a connection
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def observe(self, waited: float):
+        self.checkouts += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self) -> dict:
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+        }
+
+class TimedPoolMixin:
+    stats: PoolStats
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.timeouts += 1
+            raise
+        self.stats.observe(time.perf_counter() - started)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+class SQLiteWriteQueue:
+    # SQLite allows one writer at a time. Async sessions queue here, in
+    # arrival order, at their transaction's first write and leave on
+    # commit/rollback, so writers wait on the event loop instead of spinning
+    # in the busy handler. Readers never queue; WAL runs them beside the writer.
+    # The sync engine has no queue and relies on busy_timeout
+
+    def __init__(self):
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.waits = 0
+        self.wait_total = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock, self._loop = asyncio.Lock(), loop
+        started = time.perf_counter()
+        await asyncio.wait_for(self._lock.acquire(), settings.sqlite_busy_timeout / 1000)
+        self.waits += 1
+        self.wait_total += time.perf_counter() - started
+
+    def release(self):
+        if self._lock is not None and self._lock.locked():
+            self._lock.release()
+
+    @property
+    def writing(self) -> bool:
+        return self._lock is not None and self._lock.locked()
+
+sqlite_write_queue = SQLiteWriteQueue()
+
+def _is_memory(url) -> bool:
+    return url.database in (None, "", ":memory:")
+
+def engine_options(database_url: str, is_async: bool) -> dict:
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        options = {"echo": False, "connect_args": {"check_same_thread": False}}
+        if not _is_memory(url):
+            options["poolclass"] = TimedAsyncQueuePool if is_async else TimedQueuePool
+            options["pool_size"] = settings.db_pool_size
+            options["max_overflow"] = settings.db_max_overflow
+            options["pool_timeout"] = settings.db_pool_timeout
+        return options
+
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+        "echo": False,
+    }
+
+def configure_sqlite(engine: Engine, write_queue: Optional[SQLiteWriteQueue] = None):
+    # statements run in SQLite's autocommit mode until the first write, which
+    # opens BEGIN IMMEDIATE. Reads then see the latest commit rather than pin a
+    # snapshot that a later write could not upgrade (SQLITE_BUSY), which also
+    # matches the read-committed behaviour the services get from MySQL
+    wal = not _is_memory(engine.url)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        if wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+        cursor.close()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def begin_write(connection, cursor, statement, parameters, context, executemany):
+        if connection.info.get("writing") or not statement.lstrip()[:7].upper().startswith(WRITE_PREFIXES):
+            return
+        if write_queue is not None:
+            # runs inside the async adapter's greenlet, so it may await
+            await_only(write_queue.acquire())
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+        except Exception:
+            if write_queue is not None:
+                write_queue.release()
+            raise
+        connection.info["writing"] = True
+
+    def end_write(connection):
+        # an invalidated connection is settled by the pool events below
+        if not connection.invalidated and connection.info.pop("writing", False) and write_queue is not None:
+            write_queue.release()
+
+    event.listen(engine, "commit", end_write)
+    event.listen(engine, "rollback", end_write)
+
+    def end_write_on_pool(dbapi_connection, connection_record, *args):
+        # a connection handed back or dropped mid-transaction must not keep the queue
+        if connection_record is not None and connection_record.info.pop("writing", False) and write_queue is not None:
+            write_queue.release()
+
+    event.listen(engine.pool, "checkin", end_write_on_pool)
+    event.listen(engine.pool, "invalidate", end_write_on_pool)
+
+def track_statement_time(engine: Engine):
+    # registered ahead of configure_sqlite, so waiting in the write queue
+    # counts, as a lock wait inside the statement would on other backends
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement(connection, cursor, statement, parameters, context, executemany):
+        if statement_time.get() is not None:
+            connection.info["statement_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement(connection, cursor, statement, parameters, context, executemany):
+        started = connection.info.pop("statement_started", None)
+        timer = statement_time.get()
+        if started is not None and timer is not None:
+            timer[0] += time.perf_counter() - started
+
+def configure_read_only(engine: Engine):
+    statement = READ_ONLY_STATEMENTS.get(engine.dialect.name)
+    if statement is None:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_read_only(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(statement)
+        cursor.close()
+
+class ReadRouter:
+    # a user who just wrote reads from the primary until the window passes, so
+    # their next request never sees a replica that hasn't caught up yet
+
+    def __init__(self, window: float):
+        self.window = window
+        self._recent: Dict[int, float] = {}
+        self._prune_at = 1024
+
+    def mark_write(self, user_id: int):
+        now = time.monotonic()
+        self._recent[user_id] = now + self.window
+        if len(self._recent) >= self._prune_at:
+            self._recent = {user: until for user, until in self._recent.items() if until > now}
+            self._prune_at = max(1024, 2 * len(self._recent))
+
+    def use_primary(self, user_id: int) -> bool:
+        until = self._recent.get(user_id)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            del self._recent[user_id]
+            return False
+        return True
+
+read_router = ReadRouter(settings.read_your_writes_window)
+
+engine = create_engine(settings.database_url, **engine_options(settings.database_url, is_async=False))
+
+async_database_url = settings.async_database_url or to_async_url(settings.database_url)
+async_engine = create_async_engine(async_database_url, **engine_options(async_database_url, is_async=True))
+
+if settings.read_database_url:
+    read_async_url = to_async_url(settings.read_database_url)
+    read_async_engine = create_async_engine(read_async_url, **engine_options(read_async_url, is_async=True))
+    configure_read_only(read_async_engine.sync_engine)
+else:
+    read_async_engine = async_engine
+
+track_statement_time(async_engine.sync_engine)
+
+if engine.dialect.name == "sqlite":
+    configure_sqlite(engine)
+if async_engine.dialect.name == "sqlite":
+    configure_sqlite(async_engine.sync_engine, sqlite_write_queue)
+if read_async_engine is not async_engine and read_async_engine.dialect.name == "sqlite":
+    configure_sqlite(read_async_engine.sync_engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(read_async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def pool_stats() -> dict:
+    stats = {}
+    pools = [("sync", engine.pool), ("async", async_engine.sync_engine.pool)]
+    if read_async_engine is not async_engine:
+        pools.append(("read", read_async_engine.sync_engine.pool))
+    for name, pool in pools:
+        entry = {"status": pool.status()}
+        if isinstance(pool, TimedPoolMixin):
+            entry.update(pool.stats.as_dict(), size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        stats[name] = entry
+    if async_engine.dialect.name == "sqlite":
+        stats["sqlite_write_queue"] = {
+            "waits": sqlite_write_queue.waits,
+            "wait_total": sqlite_write_queue.wait_total,
+            "writing": sqlite_write_queue.writing,
+        }
+    return stats
+
+async def dispose_engines():
+    # pooled aiosqlite connections each own a worker thread that would keep
+    # the process alive after shutdown
+    await async_engine.dispose()
+    if read_async_engine is not async_engine:
+        await read_async_engine.dispose()
+    engine.dispose()
+
 def get_db() -> Generator[Session, None, None]:
     db = SessionLocal()
     try:
@@ -21,5 +303,14 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def read_session(user_id: int) -> AsyncSession:
+    if read_router.use_primary(user_id):
+        return AsyncSessionLocal()
+    return AsyncReadSessionLocal()
+
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+from .config import settings
+
+# attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Bucket:
+    __slots__ = ("capacity", "rate", "tokens", "refilled", "suppressed")
+
+    def __init__(self, rate: float):
+        self.capacity = max(rate, 1.0)
+        self.rate = rate
+        self.tokens = self.capacity
+        self.refilled = time.monotonic()
+        self.suppressed = 0
+
+
+class SamplingFilter(logging.Filter):
+    # per-logger sampling of sub-warning records and a token bucket on
+    # everything, both keyed by the longest matching logger name prefix.
+    # Records dropped by the bucket are counted onto the next one let through
+
+    def __init__(self, sample_rates: Dict[str, float], rate_limits: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_limits = rate_limits
+        self._resolved: Dict[str, Tuple[float, Optional[_Bucket]]] = {}
+        # one bucket per configured prefix, shared by every logger under it
+        self._buckets: Dict[str, _Bucket] = {}
+        self._lock = threading.Lock()
+
+    def _match(self, table: Dict[str, float], name: str) -> Optional[Tuple[str, float]]:
+        best = None
+        for prefix, value in table.items():
+            if (name == prefix or name.startswith(prefix + ".")) and (best is None or len(prefix) > len(best[0])):
+                best = (prefix, value)
+        return best
+
+    def _policy(self, name: str) -> Tuple[float, Optional[_Bucket]]:
+        policy = self._resolved.get(name)
+        if policy is None:
+            sample = self._match(self.sample_rates, name)
+            limit = self._match(self.rate_limits, name)
+            bucket = None
+            if limit and limit[1]:
+                with self._lock:
+                    bucket = self._buckets.get(limit[0])
+                    if bucket is None:
+                        bucket = self._buckets[limit[0]] = _Bucket(limit[1])
+            policy = self._resolved[name] = (1.0 if sample is None else sample[1], bucket)
+        return policy
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample, bucket = self._policy(record.name)
+        if record.levelno < logging.WARNING and sample < 1.0 and random.random() >= sample:
+            return False
+        if bucket is None:
+            return True
+
+        with self._lock:
+            now = time.monotonic()
+            bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.refilled) * bucket.rate)
+            bucket.refilled = now
+            if bucket.tokens < 1.0:
+                bucket.suppressed += 1
+                return False
+            bucket.tokens -= 1.0
+            if bucket.suppressed:
+                record.suppressed = bucket.suppressed
+                bucket.suppressed = 0
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    # the calling thread only enqueues the record; the message is formatted
+    # by the listener thread, and a full queue drops instead of blocking
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    if settings.log_json:
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    handler = NonBlockingQueueHandler(queue.Queue(settings.log_queue_size))
+    handler.addFilter(SamplingFilter(settings.log_sample_rates, settings.log_rate_limits))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(settings.log_level.upper())
+
+    _listener = QueueListener(handler.queue, stream)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,226 @@
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+from .database import pool_stats, sqlite_write_queue, statement_time
+from .log import NonBlockingQueueHandler
+from .passwords import password_hasher
+
+# Prometheus text exposition without the client library. Recording is an
+# unlocked add on plain lists and floats: nearly every sample is taken on the
+# event loop thread, and the few from worker threads can at worst lose an
+# increment. Only creating a new label set takes the lock
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names: Tuple[str, ...], values: Labels, extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: List["Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def render(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if labels not in self._values:
+            with self._lock:
+                self._values.setdefault(labels, 0.0)
+        self._values[labels] += amount
+
+    def render(self) -> Iterator[str]:
+        for labels, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class _HistogramChild:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self, size: int):
+        # one slot per bucket plus the overflow above the last bound
+        self.counts = [0] * (size + 1)
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Labels, _HistogramChild] = {}
+
+    def observe(self, value: float, *labels: str):
+        child = self._children.get(labels)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(labels, _HistogramChild(len(self.buckets)))
+        # buckets are upper bounds, inclusive
+        child.counts[bisect_left(self.buckets, value)] += 1
+        child.sum += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> Iterator[str]:
+        for labels, child in list(self._children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(child.sum)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Observed(Metric):
+    # a gauge or counter read at scrape time from state a service already
+    # keeps, so it costs nothing between scrapes. The callback returns a
+    # single value, or a mapping of label values to values
+
+    def __init__(
+        self, name: str, help: str, type: str,
+        collect: Callable[[], Union[float, Dict[Labels, float]]], labelnames: Tuple[str, ...] = ()
+    ):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def render(self) -> Iterator[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            if value is not None:
+                yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+trade_latency = Histogram(
+    "trade_execution_seconds",
+    "Trade request latency. phase=total is the whole request, phase=db its statement time "
+    "when trades run directly against the database, phase=commit each execution engine group commit",
+    ("phase",),
+)
+upstream_latency = Histogram(
+    "upstream_fetch_seconds", "CoinGecko price request latency, retries included", ("outcome",)
+)
+upstream_errors = Counter(
+    "upstream_fetch_errors_total", "Coin ids missing from a CoinGecko refresh, by cause", ("coin_id", "reason")
+)
+broadcast_latency = Histogram(
+    "ws_broadcast_seconds", "Time to encode and enqueue one price frame for every subscriber", ("kind",)
+)
+
+
+def _pool_values(key: str) -> Dict[Labels, float]:
+    return {(name,): entry[key] for name, entry in pool_stats().items() if "status" in entry and key in entry}
+
+
+def _log_dropped() -> float:
+    return sum(
+        handler.dropped for handler in logging.getLogger().handlers
+        if isinstance(handler, NonBlockingQueueHandler)
+    )
+
+
+Observed("db_pool_checkouts_total", "Connections checked out of each pool", "counter",
+         lambda: _pool_values("checkouts"), ("pool",))
+Observed("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection", "counter",
+         lambda: _pool_values("timeouts"), ("pool",))
+Observed("db_pool_wait_seconds_total", "Time spent waiting for a pooled connection", "counter",
+         lambda: _pool_values("wait_total"), ("pool",))
+Observed("db_pool_checked_out", "Connections currently checked out", "gauge",
+         lambda: _pool_values("checked_out"), ("pool",))
+Observed("sqlite_write_queue_wait_seconds_total", "Time async writers spent queued for the SQLite write lock",
+         "counter", lambda: sqlite_write_queue.wait_total)
+Observed("password_hash_pending", "Password hashes queued or running in the worker pool", "gauge",
+         lambda: password_hasher.pending)
+Observed("log_records_dropped_total", "Log records dropped because the log queue was full", "counter",
+         _log_dropped)
+
+
+@contextmanager
+def trade_timer():
+    # total time of a trade request, and the part of it spent in statements
+    # run from this task
+    timer = [0.0]
+    token = statement_time.set(timer)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        statement_time.reset(token)
+        trade_latency.observe(time.perf_counter() - started, "total")
+        # engine-mode requests run no statements of their own: account loads
+        # happen in the engine's drain task, which starts from a fresh context,
+        # and the fills' database time is in the group commit
+        if timer[0]:
+            trade_latency.observe(timer[0], "db")
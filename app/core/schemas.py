@@ -1,15 +1,16 @@
 from pydantic import BaseModel, Field, field_validator
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
+from .symbols import symbol_universe
+
 class TradeSide(str, Enum):
     BUY = "buy"
     SELL = "sell"
 
-class Symbol(str, Enum):
-    GOLD = "GOLD"
-    SILVER = "SILVER"
+# GOLD and SILVER are always present; the rest comes from the configured universe
+Symbol = Enum("Symbol", {symbol: symbol for symbol in symbol_universe.symbols}, type=str)
 
 class UserCreate(BaseModel):
     username: str = Field(..., min_length=3, max_length=50)
@@ -46,6 +47,41 @@ class TradeCreate(BaseModel):
             raise ValueError('Quantity too large')
         return round(v, 4)
 
+class BatchTradeCreate(BaseModel):
+    orders: List[TradeCreate] = Field(..., min_length=1, max_length=100)
+    # when false, orders that fail validation are skipped and the rest are filled
+    all_or_nothing: bool = True
+
+class OrderType(str, Enum):
+    LIMIT = "limit"
+    STOP = "stop"
+
+class OrderStatus(str, Enum):
+    OPEN = "open"
+    TRIGGERED = "triggered"
+    FILLED = "filled"
+    REJECTED = "rejected"
+    CANCELLED = "cancelled"
+
+class OrderCreate(TradeCreate):
+    order_type: OrderType
+    trigger_price: float = Field(..., gt=0)
+
+class OrderResponse(BaseModel):
+    id: int
+    symbol: str
+    side: str
+    order_type: str
+    quantity: float
+    trigger_price: float
+    status: str
+    reason: Optional[str] = None
+    trade_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
 class TradeResponse(BaseModel):
     id: int
     symbol: str
@@ -58,6 +94,10 @@ class TradeResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
 class PositionResponse(BaseModel):
     symbol: str
     quantity: float
@@ -68,11 +108,58 @@ class PositionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SymbolPnlResponse(BaseModel):
+    symbol: str
+    quantity: float
+    cost_basis: float
+    current_price: Optional[float] = None
+    realized_pnl: float
+    unrealized_pnl: float
+    total_pnl: float
+
+class PnlResponse(BaseModel):
+    realized_pnl: float
+    unrealized_pnl: float
+    total_pnl: float
+    symbols: List[SymbolPnlResponse]
+
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    username: Optional[str] = None
+    equity: float
+
+class LeaderboardResponse(BaseModel):
+    updated_at: Optional[datetime] = None
+    accounts: int
+    entries: List[LeaderboardEntry]
+
 class PriceData(BaseModel):
     GOLD: float
     SILVER: float
     timestamp: str
 
+    class Config:
+        extra = "allow"
+
+class CandleInterval(str, Enum):
+    ONE_SECOND = "1s"
+    ONE_MINUTE = "1m"
+    FIVE_MINUTES = "5m"
+
+class CandleData(BaseModel):
+    timestamp: datetime
+    open: float
+    high: float
+    low: float
+    close: float
+    ticks: int
+
+class PriceHistoryResponse(BaseModel):
+    symbol: str
+    interval: CandleInterval
+    candles: list[CandleData]
+
 class APIResponse(BaseModel):
     success: bool
     message: str
@@ -0,0 +1,72 @@
+import json
+import random
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from .config import settings
+
+
+class Instrument(BaseModel):
+    symbol: str = Field(..., min_length=1, max_length=10)
+    price: float = Field(..., gt=0)
+    # drift and volatility of log returns, per simulation tick
+    drift: float = 0.0
+    volatility: float = Field(0.00115, ge=0)
+
+
+class SymbolUniverse(BaseModel):
+    instruments: list[Instrument]
+    correlations: list[tuple[str, str, float]] = []
+
+    @property
+    def symbols(self) -> list[str]:
+        return [instrument.symbol for instrument in self.instruments]
+
+
+DEFAULT_UNIVERSE = SymbolUniverse(
+    instruments=[
+        Instrument(symbol="GOLD", price=2650.00, volatility=0.00115),
+        Instrument(symbol="SILVER", price=32.00, volatility=0.0015),
+    ],
+    correlations=[("GOLD", "SILVER", 0.8)],
+)
+
+
+def load_symbol_universe(path: Optional[str] = None, synthetic_count: Optional[int] = None) -> SymbolUniverse:
+    path = path if path is not None else settings.symbol_universe_path
+    synthetic_count = synthetic_count if synthetic_count is not None else settings.synthetic_symbol_count
+
+    if path:
+        with open(path) as f:
+            universe = SymbolUniverse(**json.load(f))
+    else:
+        universe = DEFAULT_UNIVERSE.model_copy(deep=True)
+
+    # GOLD and SILVER are fed from CoinGecko and must always be tradable
+    known = set(universe.symbols)
+    for instrument in DEFAULT_UNIVERSE.instruments:
+        if instrument.symbol not in known:
+            universe.instruments.append(instrument)
+
+    rng = random.Random(settings.synthetic_symbol_seed)
+    for i in range(synthetic_count):
+        universe.instruments.append(Instrument(
+            symbol=f"SYN{i:04d}",
+            price=round(rng.uniform(5, 500), 2),
+            volatility=rng.uniform(0.0005, 0.003),
+        ))
+
+    symbols = universe.symbols
+    if len(set(symbols)) != len(symbols):
+        raise ValueError("Duplicate symbols in symbol universe")
+    for a, b, rho in universe.correlations:
+        if a not in symbols or b not in symbols:
+            raise ValueError(f"Correlation references unknown symbol: {a}/{b}")
+        if not -1 <= rho <= 1:
+            raise ValueError(f"Correlation for {a}/{b} out of range: {rho}")
+
+    return universe
+
+
+symbol_universe = load_symbol_universe()
@@ -1,5 +1,9 @@
 from .user import User
 from .trade import Trade
 from .position import Position
+from .order import Order
+from .journal import JournalCheckpoint
+from .lot import Lot
+from .pnl_summary import PnlSummary
 
-__all__ = ["User", "Trade", "Position"]
+__all__ = ["User", "Trade", "Position", "Order", "JournalCheckpoint", "Lot", "PnlSummary"]
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, BigInteger
+from ..core.database import Base
+
+class JournalCheckpoint(Base):
+    __tablename__ = "journal_checkpoints"
+    
+    # highest journal sequence whose fill is in the trades/positions tables;
+    # updated in the same transaction as the rows it covers
+    name = Column(String(50), primary_key=True)
+    seq = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<JournalCheckpoint(name={self.name}, seq={self.seq})>"
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from ..core.database import Base
+
+class Lot(Base):
+    __tablename__ = "lots"
+    
+    # an open slice of a position bought at one price; sells consume lots
+    # oldest first (FIFO) and exhausted lots are deleted
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String(10), nullable=False)
+    quantity = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    user = relationship("User", back_populates="lots")
+
+    __table_args__ = (
+        Index('idx_lot_user_symbol', 'user_id', 'symbol', 'id'),
+    )
+
+    def __repr__(self):
+        return f"<Lot(user_id={self.user_id}, symbol={self.symbol}, quantity={self.quantity}, price={self.price})>"
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship
+from datetime import datetime
+from ..core.database import Base
+
+class Order(Base):
+    __tablename__ = "orders"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String(10), nullable=False)
+    side = Column(String(4), nullable=False)
+    order_type = Column(String(5), nullable=False)
+    quantity = Column(Float, nullable=False)
+    trigger_price = Column(Float, nullable=False)
+    # open -> triggered -> filled | rejected, or open -> cancelled
+    status = Column(String(10), default="open", nullable=False)
+    reason = Column(String(100))
+    trade_id = Column(Integer, ForeignKey("trades.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    user = relationship("User", back_populates="orders")
+
+    __table_args__ = (
+        Index('idx_order_status', 'status'),
+        Index('idx_order_user_status', 'user_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f"<Order(user_id={self.user_id}, symbol={self.symbol}, {self.order_type} {self.side} @ {self.trigger_price})>"
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import relationship
+from ..core.database import Base
+
+class PnlSummary(Base):
+    __tablename__ = "pnl_summaries"
+    
+    # kept up to date by every fill, so reports never replay trades
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String(10), nullable=False)
+    realized_pnl = Column(Float, default=0.0, nullable=False)
+    # total cost of the open lots
+    cost_basis = Column(Float, default=0.0, nullable=False)
+    
+    user = relationship("User", back_populates="pnl_summaries")
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'symbol', name='uq_pnl_user_symbol'),
+    )
+
+    def __repr__(self):
+        return f"<PnlSummary(user_id={self.user_id}, symbol={self.symbol}, realized_pnl={self.realized_pnl})>"
@@ -16,6 +16,9 @@ class User(Base):
     
     trades = relationship("Trade", back_populates="user", cascade="all, delete-orphan")
     positions = relationship("Position", back_populates="user", cascade="all, delete-orphan")
+    orders = relationship("Order", back_populates="user", cascade="all, delete-orphan")
+    lots = relationship("Lot", back_populates="user", cascade="all, delete-orphan")
+    pnl_summaries = relationship("PnlSummary", back_populates="user", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<User(username={self.username}, balance={self.balance})>"
@@ -1,32 +1,32 @@
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..core.database import get_db
+from ..core.database import get_async_db
 from ..core.auth import AuthService, get_current_user
 from ..core.schemas import UserCreate, UserLogin, Token, UserResponse, APIResponse
 from ..models import User
+from ..services.leaderboard_service import leaderboard_service
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 @router.post("/register", response_model=Token)
-async def register(request: Request, user_data: UserCreate, db: Session = Depends(get_db)):
-    import logging
-    logger = logging.getLogger(__name__)
+async def register(request: Request, user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Register attempt", extra={"username": user_data.username, "client": request.client.host})
     
-    logger.info(f"Register request from: {request.client.host}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    logger.info(f"Register attempt: username={user_data.username}, password_len={len(user_data.password)}")
-    
-    existing_user = db.query(User).filter(User.username == user_data.username).first()
+    existing_user = await AuthService.get_user_by_username(db, user_data.username)
     if existing_user:
-        logger.warning(f"Registration failed: username {user_data.username} already exists")
+        logger.warning("Registration failed: username %s already exists", user_data.username)
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
     
-    hashed_password = AuthService.get_password_hash(user_data.password)
+    hashed_password = await AuthService.get_password_hash_async(user_data.password)
     user = User(
         username=user_data.username,
         hashed_password=hashed_password,
@@ -34,24 +34,20 @@ async def register(request: Request, user_data: UserCreate, db: Session = Depend
     )
     
     db.add(user)
-    db.commit()
+    await db.commit()
+    leaderboard_service.add_account(user.id, user.balance)
     
-    access_token = AuthService.create_access_token(data={"sub": user.username})
+    access_token = AuthService.create_user_token(user)
     
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/login", response_model=Token)
-async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    logger.info(f"Login request from: {request.client.host}")
-    logger.info(f"Headers: {dict(request.headers)}")
-    logger.info(f"Login attempt: username={form_data.username}, password_len={len(form_data.password)}")
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    logger.info("Login attempt", extra={"username": form_data.username, "client": request.client.host})
     
-    user = AuthService.authenticate_user(db, form_data.username, form_data.password)
+    user = await AuthService.authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
-        logger.warning(f"Login failed: incorrect credentials for {form_data.username}")
+        logger.warning("Login failed: incorrect credentials for %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -64,7 +60,7 @@ async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends
             detail="Inactive user"
         )
     
-    access_token = AuthService.create_access_token(data={"sub": user.username})
+    access_token = AuthService.create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserResponse)
@@ -73,5 +69,5 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 @router.post("/refresh", response_model=Token)
 async def refresh_token(current_user: User = Depends(get_current_user)):
-    access_token = AuthService.create_access_token(data={"sub": current_user.username})
+    access_token = AuthService.create_user_token(current_user)
     return {"access_token": access_token, "token_type": "bearer"}
@@ -0,0 +1,18 @@
+from fastapi import APIRouter
+
+from ..core.schemas import LeaderboardResponse
+from ..services.leaderboard_service import leaderboard_service
+
+router = APIRouter(prefix="/leaderboard", tags=["Leaderboard"])
+
+@router.get("", response_model=LeaderboardResponse)
+async def get_leaderboard(limit: int = 100):
+    # served from the last ranking pass; never touches the database
+    if limit < 1:
+        limit = 1
+    
+    return LeaderboardResponse(
+        updated_at=leaderboard_service.updated_at,
+        accounts=leaderboard_service.book.accounts,
+        entries=leaderboard_service.entries[:limit]
+    )
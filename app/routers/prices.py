@@ -1,20 +1,36 @@
-from fastapi import APIRouter
-from ..core.schemas import PriceData
-from ..services.price_service import price_service
+from fastapi import APIRouter, Depends
+from ..core.schemas import PriceData, PriceHistoryResponse, CandleInterval, Symbol
+from ..services.price_provider import PriceProvider
+from ..services.price_service import get_price_provider, CANDLE_INTERVALS
 
 router = APIRouter(prefix="/prices", tags=["Prices"])
 
 @router.get("/current", response_model=PriceData)
-async def get_current_prices():
-    prices = price_service.get_all_prices()
+async def get_current_prices(price_provider: PriceProvider = Depends(get_price_provider)):
+    prices = price_provider.get_all_prices()
     return PriceData(**prices)
 
 @router.get("/gold")
-async def get_gold_price():
-    price = price_service.get_current_price("GOLD")
+async def get_gold_price(price_provider: PriceProvider = Depends(get_price_provider)):
+    price = price_provider.get_current_price("GOLD")
     return {"symbol": "GOLD", "price": price}
 
 @router.get("/silver")
-async def get_silver_price():
-    price = price_service.get_current_price("SILVER")
+async def get_silver_price(price_provider: PriceProvider = Depends(get_price_provider)):
+    price = price_provider.get_current_price("SILVER")
     return {"symbol": "SILVER", "price": price}
+
+@router.get("/history", response_model=PriceHistoryResponse)
+async def get_price_history(
+    symbol: Symbol,
+    interval: CandleInterval = CandleInterval.ONE_MINUTE,
+    limit: int = 100,
+    price_provider: PriceProvider = Depends(get_price_provider)
+):
+    if limit > 1000:
+        limit = 1000
+    if limit < 1:
+        limit = 1
+    
+    candles = price_provider.get_candles(symbol.value, CANDLE_INTERVALS[interval.value], limit)
+    return PriceHistoryResponse(symbol=symbol.value, interval=interval, candles=candles)
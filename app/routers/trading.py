@@ -1,13 +1,27 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import csv
+import io
+import json
+from contextlib import aclosing
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..core.database import get_db
-from ..core.auth import get_current_user
-from ..core.schemas import TradeCreate, TradeResponse, PositionResponse, APIResponse
-from ..models import User
-from ..services.trading_service import TradingService
-from ..services.price_service import price_service
+from ..core.config import settings
+from ..core.database import get_async_db, read_session
+from ..core.auth import get_current_user, get_read_db, load_user
+from ..core.metrics import trade_timer
+from ..core.schemas import (
+    TradeCreate, BatchTradeCreate, OrderCreate, OrderResponse, OrderStatus, TradeResponse,
+    PositionResponse, PnlResponse, APIResponse, ExportFormat
+)
+from ..models import User, Trade, Position
+from ..services.trading_service import AsyncTradingService, encode_cursor, decode_cursor
+from ..services.execution_engine import execution_engine
+from ..services.order_service import order_service
+from ..services.pnl_service import get_user_pnl
+from ..services.price_provider import PriceProvider
+from ..services.price_service import get_price_provider
 
 router = APIRouter(prefix="/trading", tags=["Trading"])
 
@@ -15,11 +29,16 @@ router = APIRouter(prefix="/trading", tags=["Trading"])
 async def execute_trade(
     trade_data: TradeCreate,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    price_provider: PriceProvider = Depends(get_price_provider)
 ):
     try:
-        trading_service = TradingService(db)
-        trade = trading_service.execute_trade(current_user, trade_data)
+        with trade_timer():
+            if settings.execution_engine_enabled:
+                trade = await execution_engine.submit(current_user, trade_data)
+            else:
+                trading_service = AsyncTradingService(db, price_provider)
+                trade = await trading_service.execute_trade(await load_user(db, current_user), trade_data)
         
         return APIResponse(
             success=True,
@@ -42,17 +61,100 @@ async def execute_trade(
             detail=f"Trade execution failed: {str(e)}"
         )
 
+@router.post("/trades/batch", response_model=APIResponse)
+async def execute_trade_batch(
+    batch: BatchTradeCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    price_provider: PriceProvider = Depends(get_price_provider)
+):
+    try:
+        with trade_timer():
+            if settings.execution_engine_enabled:
+                results = await execution_engine.submit_batch(current_user, batch.orders, batch.all_or_nothing)
+            else:
+                trading_service = AsyncTradingService(db, price_provider)
+                results = await trading_service.execute_batch(
+                    await load_user(db, current_user), batch.orders, batch.all_or_nothing
+                )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Batch execution failed: {str(e)}"
+        )
+
+    orders = []
+    for index, (trade, error) in enumerate(results):
+        if trade is None:
+            orders.append({"index": index, "success": False, "error": error})
+            continue
+        orders.append({
+            "index": index,
+            "success": True,
+            "trade_id": trade.id,
+            "symbol": trade.symbol,
+            "side": trade.side,
+            "quantity": trade.quantity,
+            "price": trade.price,
+            "total_amount": trade.total_amount
+        })
+
+    executed = sum(1 for order in orders if order["success"])
+    return APIResponse(
+        success=executed == len(orders),
+        message=f"{executed} of {len(orders)} trades executed",
+        data={"executed": executed, "orders": orders}
+    )
+
+@router.post("/orders", response_model=OrderResponse)
+async def place_order(
+    order_data: OrderCreate,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    order = await order_service.place(db, current_user, order_data)
+    return OrderResponse.from_orm(order)
+
+@router.get("/orders", response_model=List[OrderResponse])
+async def get_orders(
+    status: Optional[OrderStatus] = None,
+    limit: int = Query(50, ge=1, le=100),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    orders = await order_service.get_user_orders(db, current_user, status, limit)
+    return [OrderResponse.from_orm(order) for order in orders]
+
+@router.delete("/orders/{order_id}", response_model=OrderResponse)
+async def cancel_order(
+    order_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    order = await order_service.cancel(db, current_user, order_id)
+    return OrderResponse.from_orm(order)
+
 @router.get("/positions", response_model=List[PositionResponse])
 async def get_positions(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    price_provider: PriceProvider = Depends(get_price_provider)
 ):
-    trading_service = TradingService(db)
-    positions = trading_service.get_user_positions(current_user)
+    account = execution_engine.get_account(current_user.id) if settings.execution_engine_enabled else None
+    if account is not None:
+        positions = [
+            Position(symbol=symbol, quantity=quantity, avg_price=avg_price)
+            for symbol, (quantity, avg_price) in account.positions.items()
+        ]
+    else:
+        trading_service = AsyncTradingService(db, price_provider)
+        positions = await trading_service.get_user_positions(current_user)
     
     result = []
     for position in positions:
-        current_price = price_service.get_current_price(position.symbol)
+        current_price = price_provider.get_current_price(position.symbol)
         pnl = position.calculate_pnl(current_price) if current_price else 0
         
         result.append(PositionResponse(
@@ -65,23 +167,82 @@ async def get_positions(
     
     return result
 
+@router.get("/pnl", response_model=PnlResponse)
+async def get_pnl(
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db),
+    price_provider: PriceProvider = Depends(get_price_provider)
+):
+    return PnlResponse(**await get_user_pnl(db, current_user, price_provider))
+
 @router.get("/trades", response_model=List[TradeResponse])
 async def get_trade_history(
-    limit: int = 50,
+    response: Response,
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    price_provider: PriceProvider = Depends(get_price_provider)
 ):
-    if limit > 100:
-        limit = 100
-    
-    trading_service = TradingService(db)
-    trades = trading_service.get_user_trades(current_user, limit)
+    before = decode_cursor(cursor) if cursor else None
+    trading_service = AsyncTradingService(db, price_provider)
+    trades = await trading_service.get_user_trades(current_user, limit, before)
     
+    # the body stays a plain list; the next page is requested with ?cursor=
+    if len(trades) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(trades[-1])
     return [TradeResponse.from_orm(trade) for trade in trades]
 
+EXPORT_FIELDS = ["id", "symbol", "side", "quantity", "price", "total_amount", "timestamp"]
+
+def _export_row(trade: Trade) -> dict:
+    return {
+        "id": trade.id,
+        "symbol": trade.symbol,
+        "side": trade.side,
+        "quantity": trade.quantity,
+        "price": trade.price,
+        "total_amount": trade.total_amount,
+        "timestamp": trade.timestamp.isoformat() if trade.timestamp else None
+    }
+
+@router.get("/trades/export")
+async def export_trades(
+    format: ExportFormat = ExportFormat.NDJSON,
+    current_user: User = Depends(get_current_user)
+):
+    user_id = current_user.id
+
+    async def chunks():
+        # the stream outlives the request's session, so it opens its own
+        async with read_session(user_id) as db:
+            if format == ExportFormat.CSV:
+                yield ",".join(EXPORT_FIELDS) + "\n"
+            # closed here rather than whenever it is collected if the client
+            # disconnects, which releases the archive files it reads
+            async with aclosing(AsyncTradingService(db).stream_user_trades(user_id)) as stream:
+                async for trades in stream:
+                    buffer = io.StringIO()
+                    if format == ExportFormat.CSV:
+                        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+                        writer.writerows(_export_row(trade) for trade in trades)
+                    else:
+                        for trade in trades:
+                            buffer.write(json.dumps(_export_row(trade)))
+                            buffer.write("\n")
+                    yield buffer.getvalue()
+
+    media_type = "text/csv" if format == ExportFormat.CSV else "application/x-ndjson"
+    return StreamingResponse(
+        chunks(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=trades.{format.value}"}
+    )
+
 @router.get("/balance")
 async def get_balance(current_user: User = Depends(get_current_user)):
+    account = execution_engine.get_account(current_user.id) if settings.execution_engine_enabled else None
     return {
-        "balance": current_user.balance,
+        "balance": account.balance if account is not None else current_user.balance,
         "username": current_user.username
     }
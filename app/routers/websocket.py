@@ -1,23 +1,103 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from typing import Optional
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, status
+from sqlalchemy import select
+import json
 import logging
 
-from ..services.websocket_service import websocket_manager
+from ..core.auth import AuthService
+from ..core.database import AsyncSessionLocal
+from ..models import Position
+from ..services.leaderboard_service import leaderboard_service
+from ..services.portfolio_service import portfolio_service
+from ..services.websocket_service import websocket_manager, ENCODINGS, WILDCARD
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["WebSocket"])
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket_manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, encoding: str = "json", symbols: Optional[str] = None):
+    # encoding is fixed for the lifetime of the connection; msgpack frames are
+    # sent as binary messages, control messages from the client stay JSON text
+    if encoding not in ENCODINGS:
+        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+        return
+    
+    initial_symbols = symbols.split(",") if symbols else [WILDCARD]
+    await websocket_manager.connect(websocket, encoding=encoding, symbols=initial_symbols)
     try:
         while True:
             data = await websocket.receive_text()
-            logger.debug(f"Received WebSocket message: {data}")
+            logger.debug("Received WebSocket message: %s", data)
+            
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if not isinstance(message, dict):
+                continue
+            
+            message_type = message.get("type")
+            requested = message.get("symbols") or []
+            if not isinstance(requested, list):
+                continue
+            
+            if message_type == "subscribe":
+                await websocket_manager.subscribe(websocket, [str(symbol) for symbol in requested])
+            elif message_type == "unsubscribe":
+                await websocket_manager.unsubscribe(websocket, [str(symbol) for symbol in requested])
+            elif message_type == "resync":
+                # clients that see a gap in "seq" ask for a fresh snapshot
+                await websocket_manager.resync(websocket)
             
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket)
-        logger.info("WebSocket client disconnected")
+        logger.debug("WebSocket client disconnected")
     except Exception as e:
-        logger.error(f"WebSocket error: {e}")
+        logger.error("WebSocket error: %s", e)
         websocket_manager.disconnect(websocket)
+
+@router.websocket("/ws/user")
+async def user_websocket_endpoint(websocket: WebSocket, token: str):
+    # browsers cannot set headers on WebSocket requests, so the JWT comes in
+    # as ?token=; the user and positions are loaded once, then kept in memory
+    try:
+        username = AuthService.verify_token(token)
+    except HTTPException:
+        username = None
+    
+    async with AsyncSessionLocal() as db:
+        user = await AuthService.get_user_by_username(db, username) if username else None
+        if user is None or not user.is_active:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        result = await db.execute(select(Position).where(Position.user_id == user.id))
+        positions = result.scalars().all()
+        user_id = user.id
+    
+    await portfolio_service.attach(websocket, user, positions)
+    
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.debug("Private WebSocket client disconnected")
+    except Exception as e:
+        logger.error("Private WebSocket error: %s", e)
+    finally:
+        portfolio_service.detach(websocket, user_id)
+
+@router.websocket("/ws/leaderboard")
+async def leaderboard_websocket_endpoint(websocket: WebSocket):
+    # receives the current ranking on connect and after every ranking pass
+    await leaderboard_service.attach(websocket)
+    
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        logger.debug("Leaderboard WebSocket client disconnected")
+    except Exception as e:
+        logger.error("Leaderboard WebSocket error: %s", e)
+    finally:
+        leaderboard_service.detach(websocket)
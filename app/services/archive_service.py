@@ -0,0 +1,166 @@
+import asyncio
+import fcntl
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import select, delete, func
+
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal
+from ..models import Trade, Order
+from .trade_archive import CHUNK_ROWS, RESCAN_INTERVAL, TradeArchive, month_end, to_micros
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH = 1000
+LOCK_NAME = ".archiver.lock"
+
+
+class TradeArchiver:
+    # moves whole months of trades older than trade_archive_after_days out of
+    # the table and into the archive, oldest month first. Every worker runs the
+    # loop; a pass only goes ahead under an flock on LOCK_NAME in the archive
+    # directory, so one worker archives at a time and another takes over if
+    # it dies
+
+    def __init__(self, archive: TradeArchive, session_factory=None):
+        self.archive = archive
+        self.session_factory = session_factory or AsyncSessionLocal
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._archive_loop())
+        logger.info("Trade archiver started for %s", self.archive.directory)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _try_lock(self) -> Optional[int]:
+        os.makedirs(self.archive.directory, exist_ok=True)
+        fd = os.open(os.path.join(self.archive.directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    async def run_once(self) -> int:
+        fd = self._try_lock()
+        if fd is None:
+            return 0
+        try:
+            return await self._archive_due()
+        finally:
+            os.close(fd)
+
+    async def _archive_due(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(days=settings.trade_archive_after_days)
+        archived = 0
+        while True:
+            boundary = self.archive.boundary
+            async with self.session_factory() as db:
+                query = select(func.min(Trade.timestamp))
+                if boundary is not None:
+                    query = query.where(Trade.timestamp >= boundary)
+                oldest = (await db.execute(query)).scalar()
+            if oldest is None:
+                break
+            start = datetime(oldest.year, oldest.month, 1)
+            end = month_end(start)
+            if end > cutoff:
+                break
+            archived += await self._archive_month(start, end)
+        return archived
+
+    async def _archive_month(self, start: datetime, end: datetime) -> int:
+        # rows come off a server-side cursor in file order and go to the writer
+        # a chunk at a time, so a month is never held in memory whole
+        writer = await asyncio.to_thread(self.archive.month_writer, start)
+        archived = 0
+        try:
+            async with self.session_factory() as db:
+                result = await db.stream(
+                    select(
+                        Trade.id, Trade.user_id, Trade.timestamp, Trade.symbol, Trade.side,
+                        Trade.quantity, Trade.price, Trade.total_amount
+                    )
+                    .where(Trade.timestamp >= start, Trade.timestamp < end)
+                    .order_by(Trade.user_id, Trade.timestamp, Trade.id)
+                    .execution_options(yield_per=CHUNK_ROWS)
+                )
+                async for rows in result.partitions():
+                    ids, user_ids, timestamps, symbols, sides, quantities, prices, totals = zip(*rows)
+                    archived += len(ids)
+                    columns = {
+                        "id": np.array(ids, dtype=np.int64),
+                        "user_id": np.array(user_ids, dtype=np.int64),
+                        "timestamp": to_micros(list(timestamps)),
+                        "symbol": np.array(symbols, dtype=object),
+                        "side": np.array(sides, dtype=object),
+                        "quantity": np.array(quantities, dtype=np.float64),
+                        "price": np.array(prices, dtype=np.float64),
+                        "total_amount": np.array(totals, dtype=np.float64),
+                    }
+                    # compressing is CPU work, kept off the event loop
+                    await asyncio.to_thread(writer.append, columns)
+        except BaseException:
+            writer.abort()
+            raise
+        await asyncio.to_thread(writer.commit)
+
+        # from here on reads take the month from the file, so the rows can go
+        # once every worker has rescanned the directory and moved its boundary
+        await asyncio.sleep(RESCAN_INTERVAL)
+        deleted = await self._delete_before(end)
+        logger.info("Archived %d trades for %s, %d deleted", archived, start.strftime("%Y-%m"), deleted)
+        return archived
+
+    async def _delete_before(self, end: datetime) -> int:
+        # two kinds of archived rows stay in the table, hidden from reads by
+        # the archive boundary: the newest trade, so an autoincrement that
+        # derives from max(id) never hands out an archived id again, and
+        # trades still referenced by orders.trade_id. Both are retried on the
+        # next pass
+        async with self.session_factory() as db:
+            newest = (await db.execute(select(func.max(Trade.id)))).scalar()
+            referenced = set((await db.execute(
+                select(Order.trade_id)
+                .join(Trade, Trade.id == Order.trade_id)
+                .where(Trade.timestamp < end)
+            )).scalars())
+            stale = [
+                trade_id for trade_id in (await db.execute(select(Trade.id).where(Trade.timestamp < end))).scalars()
+                if trade_id != newest and trade_id not in referenced
+            ]
+            # short transactions, so trades keep flowing while a month is cleared
+            for start in range(0, len(stale), DELETE_BATCH):
+                await db.execute(delete(Trade).where(Trade.id.in_(stale[start:start + DELETE_BATCH])))
+                await db.commit()
+        return len(stale)
+
+    async def _archive_loop(self):
+        while True:
+            try:
+                await self.run_once()
+                await asyncio.sleep(settings.trade_archive_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("Error archiving trades: %s", e)
+                await asyncio.sleep(settings.trade_archive_interval)
+
+
+trade_archive = TradeArchive(settings.trade_archive_dir) if settings.trade_archive_dir else None
+trade_archiver = TradeArchiver(trade_archive) if trade_archive else None
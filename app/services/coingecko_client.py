@@ -0,0 +1,149 @@
+import asyncio
+import time
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from ..core.config import settings
+from ..core.metrics import upstream_errors, upstream_latency
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamUnavailableError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, max_reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.current_timeout:
+            return "half-open"
+        return "open"
+
+    @property
+    def current_timeout(self) -> float:
+        # each consecutive trip doubles the cool-down
+        return min(self.reset_timeout * (2 ** max(self.trips - 1, 0)), self.max_reset_timeout)
+
+    def allow_request(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.trips += 1
+            self.opened_at = time.monotonic()
+            logger.warning("Upstream circuit opened for %.1fs", self.current_timeout)
+
+
+class CoinGeckoClient:
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        max_connections: int = 4,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url or settings.coingecko_api_url
+        self.timeout = timeout if timeout is not None else settings.coingecko_timeout
+        self.max_retries = max_retries if max_retries is not None else settings.coingecko_max_retries
+        self.backoff_base = backoff_base if backoff_base is not None else settings.coingecko_backoff_base
+        self.max_connections = max_connections
+        self.transport = transport
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.coingecko_breaker_threshold,
+            reset_timeout=settings.coingecko_breaker_reset,
+            max_reset_timeout=settings.coingecko_breaker_max_reset,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=self.transport,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def fetch_prices(self, coin_ids: Iterable[str], vs_currency: str = "usd") -> Dict[str, float]:
+        # one request covers every coin, so latency is per request and
+        # errors are counted against each coin the refresh failed to price
+        coin_ids = list(dict.fromkeys(coin_ids))
+        if not self.breaker.allow_request():
+            for coin_id in coin_ids:
+                upstream_errors.inc(coin_id, "circuit_open")
+            raise CircuitOpenError("CoinGecko circuit is open")
+
+        started = time.perf_counter()
+        try:
+            quotes = await self._fetch(coin_ids, vs_currency)
+        except UpstreamUnavailableError:
+            upstream_latency.observe(time.perf_counter() - started, "error")
+            for coin_id in coin_ids:
+                upstream_errors.inc(coin_id, "unavailable")
+            raise
+        upstream_latency.observe(time.perf_counter() - started, "ok")
+        for coin_id in coin_ids:
+            if coin_id not in quotes:
+                upstream_errors.inc(coin_id, "missing")
+        return quotes
+
+    async def _fetch(self, coin_ids: List[str], vs_currency: str) -> Dict[str, float]:
+        params = {"ids": ",".join(coin_ids), "vs_currencies": vs_currency}
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_base * (2 ** (attempt - 1)))
+            try:
+                response = await self._get_client().get(self.base_url, params=params)
+                if response.status_code == 200:
+                    data = response.json()
+                    self.breaker.record_success()
+                    return {
+                        coin_id: float(quote[vs_currency])
+                        for coin_id, quote in data.items()
+                        if isinstance(quote, dict) and vs_currency in quote
+                    }
+                last_error = UpstreamUnavailableError(f"CoinGecko API returned status {response.status_code}")
+                if response.status_code < 500 and response.status_code != 429:
+                    break
+            except (httpx.HTTPError, ValueError) as e:
+                last_error = e
+
+        self.breaker.record_failure()
+        raise UpstreamUnavailableError(f"CoinGecko request failed: {last_error}")
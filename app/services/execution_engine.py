@@ -0,0 +1,454 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, update, delete, func
+
+from ..core.config import settings
+from ..core.auth import principal_cache
+from ..core.database import AsyncSessionLocal, read_router
+from ..core.metrics import trade_latency
+from ..core.schemas import OrderStatus, TradeCreate
+from ..models import User, Trade, Position, Order, JournalCheckpoint
+from .price_provider import PriceProvider
+from .price_service import get_price_provider
+from .archive_service import trade_archive
+from .trade_journal import JournalEntry, TradeJournal
+from .pnl_service import record_fills
+from .trading_service import fill_order, new_trade, publish_fill, require_price
+
+logger = logging.getLogger(__name__)
+
+
+class OrderRequest:
+    # one submission: a single order or a whole batch, resolved after commit.
+    # order_ids, when set, are the resting orders the trades fill, one per trade
+
+    __slots__ = ("orders", "all_or_nothing", "future", "results", "order_ids")
+
+    def __init__(self, orders: List[TradeCreate], all_or_nothing: bool, future: asyncio.Future,
+                 order_ids: Optional[List[int]] = None):
+        self.orders = orders
+        self.all_or_nothing = all_or_nothing
+        self.future = future
+        self.results: List[Tuple[Optional[Trade], Optional[str]]] = []
+        self.order_ids = order_ids
+
+
+class AccountState:
+    # authoritative in-memory copy of one account while the engine owns it
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.balance = 0.0
+        # symbol -> [quantity, avg_price]
+        self.positions: Dict[str, List[float]] = {}
+        self.loaded = False
+        self.requests: Deque[OrderRequest] = deque()
+        self.task: Optional[asyncio.Task] = None
+
+
+class Fill:
+
+    __slots__ = ("account", "trade", "request", "balance", "quantity", "avg_price")
+
+    def __init__(self, account: AccountState, trade: Trade, request: OrderRequest):
+        self.account = account
+        self.trade = trade
+        self.request = request
+        position = account.positions.get(trade.symbol)
+        self.balance = account.balance
+        self.quantity = position[0] if position else 0.0
+        self.avg_price = position[1] if position else 0.0
+
+
+class ExecutionEngine:
+    # orders are applied one at a time per account against in-memory state, so
+    # concurrent orders from one account can never both spend the same balance.
+    # Fills are acknowledged once durable: after the group commit that writes
+    # them or, in journal mode, after the fsync of the journal batch holding
+    # them, with the database catching up in the background. Fills of resting
+    # orders skip the journal and are committed together with the order
+    # status, so orders.trade_id never points at a trade not yet written.
+    # The engine assigns trade ids itself, so it must be the only writer of
+    # trades.
+
+    def __init__(self, price_provider: Optional[PriceProvider] = None, session_factory=None,
+                 journal_path: Optional[str] = None):
+        self.price_provider = price_provider or get_price_provider()
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.journal_path = journal_path if journal_path is not None else settings.trade_journal_path
+        self.journal: Optional[TradeJournal] = None
+        self._accounts: Dict[int, AccountState] = {}
+        self._pending: List[Fill] = []
+        self._wakeup = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._seq = 0
+        self._next_trade_id = 1
+        # journaled but not yet in the database, oldest first
+        self._unpersisted: List[JournalEntry] = []
+        self._journal_lock = asyncio.Lock()
+        # held while copying into the database, so journaled fills and
+        # directly committed ones reach it in seq order
+        self._persist_lock = asyncio.Lock()
+        # set each time the writer catches up on a part of _unpersisted
+        self._caught_up = asyncio.Event()
+        self._writer_wakeup = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._flush_task and not self._flush_task.done():
+            return
+
+        if self.journal_path:
+            self.journal = TradeJournal(self.journal_path)
+            await self._replay()
+            self._writer_task = asyncio.create_task(self._write_behind_loop())
+
+        async with self.session_factory() as db:
+            self._next_trade_id = ((await db.execute(select(func.max(Trade.id)))).scalar() or 0) + 1
+        if trade_archive:
+            self._next_trade_id = max(self._next_trade_id, trade_archive.max_id + 1)
+
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        logger.info("Execution engine started")
+
+    async def stop(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self._flush()
+
+        if self._writer_task:
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+            self._writer_task = None
+            try:
+                await self._write_behind()
+            except Exception as e:
+                logger.warning("%d journaled fills left for replay: %s", len(self._unpersisted), e)
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        logger.info("Execution engine stopped")
+
+    async def _replay(self):
+        entries = self.journal.read()
+        async with self.session_factory() as db:
+            checkpoint = await db.get(JournalCheckpoint, "trades")
+        persisted = checkpoint.seq if checkpoint else 0
+
+        pending = [entry for entry in entries if entry.seq > persisted]
+        if pending:
+            await self._persist(pending)
+            logger.info("Replayed %d journaled fills into the database", len(pending))
+        self._seq = max([persisted] + [entry.seq for entry in entries])
+        self.journal.reset()
+
+    async def submit(self, user: User, trade_data: TradeCreate) -> Trade:
+        [(trade, error)] = await self.submit_batch(user, [trade_data])
+        if error:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+        return trade
+
+    async def submit_batch(
+        self, user: User, orders: List[TradeCreate], all_or_nothing: bool = True,
+        order_ids: Optional[List[int]] = None
+    ) -> List[Tuple[Optional[Trade], Optional[str]]]:
+        # with order_ids, the orders' status is written in the commit holding
+        # their fills; orders with no fill at all are left to the caller
+        account = self._accounts.get(user.id)
+        if account is None:
+            account = self._accounts[user.id] = AccountState(user.id)
+
+        request = OrderRequest(orders, all_or_nothing, asyncio.get_running_loop().create_future(), order_ids)
+        account.requests.append(request)
+        if account.task is None:
+            # a fresh context, so the drain serving every later request of the
+            # account doesn't carry this one's trade_timer
+            account.task = asyncio.create_task(self._drain(account), context=contextvars.Context())
+        return await request.future
+
+    def get_account(self, user_id: int) -> Optional[AccountState]:
+        # the database can lag behind in journal mode, so reads of a loaded
+        # account should come from here
+        account = self._accounts.get(user_id)
+        return account if account is not None and account.loaded else None
+
+    async def _drain(self, account: AccountState):
+        try:
+            if not account.loaded:
+                await self._load(account)
+            while account.requests:
+                request = account.requests.popleft()
+                if request.future.done():
+                    continue
+                try:
+                    self._execute(account, request)
+                except Exception as e:
+                    request.future.set_exception(e)
+        except Exception as e:
+            while account.requests:
+                request = account.requests.popleft()
+                if not request.future.done():
+                    request.future.set_exception(e)
+        finally:
+            account.task = None
+
+    async def _load(self, account: AccountState):
+        # an account reloaded after a failure must not read rows the
+        # background writer has not caught up with yet
+        while any(entry.user_id == account.user_id for entry in self._unpersisted):
+            self._caught_up.clear()
+            await self._caught_up.wait()
+
+        async with self.session_factory() as db:
+            user = await db.get(User, account.user_id)
+            if user is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+            result = await db.execute(select(Position).where(Position.user_id == account.user_id))
+            positions = result.scalars().all()
+
+        account.balance = user.balance
+        account.positions = {p.symbol: [p.quantity, p.avg_price] for p in positions}
+        account.loaded = True
+
+    def _execute(self, account: AccountState, request: OrderRequest):
+        # runs without awaiting, so every order in the request sees the same prices.
+        # A rejected order leaves the account untouched, so a snapshot is only
+        # needed to undo earlier orders of an all-or-nothing batch
+        saved = None
+        if request.all_or_nothing and len(request.orders) > 1:
+            saved = (account.balance, {symbol: list(p) for symbol, p in account.positions.items()})
+        fills = []
+        for trade_data in request.orders:
+            try:
+                fills.append(self._apply(account, trade_data, request))
+                request.results.append((fills[-1].trade, None))
+            except HTTPException as e:
+                request.results.append((None, e.detail))
+
+        if not fills or (request.all_or_nothing and len(fills) < len(request.orders)):
+            if saved is not None:
+                account.balance, account.positions = saved
+            request.future.set_result([
+                (None, error or "Not executed: batch rejected") for _, error in request.results
+            ])
+            return
+
+        self._pending.extend(fills)
+        self._wakeup.set()
+
+    def _apply(self, account: AccountState, trade_data: TradeCreate, request: OrderRequest) -> Fill:
+        symbol = trade_data.symbol.value
+        current_price = require_price(self.price_provider.get_current_price(symbol), symbol)
+        account.balance = fill_order(account.balance, account.positions, trade_data, current_price)
+        trade = new_trade(account.user_id, trade_data, current_price, timestamp=datetime.utcnow())
+        trade.id = self._next_trade_id
+        self._next_trade_id += 1
+        fill = Fill(account, trade, request)
+        if account.positions[symbol][0] == 0:
+            del account.positions[symbol]
+        return fill
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await self._wakeup.wait()
+                # fills arriving while a commit is in flight form the next
+                # batch, so batches grow with load without a fixed delay
+                await asyncio.sleep(settings.execution_flush_interval)
+                await self._flush()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("Error in execution flush loop: %s", e)
+
+    def _entry(self, fill: Fill) -> JournalEntry:
+        self._seq += 1
+        trade = fill.trade
+        return JournalEntry(
+            self._seq, trade.timestamp.replace(tzinfo=timezone.utc).timestamp(), trade.id, trade.user_id,
+            trade.symbol, trade.side, trade.quantity, trade.price, trade.total_amount,
+            fill.balance, fill.quantity, fill.avg_price
+        )
+
+    async def _flush(self):
+        self._wakeup.clear()
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        entries = [self._entry(fill) for fill in batch]
+
+        orders = self._order_updates(batch)
+
+        started = time.perf_counter()
+        try:
+            if self.journal is not None and not orders:
+                async with self._journal_lock:
+                    await asyncio.to_thread(self.journal.append, entries)
+                    self._unpersisted.extend(entries)
+                self._writer_wakeup.set()
+            elif self.journal is not None:
+                async with self._persist_lock:
+                    await self._persist_journaled()
+                    await self._persist(entries, orders)
+            else:
+                await self._persist(entries, orders)
+        except Exception as e:
+            logger.error("Group commit of %d fills failed: %s", len(batch), e)
+            self._discard({fill.account.user_id for fill in batch}, batch, e)
+            return
+        trade_latency.observe(time.perf_counter() - started, "commit")
+
+        for fill in batch:
+            publish_fill(fill.account.user_id, fill.trade, fill.balance, fill.quantity, fill.avg_price)
+            # a request's fills are always queued together, so they share a commit
+            if not fill.request.future.done():
+                fill.request.future.set_result(fill.request.results)
+
+    def _order_updates(self, batch: List[Fill]) -> List[Tuple[int, Optional[int], Optional[str]]]:
+        # (order id, trade id, rejection reason) for the resting orders in the batch
+        requests = {fill.request: None for fill in batch if fill.request.order_ids}
+        return [
+            (order_id, trade.id if trade is not None else None, error)
+            for request in requests
+            for order_id, (trade, error) in zip(request.order_ids, request.results)
+        ]
+
+    def _discard(self, user_ids: Set[int], batch: List[Fill], error: Exception):
+        # in-memory state of these accounts is ahead of what was made durable.
+        # Fills queued behind the failed batch were computed on top of it, and
+        # requests not yet executed would be, so all of them fail with it; the
+        # accounts reload from the database on their next order
+        stranded = [fill for fill in self._pending if fill.account.user_id in user_ids]
+        self._pending = [fill for fill in self._pending if fill.account.user_id not in user_ids]
+        for user_id in user_ids:
+            account = self._accounts.pop(user_id, None)
+            if account is None:
+                continue
+            if account.task is not None:
+                account.task.cancel()
+                account.task = None
+            while account.requests:
+                request = account.requests.popleft()
+                if not request.future.done():
+                    request.future.set_exception(error)
+        for fill in batch + stranded:
+            if not fill.request.future.done():
+                fill.request.future.set_exception(error)
+
+    async def _persist(
+        self, entries: List[JournalEntry], orders: List[Tuple[int, Optional[int], Optional[str]]] = ()
+    ):
+        # entries carry the account state after each fill, so only the last
+        # balance per account and position per symbol needs writing
+        balances: Dict[int, float] = {}
+        positions: Dict[Tuple[int, str], Tuple[float, float]] = {}
+        fills: Dict[Tuple[int, str], list] = {}
+        for entry in entries:
+            balances[entry.user_id] = entry.balance
+            positions[(entry.user_id, entry.symbol)] = (entry.position_quantity, entry.avg_price)
+            fills.setdefault((entry.user_id, entry.symbol), []).append((entry.side, entry.quantity, entry.price))
+
+        async with self.session_factory() as db:
+            db.add_all([
+                Trade(
+                    id=entry.trade_id,
+                    user_id=entry.user_id,
+                    symbol=entry.symbol,
+                    side=entry.side,
+                    quantity=entry.quantity,
+                    price=entry.price,
+                    total_amount=entry.total_amount,
+                    timestamp=datetime.utcfromtimestamp(entry.timestamp)
+                )
+                for entry in entries
+            ])
+            # lots are read as they stood before this batch, so this goes
+            # ahead of the position updates below
+            for (user_id, symbol), symbol_fills in fills.items():
+                await record_fills(db, user_id, symbol, symbol_fills)
+            for user_id, balance in balances.items():
+                await db.execute(update(User).where(User.id == user_id).values(balance=balance))
+            for (user_id, symbol), (quantity, avg_price) in positions.items():
+                where = (Position.user_id == user_id, Position.symbol == symbol)
+                if quantity == 0:
+                    await db.execute(delete(Position).where(*where))
+                    continue
+                result = await db.execute(update(Position).where(*where).values(quantity=quantity, avg_price=avg_price))
+                if result.rowcount == 0:
+                    db.add(Position(user_id=user_id, symbol=symbol, quantity=quantity, avg_price=avg_price))
+
+            if self.journal is not None:
+                seq = entries[-1].seq
+                result = await db.execute(
+                    update(JournalCheckpoint).where(JournalCheckpoint.name == "trades").values(seq=seq)
+                )
+                if result.rowcount == 0:
+                    db.add(JournalCheckpoint(name="trades", seq=seq))
+            if orders:
+                # the trades must be inserted before an order can reference them
+                await db.flush()
+                for order_id, trade_id, error in orders:
+                    await db.execute(
+                        update(Order)
+                        .where(Order.id == order_id, Order.status == OrderStatus.TRIGGERED.value)
+                        .values(
+                            status=OrderStatus.FILLED.value if trade_id is not None else OrderStatus.REJECTED.value,
+                            trade_id=trade_id,
+                            reason=error
+                        )
+                    )
+            await db.commit()
+
+    async def _write_behind_loop(self):
+        while True:
+            try:
+                await self._writer_wakeup.wait()
+                self._writer_wakeup.clear()
+                await self._write_behind()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                # the fills are safe in the journal; keep retrying
+                logger.error("Write-behind of %d journaled fills failed: %s", len(self._unpersisted), e)
+                self._writer_wakeup.set()
+                await asyncio.sleep(1)
+
+    async def _write_behind(self):
+        async with self._persist_lock:
+            await self._persist_journaled()
+
+        if self.journal.size > settings.trade_journal_max_bytes:
+            async with self._journal_lock:
+                if not self._unpersisted:
+                    self.journal.reset()
+
+    async def _persist_journaled(self):
+        while self._unpersisted:
+            count = len(self._unpersisted)
+            await self._persist(self._unpersisted[:count])
+            # publish_fill ran at the fsync, before the primary had these rows:
+            # a principal cached since then holds the old balance, and the
+            # read-your-writes window has to run from now
+            for user_id in {entry.user_id for entry in self._unpersisted[:count]}:
+                principal_cache.invalidate(user_id)
+                read_router.mark_write(user_id)
+            del self._unpersisted[:count]
+            self._caught_up.set()
+
+
+execution_engine = ExecutionEngine()
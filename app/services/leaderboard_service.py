@@ -0,0 +1,265 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import WebSocket
+from sqlalchemy import select
+
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal
+from ..models import User, Position
+from .price_provider import PriceProvider, PriceUpdate
+from .price_service import get_price_provider
+from .websocket_service import WebSocketManager, websocket_manager
+
+logger = logging.getLogger(__name__)
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.zeros(max(size, 2 * len(array), 1024), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class AccountBook:
+    # every account lives in columnar arrays: one row per account for the
+    # balance, and one entry per open position (row, symbol, quantity), so a
+    # re-mark is a gather plus a bincount over all positions at once
+
+    def __init__(self, price_provider: PriceProvider):
+        self.price_provider = price_provider
+        self.symbols: Dict[str, int] = {}
+        self.prices = np.zeros(0)
+        self.rows: Dict[int, int] = {}
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.balances = np.zeros(0)
+        self.accounts = 0
+
+        self.position_rows = np.zeros(0, dtype=np.int64)
+        self.position_symbols = np.zeros(0, dtype=np.int64)
+        self.position_quantities = np.zeros(0)
+        self.position_count = 0
+        self._positions: Dict[Tuple[int, int], int] = {}
+        # slots of closed positions, reused before the arrays grow
+        self._free: List[int] = []
+
+    def symbol(self, symbol: str) -> int:
+        index = self.symbols.get(symbol)
+        if index is None:
+            index = self.symbols[symbol] = len(self.symbols)
+            self.prices = _grow(self.prices, index + 1)
+            self.prices[index] = self.price_provider.get_current_price(symbol) or 0.0
+        return index
+
+    def row(self, user_id: int) -> int:
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = self.accounts
+            self.accounts += 1
+            self.user_ids = _grow(self.user_ids, self.accounts)
+            self.balances = _grow(self.balances, self.accounts)
+            self.user_ids[row] = user_id
+        return row
+
+    def set_position(self, row: int, symbol: int, quantity: float):
+        key = (row, symbol)
+        index = self._positions.get(key)
+        if quantity <= 0:
+            if index is not None:
+                self.position_quantities[index] = 0.0
+                del self._positions[key]
+                self._free.append(index)
+            return
+
+        if index is None:
+            if self._free:
+                index = self._free.pop()
+            else:
+                index = self.position_count
+                self.position_count += 1
+                self.position_rows = _grow(self.position_rows, self.position_count)
+                self.position_symbols = _grow(self.position_symbols, self.position_count)
+                self.position_quantities = _grow(self.position_quantities, self.position_count)
+            self._positions[key] = index
+            self.position_rows[index] = row
+            self.position_symbols[index] = symbol
+        self.position_quantities[index] = quantity
+
+    def add_account(self, user_id: int, balance: float):
+        row = self.row(user_id)
+        self.balances[row] = balance
+
+    def apply_fill(self, user_id: int, symbol: str, balance: float, quantity: float):
+        row = self.row(user_id)
+        self.balances[row] = balance
+        self.set_position(row, self.symbol(symbol), quantity)
+
+    def mark(self, changes: Dict[str, float]):
+        for symbol, price in changes.items():
+            index = self.symbols.get(symbol)
+            if index is not None:
+                self.prices[index] = price
+
+    def equity(self) -> np.ndarray:
+        n, m = self.accounts, self.position_count
+        values = self.position_quantities[:m] * self.prices[self.position_symbols[:m]]
+        return self.balances[:n] + np.bincount(self.position_rows[:m], weights=values, minlength=n)
+
+    def rank(self, size: int) -> List[Tuple[int, float]]:
+        if not self.accounts:
+            return []
+        equity = self.equity()
+        size = min(size, len(equity))
+        # O(n) selection of the top slice, then only that slice is sorted
+        top = np.argpartition(-equity, size - 1)[:size]
+        top = top[np.argsort(-equity[top], kind="stable")]
+        return list(zip(self.user_ids[top].tolist(), equity[top].tolist()))
+
+
+class LeaderboardService:
+
+    def __init__(self, price_provider: Optional[PriceProvider] = None, manager: Optional[WebSocketManager] = None,
+                 session_factory=None):
+        self.price_provider = price_provider or get_price_provider()
+        self.manager = manager or websocket_manager
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.book = AccountBook(self.price_provider)
+        self.entries: List[dict] = []
+        self.updated_at: Optional[datetime] = None
+        self._usernames: Dict[int, str] = {}
+        self._sockets: Set[WebSocket] = set()
+        # registrations and fills seen while a reload is streaming, replayed
+        # onto the new book
+        self._reload_changes: Optional[List[Tuple[Callable, tuple]]] = None
+        self._dirty = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+        await self._load()
+        self.price_provider.add_listener(self._on_price_update)
+        self._task = asyncio.create_task(self._refresh_loop())
+        logger.info("Leaderboard started with %d accounts", self.book.accounts)
+
+    async def stop(self):
+        self.price_provider.remove_listener(self._on_price_update)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _load(self):
+        # rebuilt from the database so a restart, or fills made by other
+        # workers, are picked up; streamed so rows never pile up as ORM objects
+        book = AccountBook(self.price_provider)
+        self._reload_changes = []
+        try:
+            async with self.session_factory() as db:
+                result = await db.stream(
+                    select(User.id, User.balance).where(User.is_active == True).execution_options(yield_per=10000)
+                )
+                async for user_id, balance in result:
+                    book.add_account(user_id, balance)
+
+                result = await db.stream(
+                    select(Position.user_id, Position.symbol, Position.quantity).execution_options(yield_per=10000)
+                )
+                async for user_id, symbol, quantity in result:
+                    row = book.rows.get(user_id)
+                    if row is not None:
+                        book.set_position(row, book.symbol(symbol), quantity)
+
+            for change, args in self._reload_changes:
+                change(book, *args)
+            # each symbol was priced when the stream first met it; ticks since
+            # then only marked the old book
+            prices = self.price_provider.get_all_prices()
+            prices.pop("timestamp", None)
+            book.mark(prices)
+            self.book = book
+        finally:
+            self._reload_changes = None
+
+    def _change(self, change: Callable, *args):
+        change(self.book, *args)
+        if self._reload_changes is not None:
+            self._reload_changes.append((change, args))
+        self._dirty.set()
+
+    def add_account(self, user_id: int, balance: float):
+        self._change(AccountBook.add_account, user_id, balance)
+
+    def apply_fill(self, user_id: int, symbol: str, balance: float, quantity: float):
+        self._change(AccountBook.apply_fill, user_id, symbol, balance, quantity)
+
+    def _on_price_update(self, update: PriceUpdate):
+        self.book.mark(update.changes)
+        self._dirty.set()
+
+    async def _resolve_usernames(self, user_ids: List[int]):
+        missing = [user_id for user_id in user_ids if user_id not in self._usernames]
+        if not missing:
+            return
+        async with self.session_factory() as db:
+            result = await db.execute(select(User.id, User.username).where(User.id.in_(missing)))
+            self._usernames.update(result.all())
+
+    async def refresh(self):
+        ranking = self.book.rank(settings.leaderboard_size)
+        await self._resolve_usernames([user_id for user_id, _ in ranking])
+        self.entries = [
+            {
+                "rank": rank,
+                "user_id": user_id,
+                "username": self._usernames.get(user_id),
+                "equity": round(equity, 2)
+            }
+            for rank, (user_id, equity) in enumerate(ranking, start=1)
+        ]
+        self.updated_at = datetime.utcnow()
+
+        payload = {"type": "leaderboard", "timestamp": self.updated_at.isoformat(), "entries": self.entries}
+        for websocket in list(self._sockets):
+            self.manager.send_to(websocket, payload)
+
+    async def _refresh_loop(self):
+        reloaded = asyncio.get_running_loop().time()
+        while True:
+            try:
+                await self._dirty.wait()
+                self._dirty.clear()
+                if asyncio.get_running_loop().time() - reloaded > settings.leaderboard_reload_interval:
+                    await self._load()
+                    reloaded = asyncio.get_running_loop().time()
+                await self.refresh()
+                # ticks and fills arriving meanwhile are folded into the next pass
+                await asyncio.sleep(settings.leaderboard_refresh_interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("Error refreshing leaderboard: %s", e)
+                await asyncio.sleep(5)
+
+    async def attach(self, websocket: WebSocket):
+        self._sockets.add(websocket)
+        await self.manager.connect(websocket, symbols=())
+        self.manager.send_to(websocket, {
+            "type": "leaderboard",
+            "timestamp": self.updated_at.isoformat() if self.updated_at else None,
+            "entries": self.entries
+        })
+
+    def detach(self, websocket: WebSocket):
+        self._sockets.discard(websocket)
+        self.manager.disconnect(websocket)
+
+
+leaderboard_service = LeaderboardService()
@@ -0,0 +1,61 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ..core.symbols import SymbolUniverse
+
+
+class MarketSimulator:
+    # correlated geometric Brownian motion over the whole symbol universe
+
+    def __init__(self, universe: SymbolUniverse, seed: Optional[int] = None):
+        self.symbols: List[str] = universe.symbols
+        self.index: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.prices = np.array([i.price for i in universe.instruments], dtype=np.float64)
+        self.drift = np.array([i.drift for i in universe.instruments], dtype=np.float64)
+        self.volatility = np.array([i.volatility for i in universe.instruments], dtype=np.float64)
+        self.correlation = self._build_correlation(universe)
+        self._rng = np.random.default_rng(seed)
+        self._log_drift = self.drift - 0.5 * self.volatility ** 2
+
+        # only instruments that take part in a correlation pay for the
+        # Cholesky product; everything else draws independent shocks
+        correlated = np.flatnonzero((self.correlation != 0).sum(axis=1) > 1)
+        self._correlated = correlated
+        self._cholesky = (
+            np.linalg.cholesky(self.correlation[np.ix_(correlated, correlated)])
+            if len(correlated) else None
+        )
+
+    def _build_correlation(self, universe: SymbolUniverse) -> np.ndarray:
+        n = len(self.symbols)
+        correlation = np.eye(n)
+        for a, b, rho in universe.correlations:
+            i, j = self.index[a], self.index[b]
+            correlation[i, j] = correlation[j, i] = rho
+
+        try:
+            np.linalg.cholesky(correlation)
+        except np.linalg.LinAlgError:
+            # clip to the nearest positive definite matrix with unit diagonal
+            values, vectors = np.linalg.eigh(correlation)
+            correlation = vectors @ np.diag(np.clip(values, 1e-8, None)) @ vectors.T
+            scale = np.sqrt(np.diag(correlation))
+            correlation = correlation / np.outer(scale, scale)
+        return correlation
+
+    def set_price(self, symbol: str, price: float):
+        i = self.index.get(symbol)
+        if i is not None:
+            self.prices[i] = price
+
+    def set_prices(self, prices: Dict[str, float]):
+        for symbol, price in prices.items():
+            self.set_price(symbol, price)
+
+    def step(self) -> np.ndarray:
+        shocks = self._rng.standard_normal(len(self.prices))
+        if self._cholesky is not None:
+            shocks[self._correlated] = self._cholesky @ shocks[self._correlated]
+        self.prices *= np.exp(self._log_drift + self.volatility * shocks)
+        return self.prices
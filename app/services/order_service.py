@@ -0,0 +1,313 @@
+import asyncio
+import heapq
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.config import settings
+from ..core.database import AsyncSessionLocal, read_router
+from ..core.schemas import OrderCreate, OrderStatus, OrderType, TradeCreate, TradeSide
+from ..models import User, Order, Trade
+from .execution_engine import execution_engine
+from .price_provider import PriceProvider, PriceUpdate
+from .price_service import get_price_provider
+from .trading_service import AsyncTradingService
+
+logger = logging.getLogger(__name__)
+
+
+# symbol, side, order type and trigger price: what the index needs to hold
+# an order again
+Trigger = Tuple[str, str, str, float]
+
+
+class TriggerIndex:
+    # two heaps per symbol keyed by trigger price, so a tick only touches the
+    # orders it actually crosses:
+    #   falling fires when price <= trigger (buy limit, sell stop), max-heap
+    #   rising fires when price >= trigger (sell limit, buy stop), min-heap
+    # removed orders are skipped lazily when they surface
+
+    def __init__(self):
+        self._falling: Dict[str, List[Tuple[float, int]]] = {}
+        self._rising: Dict[str, List[Tuple[float, int]]] = {}
+        self._live: Dict[int, Trigger] = {}
+        self._stale = 0
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def add(self, order_id: int, symbol: str, side: str, order_type: str, trigger_price: float):
+        self._live[order_id] = (symbol, side, order_type, trigger_price)
+        if (side == TradeSide.BUY.value) == (order_type == OrderType.LIMIT.value):
+            heapq.heappush(self._falling.setdefault(symbol, []), (-trigger_price, order_id))
+        else:
+            heapq.heappush(self._rising.setdefault(symbol, []), (trigger_price, order_id))
+
+    def remove(self, order_id: int):
+        if self._live.pop(order_id, None) is None:
+            return
+        self._stale += 1
+        if self._stale > 1024 and self._stale > len(self._live):
+            self._compact()
+
+    def crossed(self, symbol: str, price: float) -> List[Tuple[int, Trigger]]:
+        # the fired orders leave the index; add them back with their trigger
+        # if they can't be claimed
+        fired = []
+        heap = self._falling.get(symbol)
+        while heap and -heap[0][0] >= price:
+            self._pop(heap, fired)
+        heap = self._rising.get(symbol)
+        while heap and heap[0][0] <= price:
+            self._pop(heap, fired)
+        return fired
+
+    def _pop(self, heap: List[Tuple[float, int]], fired: List[Tuple[int, Trigger]]):
+        _, order_id = heapq.heappop(heap)
+        trigger = self._live.pop(order_id, None)
+        if trigger is not None:
+            fired.append((order_id, trigger))
+        else:
+            self._stale -= 1
+
+    def _compact(self):
+        for heaps in (self._falling, self._rising):
+            for symbol, heap in heaps.items():
+                heap[:] = [entry for entry in heap if entry[1] in self._live]
+                heapq.heapify(heap)
+        self._stale = 0
+
+
+class OrderService:
+
+    def __init__(self, price_provider: Optional[PriceProvider] = None, session_factory=None):
+        self.price_provider = price_provider or get_price_provider()
+        self.session_factory = session_factory or AsyncSessionLocal
+        self.index = TriggerIndex()
+        self._triggered: List[Tuple[int, Trigger]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task and not self._task.done():
+            return
+
+        async with self.session_factory() as db:
+            # a fill commits its trades and order status together, so an order
+            # still TRIGGERED was claimed by a worker that stopped before
+            # executing it, or is being filled by a worker that will now
+            # refuse to commit it
+            result = await db.execute(
+                update(Order)
+                .where(Order.status == OrderStatus.TRIGGERED.value)
+                .values(status=OrderStatus.OPEN.value)
+            )
+            await db.commit()
+            if result.rowcount:
+                logger.warning("Reopened %d orders left triggered", result.rowcount)
+            result = await db.execute(select(Order).where(Order.status == OrderStatus.OPEN.value))
+            for order in result.scalars():
+                self.index.add(order.id, order.symbol, order.side, order.order_type, order.trigger_price)
+
+        self.price_provider.add_listener(self._on_price_update)
+        self._task = asyncio.create_task(self._fill_loop())
+        logger.info("Order service started with %d resting orders", len(self.index))
+
+    async def stop(self):
+        self.price_provider.remove_listener(self._on_price_update)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def place(self, db: AsyncSession, user: User, order_data: OrderCreate) -> Order:
+        order = Order(
+            user_id=user.id,
+            symbol=order_data.symbol.value,
+            side=order_data.side.value,
+            order_type=order_data.order_type.value,
+            quantity=order_data.quantity,
+            trigger_price=order_data.trigger_price
+        )
+        db.add(order)
+        await db.commit()
+        read_router.mark_write(user.id)
+
+        self.index.add(order.id, order.symbol, order.side, order.order_type, order.trigger_price)
+        # an order placed through the current price fires without waiting for a tick
+        current_price = self.price_provider.get_current_price(order.symbol)
+        if current_price:
+            self._check(order.symbol, current_price)
+        return order
+
+    async def cancel(self, db: AsyncSession, user: User, order_id: int) -> Order:
+        result = await db.execute(
+            update(Order)
+            .where(Order.id == order_id, Order.user_id == user.id, Order.status == OrderStatus.OPEN.value)
+            .values(status=OrderStatus.CANCELLED.value)
+        )
+        await db.commit()
+        if result.rowcount == 0:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Open order not found"
+            )
+
+        read_router.mark_write(user.id)
+        self.index.remove(order_id)
+        return await db.get(Order, order_id)
+
+    async def get_user_orders(
+        self, db: AsyncSession, user: User, order_status: Optional[OrderStatus] = None, limit: int = 50
+    ) -> List[Order]:
+        query = select(Order).where(Order.user_id == user.id)
+        if order_status is not None:
+            query = query.where(Order.status == order_status.value)
+        result = await db.execute(query.order_by(Order.id.desc()).limit(limit))
+        return list(result.scalars().all())
+
+    def _check(self, symbol: str, price: float):
+        fired = self.index.crossed(symbol, price)
+        if fired:
+            self._triggered.extend(fired)
+            self._wakeup.set()
+
+    def _on_price_update(self, update: PriceUpdate):
+        for symbol, price in update.changes.items():
+            self._check(symbol, price)
+
+    async def _fill_loop(self):
+        while True:
+            try:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                batch, self._triggered = self._triggered, []
+                await self._fill(batch)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error("Error filling triggered orders: %s", e)
+
+    async def _fill(self, triggered: List[Tuple[int, Trigger]]):
+        try:
+            by_user = await self._claim([order_id for order_id, _ in triggered])
+        except Exception:
+            # nothing was claimed, so the orders are still OPEN and wait for
+            # the next crossing tick like any other
+            for order_id, trigger in triggered:
+                self.index.add(order_id, *trigger)
+            raise
+
+        # a session per user, so one user's failure leaves nothing behind for
+        # the next
+        for user_id, orders in by_user.items():
+            try:
+                async with self.session_factory() as db:
+                    await self._fill_user(db, user_id, orders)
+            except Exception as e:
+                logger.error("Filling %d orders of user %d failed, reopening them: %s", len(orders), user_id, e)
+                await self._reopen(orders)
+            read_router.mark_write(user_id)
+
+    async def _claim(self, order_ids: List[int]) -> Dict[int, List[Order]]:
+        async with self.session_factory() as db:
+            result = await db.execute(select(Order).where(Order.id.in_(order_ids)))
+            rows = {order.id: order for order in result.scalars()}
+            # claiming with a conditional update keeps an order from filling
+            # twice when it was cancelled meanwhile or another worker indexed it
+            claimed = []
+            for order_id in order_ids:
+                result = await db.execute(
+                    update(Order)
+                    .where(Order.id == order_id, Order.status == OrderStatus.OPEN.value)
+                    .values(status=OrderStatus.TRIGGERED.value)
+                )
+                if result.rowcount:
+                    claimed.append(order_id)
+            await db.commit()
+
+        by_user: Dict[int, List[Order]] = {}
+        for order_id in claimed:
+            order = rows[order_id]
+            by_user.setdefault(order.user_id, []).append(order)
+        return by_user
+
+    async def _fill_user(self, db: AsyncSession, user_id: int, orders: List[Order]):
+        user = await db.get(User, user_id)
+        if user is None:
+            await self._settle(db, orders, [(None, "User not found")] * len(orders))
+            await db.commit()
+            return
+
+        trades = [
+            TradeCreate(symbol=order.symbol, side=order.side, quantity=order.quantity)
+            for order in orders
+        ]
+        # the status goes into the commit holding the fills, so a crash can't
+        # separate an executed trade from its order
+        if settings.execution_engine_enabled:
+            results = await execution_engine.submit_batch(
+                user, trades, all_or_nothing=False, order_ids=[order.id for order in orders]
+            )
+        else:
+            trading_service = AsyncTradingService(db, self.price_provider)
+            results = await trading_service.execute_batch(
+                user, trades, all_or_nothing=False,
+                before_commit=lambda results: self._settle(db, orders, results, claimed=True)
+            )
+        # orders none of which filled had no commit to ride on
+        await self._settle(db, orders, results)
+        await db.commit()
+
+    async def _settle(
+        self, db: AsyncSession, orders: List[Order], results: List[Tuple[Optional[Trade], Optional[str]]],
+        claimed: bool = False
+    ):
+        # conditional on TRIGGERED, so orders already settled with their fills
+        # are left alone. With claimed, the fills are in this transaction and
+        # must not commit for an order another worker's start() reopened
+        for order, (trade, error) in zip(orders, results):
+            result = await db.execute(
+                update(Order)
+                .where(Order.id == order.id, Order.status == OrderStatus.TRIGGERED.value)
+                .values(
+                    status=OrderStatus.FILLED.value if trade is not None else OrderStatus.REJECTED.value,
+                    trade_id=trade.id if trade is not None else None,
+                    reason=error
+                )
+            )
+            if claimed and trade is not None and result.rowcount == 0:
+                raise RuntimeError(f"Order {order.id} is no longer triggered")
+
+    async def _reopen(self, orders: List[Order]):
+        # nothing was written for these orders, so they go back to resting
+        # and fire again on a later tick
+        ids = [order.id for order in orders]
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(Order)
+                    .where(Order.id.in_(ids), Order.status == OrderStatus.TRIGGERED.value)
+                    .values(status=OrderStatus.OPEN.value)
+                )
+                await db.commit()
+                # the failure may have come after some of them settled
+                reopened = set((await db.execute(
+                    select(Order.id).where(Order.id.in_(ids), Order.status == OrderStatus.OPEN.value)
+                )).scalars())
+        except Exception as e:
+            # left TRIGGERED; start() reopens them
+            logger.error("Reopening %d orders failed: %s", len(orders), e)
+            return
+        for order in orders:
+            if order.id in reopened:
+                self.index.add(order.id, order.symbol, order.side, order.order_type, order.trigger_price)
+
+order_service = OrderService()
@@ -0,0 +1,142 @@
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import select, inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..core.schemas import TradeSide
+from ..models import User, Position, Lot, PnlSummary
+from .price_provider import PriceProvider
+
+# quantities are rounded to 4 decimals, so anything below this is float noise
+LOT_EPSILON = 1e-9
+
+# (side, quantity, price) of one fill, in execution order
+FillTuple = Tuple[str, float, float]
+
+
+def _apply_fills(lots: List[Lot], summary: PnlSummary, fills: Iterable[FillTuple]) -> List[Lot]:
+    # buys open a lot, sells consume the oldest lots first and realize the
+    # difference; returns the lots that were used up
+    exhausted = []
+    for side, quantity, price in fills:
+        if side == TradeSide.BUY.value:
+            lots.append(Lot(user_id=summary.user_id, symbol=summary.symbol, quantity=quantity, price=price))
+            summary.cost_basis += quantity * price
+            continue
+
+        remaining = quantity
+        while remaining > LOT_EPSILON and lots:
+            lot = lots[0]
+            taken = min(lot.quantity, remaining)
+            summary.realized_pnl += taken * (price - lot.price)
+            summary.cost_basis -= taken * lot.price
+            lot.quantity -= taken
+            remaining -= taken
+            if lot.quantity <= LOT_EPSILON:
+                exhausted.append(lots.pop(0))
+
+    if not lots:
+        summary.cost_basis = 0.0
+    return exhausted
+
+
+def _new_summary(user_id: int, symbol: str, lots: List[Lot], position: Optional[Position]) -> PnlSummary:
+    # a position opened before lots were tracked starts as one lot at its
+    # average price
+    summary = PnlSummary(user_id=user_id, symbol=symbol, realized_pnl=0.0, cost_basis=0.0)
+    if position is not None and position.quantity > LOT_EPSILON:
+        lots.append(Lot(user_id=user_id, symbol=symbol, quantity=position.quantity, price=position.avg_price))
+        summary.cost_basis = position.quantity * position.avg_price
+    return summary
+
+
+def _insert_summary(dialect: str, summary: PnlSummary):
+    # skipped when a concurrent first fill for the same (user, symbol) created
+    # the row first, instead of failing uq_pnl_user_symbol at commit
+    values = dict(
+        user_id=summary.user_id, symbol=summary.symbol,
+        realized_pnl=summary.realized_pnl, cost_basis=summary.cost_basis
+    )
+    if dialect == "mysql":
+        return mysql.insert(PnlSummary).values(**values).prefix_with("IGNORE")
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    return insert(PnlSummary).values(**values).on_conflict_do_nothing()
+
+
+def _lots_query(user_id: int, symbol: str):
+    return select(Lot).where(Lot.user_id == user_id, Lot.symbol == symbol).order_by(Lot.id)
+
+
+def _summary_query(user_id: int, symbol: str):
+    return select(PnlSummary).where(PnlSummary.user_id == user_id, PnlSummary.symbol == symbol)
+
+
+def _position_query(user_id: int, symbol: str):
+    return select(Position).where(Position.user_id == user_id, Position.symbol == symbol)
+
+
+async def record_fills(db: AsyncSession, user_id: int, symbol: str, fills: Iterable[FillTuple]):
+    # must run before the caller touches the position, which is read as it
+    # stood before these fills. Changes are left for the caller's commit
+    summary = (await db.execute(_summary_query(user_id, symbol))).scalars().first()
+    if summary is None:
+        lots: List[Lot] = []
+        position = (await db.execute(_position_query(user_id, symbol))).scalars().first()
+        created = await db.execute(_insert_summary(db.bind.dialect.name, _new_summary(user_id, symbol, lots, position)))
+        # a locking read, so under MySQL's repeatable read it sees the row a
+        # concurrent transaction just committed
+        summary = (await db.execute(_summary_query(user_id, symbol).with_for_update())).scalars().one()
+        if not created.rowcount:
+            # seeded by the other transaction; its lots are the ones to use
+            lots = list((await db.execute(_lots_query(user_id, symbol).with_for_update())).scalars().all())
+    else:
+        lots = list((await db.execute(_lots_query(user_id, symbol))).scalars().all())
+
+    for lot in _apply_fills(lots, summary, fills):
+        if inspect(lot).persistent:
+            await db.delete(lot)
+    db.add_all([lot for lot in lots if inspect(lot).transient])
+
+
+async def get_user_pnl(db: AsyncSession, user: User, price_provider: PriceProvider) -> dict:
+    # one row per symbol from each table; never touches trades or lots
+    summaries = {
+        summary.symbol: summary
+        for summary in (await db.execute(select(PnlSummary).where(PnlSummary.user_id == user.id))).scalars()
+    }
+    positions = {
+        position.symbol: position
+        for position in (await db.execute(select(Position).where(Position.user_id == user.id))).scalars()
+    }
+
+    symbols = []
+    for symbol in sorted(summaries.keys() | positions.keys()):
+        summary = summaries.get(symbol)
+        position = positions.get(symbol)
+        quantity = position.quantity if position else 0.0
+        if summary is not None:
+            realized, cost_basis = summary.realized_pnl, summary.cost_basis
+        else:
+            realized, cost_basis = 0.0, quantity * position.avg_price
+
+        current_price = price_provider.get_current_price(symbol)
+        unrealized = quantity * current_price - cost_basis if current_price and quantity else 0.0
+        symbols.append({
+            "symbol": symbol,
+            "quantity": quantity,
+            "cost_basis": cost_basis,
+            "current_price": current_price,
+            "realized_pnl": realized,
+            "unrealized_pnl": unrealized,
+            "total_pnl": realized + unrealized
+        })
+
+    realized = sum(item["realized_pnl"] for item in symbols)
+    unrealized = sum(item["unrealized_pnl"] for item in symbols)
+    return {
+        "realized_pnl": realized,
+        "unrealized_pnl": unrealized,
+        "total_pnl": realized + unrealized,
+        "symbols": symbols
+    }
@@ -0,0 +1,163 @@
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+from ..models import User, Trade, Position
+from .price_provider import PriceProvider, PriceUpdate
+from .price_service import get_price_provider
+from .websocket_service import WebSocketManager, websocket_manager
+
+logger = logging.getLogger(__name__)
+
+
+class CachedPosition:
+
+    __slots__ = ("quantity", "avg_price", "price", "pnl")
+
+    def __init__(self, quantity: float, avg_price: float, price: Optional[float]):
+        self.quantity = quantity
+        self.avg_price = avg_price
+        self.price = price
+        self.pnl = (price - avg_price) * quantity if price is not None else 0.0
+
+    def mark(self, price: float) -> float:
+        # returns the change in P&L so the account total can be updated in O(1)
+        pnl = (price - self.avg_price) * self.quantity
+        delta = pnl - self.pnl
+        self.price = price
+        self.pnl = pnl
+        return delta
+
+
+class UserPortfolio:
+
+    def __init__(self, user_id: int, balance: float):
+        self.user_id = user_id
+        self.balance = balance
+        self.positions: Dict[str, CachedPosition] = {}
+        self.unrealized_pnl = 0.0
+        self.sockets: Set[WebSocket] = set()
+
+    def to_dict(self) -> dict:
+        return {
+            "balance": self.balance,
+            "unrealized_pnl": self.unrealized_pnl,
+            "positions": {
+                symbol: {
+                    "quantity": position.quantity,
+                    "avg_price": position.avg_price,
+                    "current_price": position.price,
+                    "pnl": position.pnl
+                }
+                for symbol, position in self.positions.items()
+            }
+        }
+
+
+class PortfolioService:
+    # in-memory mark-to-market for users with an open private channel; only
+    # those users are cached, and only their held symbols are re-marked per tick
+
+    def __init__(self, price_provider: Optional[PriceProvider] = None, manager: Optional[WebSocketManager] = None):
+        self.price_provider = price_provider or get_price_provider()
+        self.manager = manager or websocket_manager
+        self._portfolios: Dict[int, UserPortfolio] = {}
+        # symbol -> ids of cached users holding it
+        self._holders: Dict[str, Set[int]] = {}
+        self._listening = False
+
+    def _set_position(self, portfolio: UserPortfolio, symbol: str, quantity: float, avg_price: float):
+        old = portfolio.positions.pop(symbol, None)
+        if old is not None:
+            portfolio.unrealized_pnl -= old.pnl
+        if quantity > 0:
+            position = CachedPosition(quantity, avg_price, self.price_provider.get_current_price(symbol))
+            portfolio.positions[symbol] = position
+            portfolio.unrealized_pnl += position.pnl
+            self._holders.setdefault(symbol, set()).add(portfolio.user_id)
+        else:
+            holders = self._holders.get(symbol)
+            if holders is not None:
+                holders.discard(portfolio.user_id)
+                if not holders:
+                    del self._holders[symbol]
+
+    async def attach(self, websocket: WebSocket, user: User, positions: List[Position]):
+        portfolio = self._portfolios.get(user.id)
+        if portfolio is None:
+            portfolio = self._portfolios[user.id] = UserPortfolio(user.id, user.balance)
+            for position in positions:
+                self._set_position(portfolio, position.symbol, position.quantity, position.avg_price)
+        portfolio.sockets.add(websocket)
+
+        if not self._listening:
+            self.price_provider.add_listener(self._on_price_update)
+            self._listening = True
+
+        await self.manager.connect(websocket, symbols=())
+        self.manager.send_to(websocket, {"type": "portfolio", **portfolio.to_dict()})
+
+    def detach(self, websocket: WebSocket, user_id: int):
+        self.manager.disconnect(websocket)
+        portfolio = self._portfolios.get(user_id)
+        if portfolio is None:
+            return
+        portfolio.sockets.discard(websocket)
+        if not portfolio.sockets:
+            for symbol in list(portfolio.positions):
+                self._set_position(portfolio, symbol, 0, 0)
+            del self._portfolios[user_id]
+
+        if not self._portfolios and self._listening:
+            self.price_provider.remove_listener(self._on_price_update)
+            self._listening = False
+
+    def apply_fill(self, user_id: int, trade: Trade, balance: float, quantity: float, avg_price: float):
+        portfolio = self._portfolios.get(user_id)
+        if portfolio is None:
+            return
+
+        portfolio.balance = balance
+        self._set_position(portfolio, trade.symbol, quantity, avg_price)
+        self._send(portfolio, {
+            "type": "fill",
+            "trade": {
+                "id": trade.id,
+                "symbol": trade.symbol,
+                "side": trade.side,
+                "quantity": trade.quantity,
+                "price": trade.price,
+                "total_amount": trade.total_amount,
+                "timestamp": trade.timestamp.isoformat() if trade.timestamp else None
+            },
+            **portfolio.to_dict()
+        })
+
+    def _on_price_update(self, update: PriceUpdate):
+        touched: Dict[int, Dict[str, dict]] = {}
+        for symbol, price in update.changes.items():
+            for user_id in self._holders.get(symbol, ()):
+                portfolio = self._portfolios[user_id]
+                position = portfolio.positions[symbol]
+                portfolio.unrealized_pnl += position.mark(price)
+                touched.setdefault(user_id, {})[symbol] = {"current_price": price, "pnl": position.pnl}
+
+        timestamp = datetime.utcfromtimestamp(update.timestamp).isoformat()
+        for user_id, positions in touched.items():
+            portfolio = self._portfolios[user_id]
+            self._send(portfolio, {
+                "type": "pnl",
+                "seq": update.seq,
+                "timestamp": timestamp,
+                "unrealized_pnl": portfolio.unrealized_pnl,
+                "positions": positions
+            })
+
+    def _send(self, portfolio: UserPortfolio, payload: dict):
+        for websocket in list(portfolio.sockets):
+            self.manager.send_to(websocket, payload)
+
+
+portfolio_service = PortfolioService()
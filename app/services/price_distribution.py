@@ -0,0 +1,149 @@
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import time
+from typing import Optional, Set
+
+import msgpack
+
+from ..core.config import settings
+from .price_provider import PriceUpdate
+from .price_service import PriceService, price_service
+
+logger = logging.getLogger(__name__)
+
+# frames are a 4-byte big-endian length followed by a msgpack array:
+# ["snapshot" | "delta", seq, timestamp, {symbol: price}]
+HEADER = struct.Struct(">I")
+
+
+def _frame(kind: str, seq: int, timestamp: float, prices: dict) -> bytes:
+    body = msgpack.packb([kind, seq, timestamp, prices])
+    return HEADER.pack(len(body)) + body
+
+
+class PriceDistributor:
+    # elects one producer per host with an flock on <socket>.lock; the producer
+    # runs the update loop and streams every update to the other workers, which
+    # apply them with the producer's sequence numbers. If the producer dies its
+    # lock is released and a subscriber takes over.
+
+    def __init__(self, service: PriceService, socket_path: Optional[str] = None):
+        self.service = service
+        self.socket_path = socket_path if socket_path is not None else settings.price_feed_socket
+        self.is_producer = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscribers: Set[asyncio.StreamWriter] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.socket_path:
+            await self.service.start_price_updates()
+            return
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.socket_path:
+            await self.service.stop_price_updates()
+            return
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self._stop_producing()
+
+    def _try_acquire_lock(self) -> bool:
+        fd = os.open(f"{self.socket_path}.lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _run(self):
+        while True:
+            try:
+                if self._try_acquire_lock():
+                    await self._produce()
+                    return
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Price feed connection lost: %s", e)
+            await asyncio.sleep(1)
+
+    async def _produce(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_subscriber, path=self.socket_path)
+        self.is_producer = True
+        self.service.add_listener(self._on_price_update)
+        await self.service.start_price_updates()
+        logger.info("Price feed producer listening on %s", self.socket_path)
+
+    async def _stop_producing(self):
+        if not self.is_producer:
+            return
+        self.service.remove_listener(self._on_price_update)
+        await self.service.stop_price_updates()
+        for writer in list(self._subscribers):
+            writer.close()
+        self._subscribers.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+        self.is_producer = False
+
+    async def _handle_subscriber(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        prices = self.service.get_all_prices()
+        prices.pop("timestamp", None)
+        writer.write(_frame("snapshot", self.service.sequence, time.time(), prices))
+        self._subscribers.add(writer)
+        try:
+            # subscribers never send anything; EOF means they went away
+            await reader.read()
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    def _on_price_update(self, update: PriceUpdate):
+        frame = _frame("delta", update.seq, update.timestamp, update.changes)
+        for writer in list(self._subscribers):
+            # writes are buffered by the transport; a worker that stops reading
+            # is dropped instead of growing the buffer without bound
+            if writer.transport.get_write_buffer_size() > settings.price_feed_max_buffer:
+                logger.warning("Dropping stalled price feed subscriber")
+                self._subscribers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+
+    async def _consume(self):
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        logger.info("Mirroring price feed from %s", self.socket_path)
+        try:
+            while True:
+                (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+                kind, seq, timestamp, prices = msgpack.unpackb(await reader.readexactly(length))
+                self.service.apply_remote_update(seq, timestamp, prices)
+        finally:
+            writer.close()
+
+
+price_distributor = PriceDistributor(price_service)
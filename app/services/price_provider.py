@@ -0,0 +1,81 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PriceUpdate:
+
+    __slots__ = ("seq", "timestamp", "changes")
+
+    def __init__(self, seq: int, timestamp: float, changes: Dict[str, float]):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.changes = changes
+
+
+class PriceProvider(ABC):
+
+    def __init__(self):
+        # bumped once per published change; listeners see every value in order
+        self.sequence = 0
+        self._listeners: List[Callable[[PriceUpdate], None]] = []
+
+    def add_listener(self, listener: Callable[[PriceUpdate], None]):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[PriceUpdate], None]):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, changes: Dict[str, float], timestamp: Optional[float] = None, seq: Optional[int] = None):
+        # seq is only passed when mirroring another process's feed
+        self.sequence = seq if seq is not None else self.sequence + 1
+        update = PriceUpdate(self.sequence, timestamp if timestamp is not None else time.time(), changes)
+        for listener in self._listeners:
+            try:
+                listener(update)
+            except Exception as e:
+                logger.error("Error in price listener: %s", e)
+
+    @abstractmethod
+    def get_current_price(self, symbol: str) -> Optional[float]:
+        ...
+
+    @abstractmethod
+    def get_all_prices(self) -> Dict[str, float]:
+        ...
+
+    def get_candles(self, symbol: str, interval_seconds: int, limit: int) -> List[dict]:
+        return []
+
+
+class InMemoryPriceProvider(PriceProvider):
+    # used by tests and tools; never touches the network
+
+    def __init__(self, prices: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.prices: Dict[str, float] = {
+            symbol.upper(): price for symbol, price in (prices or {}).items()
+        }
+        self.last_update = datetime.utcnow()
+
+    def set_price(self, symbol: str, price: float):
+        symbol = symbol.upper()
+        changed = self.prices.get(symbol) != price
+        self.prices[symbol] = price
+        self.last_update = datetime.utcnow()
+        if changed:
+            self._notify({symbol: price})
+
+    def get_current_price(self, symbol: str) -> Optional[float]:
+        return self.prices.get(symbol.upper())
+
+    def get_all_prices(self) -> Dict[str, float]:
+        return {
+            **self.prices,
+            "timestamp": self.last_update.isoformat()
+        }
@@ -1,23 +1,103 @@
 import asyncio
 import random
 import json
+import time
 from datetime import datetime
-from typing import Dict, Optional
-import requests
+from typing import Dict, List, Optional
 import logging
 
+import numpy as np
+
 from ..core.config import settings
+from ..core.metrics import Observed
+from ..core.symbols import SymbolUniverse, symbol_universe
+from .coingecko_client import CoinGeckoClient, CircuitOpenError, UpstreamUnavailableError
+from .market_simulator import MarketSimulator
+from .price_provider import PriceProvider
+from .tick_recording import TickRecorder, TickRecording
 
 logger = logging.getLogger(__name__)
 
-class PriceService:
+CANDLE_INTERVALS = {"1s": 1, "1m": 60, "5m": 300}
+
+class TickHistory:
+    # fixed-capacity ring buffer with one row of prices per symbol; the oldest
+    # ticks are overwritten once full
+
+    def __init__(self, symbols: List[str], capacity: int):
+        self.capacity = capacity
+        self.index: Dict[str, int] = {symbol: i for i, symbol in enumerate(symbols)}
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.prices = np.zeros((len(symbols), capacity), dtype=np.float64)
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, timestamp: float, prices: np.ndarray):
+        self.timestamps[self._next] = timestamp
+        self.prices[:, self._next] = prices
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def snapshot(self, symbol: str) -> tuple[np.ndarray, np.ndarray]:
+        row = self.prices[self.index[symbol]]
+        if self._size < self.capacity:
+            return self.timestamps[:self._size].copy(), row[:self._size].copy()
+        return (
+            np.concatenate((self.timestamps[self._next:], self.timestamps[:self._next])),
+            np.concatenate((row[self._next:], row[:self._next])),
+        )
+
+    def candles(self, symbol: str, interval_seconds: int, limit: int) -> List[dict]:
+        if symbol not in self.index:
+            return []
+        timestamps, prices = self.snapshot(symbol)
+        if not len(timestamps):
+            return []
+
+        buckets = np.floor_divide(timestamps, interval_seconds).astype(np.int64)
+        starts = np.flatnonzero(np.diff(buckets, prepend=buckets[0] - 1))[-limit:]
+        ends = np.append(starts[1:], len(prices)) - 1
+
+        opens = prices[starts]
+        highs = np.maximum.reduceat(prices[starts[0]:], starts - starts[0])
+        lows = np.minimum.reduceat(prices[starts[0]:], starts - starts[0])
+        closes = prices[ends]
+        counts = ends - starts + 1
+        bucket_starts = buckets[starts] * interval_seconds
+
+        return [
+            {
+                "timestamp": datetime.utcfromtimestamp(int(ts)),
+                "open": float(o),
+                "high": float(h),
+                "low": float(l),
+                "close": float(c),
+                "ticks": int(n),
+            }
+            for ts, o, h, l, c, n in zip(bucket_starts, opens, highs, lows, closes, counts)
+        ]
+
+class PriceService(PriceProvider):
     
-    def __init__(self):
+    def __init__(self, upstream: Optional[CoinGeckoClient] = None, universe: Optional[SymbolUniverse] = None):
+        super().__init__()
         self.prices = {}
         self.last_update = datetime.utcnow()
+        self.upstream = upstream or CoinGeckoClient()
+        self.simulator = MarketSimulator(universe or symbol_universe, seed=settings.simulation_seed)
+        self.history = TickHistory(self.simulator.symbols, settings.price_history_capacity)
+        self._published = np.round(self.simulator.prices, 2)
+        self.recorder: Optional[TickRecorder] = None
+        self.replay: Optional[TickRecording] = None
+        self._replay_position = 0
+        self._replay_columns: Optional[np.ndarray] = None
+        self._replay_targets: Optional[np.ndarray] = None
         self._update_task: Optional[asyncio.Task] = None
         
-        self._fetch_initial_prices()
+        self._load_fallback_prices()
 
     def get_current_price(self, symbol: str) -> Optional[float]:
         return self.prices.get(symbol.upper())
@@ -28,10 +108,78 @@ class PriceService:
             "timestamp": datetime.utcnow().isoformat()
         }
 
+    def get_candles(self, symbol: str, interval_seconds: int, limit: int) -> List[dict]:
+        return self.history.candles(symbol.upper(), interval_seconds, limit)
+
+    def _publish(self, prices: np.ndarray, timestamp: Optional[float] = None, seq: Optional[int] = None):
+        timestamp = timestamp if timestamp is not None else time.time()
+        rounded = np.round(prices, 2)
+        changed = np.flatnonzero(rounded != self._published)
+        self._published = rounded
+        self.prices.update(zip(self.simulator.symbols, rounded.tolist()))
+        self.history.append(timestamp, rounded)
+        if self.recorder is not None:
+            self.recorder.append(timestamp, rounded)
+
+        if len(changed):
+            symbols = self.simulator.symbols
+            self._notify(
+                {symbols[i]: price for i, price in zip(changed.tolist(), rounded[changed].tolist())},
+                timestamp,
+                seq,
+            )
+        elif seq is not None:
+            self.sequence = seq
+
+    def apply_remote_update(self, seq: int, timestamp: float, changes: Dict[str, float]):
+        # used by workers that mirror the feed owned by another process
+        index = self.simulator.index
+        for symbol, price in changes.items():
+            i = index.get(symbol)
+            if i is not None:
+                self.simulator.prices[i] = price
+        self._publish(self.simulator.prices, timestamp, seq)
+        self.last_update = datetime.utcnow()
+
+    def load_replay(self, path: str):
+        recording = TickRecording(path)
+        columns = [i for i, symbol in enumerate(recording.symbols) if symbol in self.simulator.index]
+        skipped = len(recording.symbols) - len(columns)
+        if skipped:
+            logger.warning("Ignoring %d recorded symbols that are not in the symbol universe", skipped)
+
+        self.replay = recording
+        self._replay_position = 0
+        self._replay_columns = np.array(columns, dtype=np.intp)
+        self._replay_targets = np.array(
+            [self.simulator.index[recording.symbols[i]] for i in columns], dtype=np.intp
+        )
+        logger.info("Loaded replay %s with %d ticks", path, len(recording))
+
+    def step_replay(self) -> bool:
+        # applies the next recorded tick; backtests call this directly to
+        # advance the clock without any pacing
+        if self.replay is None or self._replay_position >= len(self.replay):
+            return False
+
+        row = self.replay.data[self._replay_position]
+        self.simulator.prices[self._replay_targets] = row[1:][self._replay_columns]
+        self._publish(self.simulator.prices, float(row[0]))
+        self.last_update = datetime.utcnow()
+        self._replay_position += 1
+        return True
+
     async def start_price_updates(self):
         if self._update_task and not self._update_task.done():
             return
         
+        if settings.tick_record_path and self.recorder is None:
+            self.recorder = TickRecorder(settings.tick_record_path, self.simulator.symbols)
+        if settings.price_feed_mode == "replay" and self.replay is None:
+            if not settings.replay_path:
+                raise ValueError("price_feed_mode=replay requires replay_path")
+            self.load_replay(settings.replay_path)
+        
         self._update_task = asyncio.create_task(self._price_update_loop())
         logger.info("Price update service started")
 
@@ -43,20 +191,22 @@ class PriceService:
             except asyncio.CancelledError:
                 pass
             logger.info("Price update service stopped")
+        await self.upstream.close()
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
-    def _fetch_initial_prices(self):
-        try:
-            self._fetch_real_prices()
-            logger.info("Initial real prices fetched successfully")
-        except Exception as e:
-            logger.warning(f"Failed to fetch initial prices: {e}")
-            self.prices = {
-                "GOLD": 2650.00,
-                "SILVER": 32.00
-            }
-            logger.info("Using fallback prices")
+    def _load_fallback_prices(self):
+        # real quotes arrive on the first pass of the update loop; never block
+        # the import on the network
+        self.prices = dict(zip(self.simulator.symbols, self._published.tolist()))
+        logger.info("Using fallback prices until the first upstream refresh")
 
     async def _price_update_loop(self):
+        if self.replay is not None:
+            await self._replay_loop()
+            return
+        
         while True:
             try:
                 await self._fetch_real_prices_async()
@@ -68,86 +218,79 @@ class PriceService:
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Error in price update loop: {e}")
+                logger.error("Error in price update loop: %s", e)
                 await asyncio.sleep(10)
 
-    def _fetch_real_prices(self):
+    async def _replay_loop(self):
+        speed = settings.replay_speed
+        timestamps = self.replay.timestamps
+        if not len(timestamps):
+            return
+        
+        origin = float(timestamps[self._replay_position]) if self._replay_position < len(timestamps) else 0.0
+        started = time.monotonic()
         try:
-            self._fetch_gold_price()
-            self._fetch_silver_price()
-            
-            self.last_update = datetime.utcnow()
-            logger.info(f"Real prices updated - Gold: ${self.prices.get('GOLD')}, Silver: ${self.prices.get('SILVER')}")
-                
-        except Exception as e:
-            logger.error(f"Error fetching real prices: {e}")
-            raise
+            while self._replay_position < len(timestamps):
+                if speed > 0:
+                    delay = (float(timestamps[self._replay_position]) - origin) / speed - (time.monotonic() - started)
+                    await asyncio.sleep(max(delay, 0))
+                else:
+                    await asyncio.sleep(0)
+                self.step_replay()
+        except asyncio.CancelledError:
+            return
+        logger.info("Replay finished")
 
-    def _fetch_gold_price(self):
+    async def _fetch_real_prices_async(self):
+        coin_ids = [settings.gold_coin_id, *settings.silver_coin_ids]
         try:
-            url = f"{settings.coingecko_api_url}?ids={settings.gold_coin_id}&vs_currencies=usd"
-            
-            response = requests.get(url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                
-                if settings.gold_coin_id in data:
-                    gold_price = data[settings.gold_coin_id]['usd']
-                    self.prices["GOLD"] = round(float(gold_price), 2)
-                    logger.debug(f"Gold price updated from {settings.gold_coin_id}: ${gold_price}")
-                else:
-                    raise Exception(f"Gold coin ID {settings.gold_coin_id} not found in response")
-            else:
-                logger.warning(f"CoinGecko API returned status: {response.status_code}")
-                raise Exception(f"Gold API call failed with status {response.status_code}")
-                
-        except Exception as e:
-            logger.error(f"Error fetching gold price: {e}")
-            raise
+            quotes = await self.upstream.fetch_prices(coin_ids)
+        except CircuitOpenError:
+            logger.debug("Skipping real price refresh, upstream circuit is open")
+            return
+        except UpstreamUnavailableError as e:
+            logger.warning("Failed to fetch real prices: %s", e)
+            return
+
+        self._apply_real_prices(quotes)
+        self.simulator.set_price("GOLD", self.prices["GOLD"])
+        self.simulator.set_price("SILVER", self.prices["SILVER"])
+        self._publish(self.simulator.prices)
+        self.last_update = datetime.utcnow()
+        logger.info("Real prices updated - Gold: $%s, Silver: $%s", self.prices.get("GOLD"), self.prices.get("SILVER"))
+
+    def _apply_real_prices(self, quotes: Dict[str, float]):
+        gold_price = quotes.get(settings.gold_coin_id)
+        if gold_price is not None:
+            self.prices["GOLD"] = round(gold_price, 2)
+        else:
+            logger.warning("Gold coin ID %s not found in response", settings.gold_coin_id)
 
-    def _fetch_silver_price(self):
         for silver_id in settings.silver_coin_ids:
-            try:
-                url = f"{settings.coingecko_api_url}?ids={silver_id}&vs_currencies=usd"
-                
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    data = response.json()
-                    
-                    if silver_id in data:
-                        silver_price = data[silver_id]['usd']
-                        if silver_price >= 5:
-                            self.prices["SILVER"] = round(float(silver_price), 2)
-                            logger.debug(f"Silver price updated from {silver_id}: ${silver_price}")
-                            return
-                        else:
-                            logger.debug(f"Silver price from {silver_id} too low (${silver_price}), trying next token")
-                    else:
-                        logger.debug(f"Silver coin ID {silver_id} not found in response")
-                        
-            except Exception as e:
-                logger.debug(f"Error fetching silver price from {silver_id}: {e}")
-                continue
-        
+            silver_price = quotes.get(silver_id)
+            if silver_price is None:
+                logger.debug("Silver coin ID %s not found in response", silver_id)
+            elif silver_price >= 5:
+                self.prices["SILVER"] = round(silver_price, 2)
+                logger.debug("Silver price updated from %s: $%s", silver_id, silver_price)
+                return
+            else:
+                logger.debug("Silver price from %s too low ($%s), trying next token", silver_id, silver_price)
+
         if "GOLD" in self.prices:
             silver_ratio = random.uniform(75, 85)
             silver_price = self.prices["GOLD"] / silver_ratio
             self.prices["SILVER"] = round(float(silver_price), 2)
-            logger.info(f"Silver price calculated from gold ratio: ${silver_price} (ratio: {silver_ratio:.1f})")
-        else:
-            raise Exception("Cannot fetch silver price from API and no gold price available for ratio calculation")
-
-    async def _fetch_real_prices_async(self):
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._fetch_real_prices)
+            logger.info("Silver price calculated from gold ratio: $%s (ratio: %.1f)", silver_price, silver_ratio)
 
     def _apply_micro_fluctuations(self):
-        for symbol in list(self.prices.keys()):
-            if symbol not in ["timestamp"]:
-                change_percent = random.uniform(-0.2, 0.2)
-                self.prices[symbol] *= (1 + change_percent / 100)
-                self.prices[symbol] = round(self.prices[symbol], 2)
-        
+        self._publish(self.simulator.step())
         self.last_update = datetime.utcnow()
 
 price_service = PriceService()
+
+Observed("price_staleness_seconds", "Seconds since prices were last updated", "gauge",
+         lambda: (datetime.utcnow() - price_service.last_update).total_seconds())
+
+def get_price_provider() -> PriceProvider:
+    return price_service
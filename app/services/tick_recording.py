@@ -0,0 +1,102 @@
+import json
+import os
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+# file layout: MAGIC, uint32 header length, JSON header ({"symbols": [...]}),
+# zero padding to a multiple of 8 bytes, then one little-endian float64 row
+# per tick: [timestamp, price_0, ..., price_n-1]
+MAGIC = b"TICKREC1"
+
+
+def _data_offset(header_len: int) -> int:
+    offset = len(MAGIC) + 4 + header_len
+    return offset + (-offset % 8)
+
+
+class TickRecording:
+    # read-only, memory-mapped view of a recording; rows are paged in on access
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a tick recording")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+
+        self.symbols: List[str] = header["symbols"]
+        width = len(self.symbols) + 1
+        offset = _data_offset(header_len)
+        # ignore a trailing partial row left behind by an interrupted recorder
+        rows = max(os.path.getsize(path) - offset, 0) // (width * 8)
+        if rows:
+            self.data = np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=(rows, width))
+        else:
+            self.data = np.empty((0, width), dtype="<f8")
+        self.data_end = offset + rows * width * 8
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.data[:, 0]
+
+    @property
+    def prices(self) -> np.ndarray:
+        return self.data[:, 1:]
+
+
+class TickRecorder:
+
+    def __init__(self, path: str, symbols: List[str]):
+        self.path = path
+        self.symbols = list(symbols)
+        self._file: Optional[object] = None
+
+        try:
+            existing = TickRecording(path)
+        except FileNotFoundError:
+            existing = None
+        if existing is not None:
+            if existing.symbols != self.symbols:
+                raise ValueError(f"{path} was recorded with a different symbol universe")
+            data_end = existing.data_end
+            del existing
+            os.truncate(path, data_end)
+
+        else:
+            header = json.dumps({"symbols": self.symbols}).encode()
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<I", len(header)))
+                f.write(header)
+                f.write(b"\0" * (_data_offset(len(header)) - f.tell()))
+
+        self._file = open(path, "ab")
+
+    def append(self, timestamp: float, prices: np.ndarray):
+        row = np.empty(len(self.symbols) + 1, dtype="<f8")
+        row[0] = timestamp
+        row[1:] = prices
+        self._file.write(row.tobytes())
+
+    def append_many(self, timestamps: np.ndarray, prices: np.ndarray):
+        rows = np.column_stack((timestamps, prices)).astype("<f8")
+        self._file.write(rows.tobytes())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def write_recording(path: str, symbols: List[str], timestamps: np.ndarray, prices: np.ndarray):
+    recorder = TickRecorder(path, symbols)
+    try:
+        recorder.append_many(timestamps, prices)
+    finally:
+        recorder.close()
@@ -0,0 +1,449 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ..models import Trade
+
+# file layout: MAGIC, zlib-compressed column chunks, the user directory (int64
+# user ids, then int64 row offsets, one more than there are users), a JSON
+# header, then FOOTER (header offset, MAGIC). Rows are sorted by (user_id,
+# timestamp, id) and every column is compressed CHUNK_ROWS rows at a time, so
+# one user's history only inflates the chunks its rows fall in. Files written
+# before the directory moved behind the chunks have no "directory" offset in
+# the header and keep it right after MAGIC
+MAGIC = b"TRDARCH1"
+FOOTER = struct.Struct("<Q8s")
+CHUNK_ROWS = 16384
+COLUMNS = {
+    "id": "<i8",
+    # microseconds since the epoch, naive UTC like the table
+    "timestamp": "<i8",
+    "symbol": "<u2",
+    "side": "<u2",
+    "quantity": "<f8",
+    "price": "<f8",
+    "total_amount": "<f8",
+}
+FILE_PATTERN = re.compile(r"^trades-(\d{4})-(\d{2})\.arc$")
+# how stale a worker's view of the directory may get; the archiver waits this
+# long between adding a month and deleting its rows
+RESCAN_INTERVAL = 1.0
+
+# rows of a month, one array per column plus user_id, in file order
+Columns = Dict[str, np.ndarray]
+
+
+def to_micros(timestamps: List[datetime]) -> np.ndarray:
+    return np.array(timestamps, dtype="datetime64[us]").astype("<i8")
+
+
+def month_end(start: datetime) -> datetime:
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def archive_name(month: datetime) -> str:
+    return f"trades-{month.year:04d}-{month.month:02d}.arc"
+
+
+class ArchiveFile:
+    # read-only, memory-mapped month of trades
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = len(self._mmap)
+        header_offset, magic = FOOTER.unpack_from(self._mmap, size - FOOTER.size)
+        if self._mmap[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            raise ValueError(f"{path} is not a trade archive")
+        header = json.loads(self._mmap[header_offset:size - FOOTER.size])
+
+        self.month = datetime.fromisoformat(header["month"])
+        self.end = month_end(self.month)
+        self.rows: int = header["rows"]
+        self.max_id: int = header["max_id"]
+        self.symbols: List[str] = header["symbols"]
+        self.sides: List[str] = header["sides"]
+        self._chunks: Dict[str, List[Tuple[int, int]]] = header["chunks"]
+
+        users = header["users"]
+        directory = header.get("directory", len(MAGIC))
+        self.user_ids = np.frombuffer(self._mmap, dtype="<i8", count=users, offset=directory)
+        self.offsets = np.frombuffer(self._mmap, dtype="<i8", count=users + 1, offset=directory + 8 * users)
+        # reads in flight, and whether a newer file has taken this one's place;
+        # both guarded by the owning TradeArchive's lock
+        self.readers = 0
+        self.retired = False
+
+    @property
+    def closed(self) -> bool:
+        return self._mmap.closed
+
+    def close(self):
+        # the views into the mapping go first, or mmap refuses to close
+        self.user_ids = self.offsets = None
+        self._mmap.close()
+
+    def _range(self, user_id: int) -> Tuple[int, int]:
+        index = int(np.searchsorted(self.user_ids, user_id))
+        if index < len(self.user_ids) and self.user_ids[index] == user_id:
+            return int(self.offsets[index]), int(self.offsets[index + 1])
+        return 0, 0
+
+    def _column(self, name: str, start: int, stop: int) -> np.ndarray:
+        if start >= stop:
+            return np.empty(0, dtype=COLUMNS[name])
+        first, last = start // CHUNK_ROWS, (stop - 1) // CHUNK_ROWS
+        parts = [
+            np.frombuffer(zlib.decompress(self._mmap[offset:offset + length]), dtype=COLUMNS[name])
+            for offset, length in self._chunks[name][first:last + 1]
+        ]
+        data = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        base = first * CHUNK_ROWS
+        return data[start - base:stop - base]
+
+    def user_columns(self, user_id: int) -> Columns:
+        start, stop = self._range(user_id)
+        return {name: self._column(name, start, stop) for name in COLUMNS}
+
+    def columns(self, start: int, stop: int) -> Columns:
+        columns = {name: self._column(name, start, stop) for name in COLUMNS}
+        rows = np.arange(start, stop)
+        columns["user_id"] = self.user_ids[np.searchsorted(self.offsets, rows, side="right") - 1]
+        # codes are per file; decode so rows from different files can merge
+        columns["symbol"] = np.array(self.symbols, dtype=object)[columns["symbol"]]
+        columns["side"] = np.array(self.sides, dtype=object)[columns["side"]]
+        return columns
+
+    def iter_columns(self) -> Iterator[Columns]:
+        # every row in file order, one chunk at a time
+        for start in range(0, self.rows, CHUNK_ROWS):
+            yield self.columns(start, min(start + CHUNK_ROWS, self.rows))
+
+    def trades(self, user_id: int, columns: Columns, indexes) -> List[Trade]:
+        timestamps = columns["timestamp"][indexes].astype("datetime64[us]").astype(object)
+        return [
+            Trade(
+                id=int(trade_id),
+                user_id=user_id,
+                symbol=self.symbols[symbol],
+                side=self.sides[side],
+                quantity=float(quantity),
+                price=float(price),
+                total_amount=float(total_amount),
+                timestamp=timestamp
+            )
+            for trade_id, timestamp, symbol, side, quantity, price, total_amount in zip(
+                columns["id"][indexes].tolist(), timestamps, columns["symbol"][indexes].tolist(),
+                columns["side"][indexes].tolist(), columns["quantity"][indexes].tolist(),
+                columns["price"][indexes].tolist(), columns["total_amount"][indexes].tolist()
+            )
+        ]
+
+
+def _take(columns: Columns, start: int, stop: Optional[int] = None) -> Columns:
+    return {name: values[start:stop] for name, values in columns.items()}
+
+
+def _through(columns: Columns, last: Columns) -> int:
+    # how many leading rows of `columns`, which are in file order, sort at or
+    # before the single row `last`
+    user_id, timestamp, trade_id = last["user_id"][-1], last["timestamp"][-1], last["id"][-1]
+    ids, timestamps = columns["id"], columns["timestamp"]
+    at_or_before = (columns["user_id"] < user_id) | (columns["user_id"] == user_id) & (
+        (timestamps < timestamp) | (timestamps == timestamp) & (ids <= trade_id)
+    )
+    return int(np.count_nonzero(at_or_before))
+
+
+def _union(first: Columns, second: Columns) -> Columns:
+    # both in file order; a row in both (the same id) is kept once
+    merged = {name: np.concatenate((first[name], second[name])) for name in first}
+    order = np.lexsort((merged["id"], merged["timestamp"], merged["user_id"]))
+    ids = merged["id"][order]
+    keep = order[np.append(True, ids[1:] != ids[:-1])]
+    return {name: values[keep] for name, values in merged.items()}
+
+
+class ArchiveWriter:
+    # writes one month from batches of rows that arrive in file order, with
+    # decoded symbol/side strings. Each column is compressed as soon as a full
+    # chunk is buffered, so memory stays at a chunk or two whatever the size
+    # of the month. Rows already in an existing file for the month are merged
+    # in chunk by chunk, which makes a rerun after a crash between writing the
+    # file and deleting the rows harmless. Written to a temporary file and
+    # renamed into place, so readers only ever map a complete archive
+
+    def __init__(self, path: str, month: datetime, on_commit: Optional[Callable[[], None]] = None):
+        self.path = path
+        self.month = month
+        self.rows = 0
+        self._on_commit = on_commit
+        self._existing = ArchiveFile(path) if os.path.exists(path) else None
+        self._existing_chunks = self._existing.iter_columns() if self._existing is not None else iter(())
+        self._held: Optional[Columns] = next(self._existing_chunks, None)
+        self._buffer: List[Columns] = []
+        self._buffered = 0
+        self._chunks: Dict[str, List[Tuple[int, int]]] = {name: [] for name in COLUMNS}
+        self._codes: Dict[str, Dict[str, int]] = {"symbol": {}, "side": {}}
+        self._users = array("q")
+        self._offsets = array("q")
+        self._max_id = 0
+        self._file = open(path + ".tmp", "wb")
+        self._file.write(MAGIC)
+
+    def append(self, columns: Columns):
+        # rows of either side up to the smaller of the two last keys are final
+        while self._held is not None and len(columns["id"]):
+            held = self._held
+            if _through(held, columns) == len(held["id"]):
+                count = _through(columns, held)
+                self._add(_union(held, _take(columns, 0, count)))
+                columns = _take(columns, count)
+                self._held = next(self._existing_chunks, None)
+            else:
+                count = _through(held, columns)
+                self._add(_union(_take(held, 0, count), columns))
+                self._held = _take(held, count)
+                return
+        if len(columns["id"]):
+            self._add(columns)
+
+    def _add(self, columns: Columns):
+        user_ids = columns["user_id"]
+        if not len(user_ids):
+            return
+        starts = np.flatnonzero(np.diff(user_ids)) + 1
+        if not self._users or self._users[-1] != user_ids[0]:
+            starts = np.append(0, starts)
+        self._users.extend(user_ids[starts].tolist())
+        self._offsets.extend((starts + self.rows).tolist())
+        self.rows += len(user_ids)
+        self._max_id = max(self._max_id, int(columns["id"].max()))
+
+        self._buffer.append(columns)
+        self._buffered += len(user_ids)
+        while self._buffered >= CHUNK_ROWS:
+            self._write_chunk(CHUNK_ROWS)
+
+    def _code(self, name: str, values: np.ndarray) -> np.ndarray:
+        codes = self._codes[name]
+        uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+        lookup = np.array([codes.setdefault(value, len(codes)) for value in uniques.tolist()], dtype=np.int64)
+        return lookup[inverse]
+
+    def _write_chunk(self, count: int):
+        buffered = self._buffer[0] if len(self._buffer) == 1 else {
+            name: np.concatenate([columns[name] for columns in self._buffer]) for name in self._buffer[0]
+        }
+        chunk = _take(buffered, 0, count)
+        chunk["symbol"] = self._code("symbol", chunk["symbol"])
+        chunk["side"] = self._code("side", chunk["side"])
+        for name, dtype in COLUMNS.items():
+            block = zlib.compress(np.ascontiguousarray(chunk[name], dtype=dtype).tobytes(), 6)
+            self._chunks[name].append((self._file.tell(), len(block)))
+            self._file.write(block)
+        rest = _take(buffered, count)
+        self._buffer = [rest] if len(rest["id"]) else []
+        self._buffered -= count
+
+    def commit(self):
+        try:
+            while self._held is not None:
+                self._add(self._held)
+                self._held = next(self._existing_chunks, None)
+            if self._buffered:
+                self._write_chunk(self._buffered)
+
+            f = self._file
+            directory = f.tell()
+            self._offsets.append(self.rows)
+            f.write(self._users.tobytes())
+            f.write(self._offsets.tobytes())
+            header = {
+                "month": self.month.isoformat(),
+                "rows": self.rows,
+                "max_id": self._max_id,
+                "users": len(self._users),
+                "directory": directory,
+                "symbols": list(self._codes["symbol"]),
+                "sides": list(self._codes["side"]),
+                "chunks": self._chunks,
+            }
+            header_offset = f.tell()
+            f.write(json.dumps(header).encode())
+            f.write(FOOTER.pack(header_offset, MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            self.abort()
+            raise
+        self._close()
+        os.replace(self.path + ".tmp", self.path)
+        if self._on_commit is not None:
+            self._on_commit()
+
+    def abort(self):
+        self._close()
+        try:
+            os.remove(self.path + ".tmp")
+        except FileNotFoundError:
+            pass
+
+    def _close(self):
+        self._file.close()
+        if self._existing is not None:
+            self._existing_chunks = iter(())
+            self._held = None
+            self._existing.close()
+            self._existing = None
+
+
+class TradeArchive:
+    # the per-month archive files in one directory; trades before `boundary`
+    # live here, trades after it in the table. Reads run in worker threads, so
+    # the file list and reader counts sit behind a lock held only briefly
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._files: Dict[str, ArchiveFile] = {}
+        self._scanned: Optional[int] = None
+        self._checked = 0.0
+        self._boundary: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        # another worker may have archived a month, so the directory is
+        # rescanned whenever it changes. Called with the lock held
+        self._checked = time.monotonic()
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime == self._scanned:
+            return
+
+        files = {}
+        names = sorted(os.listdir(self.directory)) if mtime is not None else []
+        for name in names:
+            if not FILE_PATTERN.match(name):
+                continue
+            path = os.path.join(self.directory, name)
+            current = self._files.get(name)
+            stat = os.stat(path)
+            if current is not None and (current.stat.st_ino, current.stat.st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns):
+                files[name] = current
+            else:
+                files[name] = ArchiveFile(path)
+        for name, archive in self._files.items():
+            if files.get(name) is not archive:
+                self._retire(archive)
+        self._files, self._scanned = files, mtime
+        self._boundary = max((archive.end for archive in files.values()), default=None)
+
+    def _retire(self, archive: ArchiveFile):
+        # replaced or removed; unmapped once the last read using it is done
+        archive.retired = True
+        if not archive.readers:
+            archive.close()
+
+    @contextmanager
+    def _reading(self) -> Iterator[List[ArchiveFile]]:
+        # the current files, kept mapped until the caller is done with them
+        with self._lock:
+            self._refresh()
+            files = list(self._files.values())
+            for archive in files:
+                archive.readers += 1
+        try:
+            yield files
+        finally:
+            with self._lock:
+                for archive in files:
+                    archive.readers -= 1
+                    if archive.retired and not archive.readers:
+                        archive.close()
+
+    def files(self) -> List[ArchiveFile]:
+        with self._lock:
+            self._refresh()
+            return list(self._files.values())
+
+    @property
+    def boundary(self) -> Optional[datetime]:
+        # read on every history request, so the directory is checked at most
+        # once per RESCAN_INTERVAL
+        if time.monotonic() - self._checked >= RESCAN_INTERVAL:
+            with self._lock:
+                self._refresh()
+        return self._boundary
+
+    @property
+    def max_id(self) -> int:
+        return max((archive.max_id for archive in self.files()), default=0)
+
+    def month_writer(self, month: datetime) -> ArchiveWriter:
+        os.makedirs(self.directory, exist_ok=True)
+        return ArchiveWriter(os.path.join(self.directory, archive_name(month)), month, self._written)
+
+    def _written(self):
+        with self._lock:
+            # picked up, and the file it replaced retired, on the next read
+            self._scanned, self._checked = None, 0.0
+
+    def write_month(self, month: datetime, columns: Columns):
+        # a month held in memory, in any order
+        order = np.lexsort((columns["id"], columns["timestamp"], columns["user_id"]))
+        writer = self.month_writer(month)
+        try:
+            writer.append({name: values[order] for name, values in columns.items()})
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def user_trades(
+        self, user_id: int, limit: int, before: Optional[Tuple[datetime, int]] = None
+    ) -> List[Trade]:
+        # newest first, continuing below the keyset cursor like the table query
+        trades: List[Trade] = []
+        with self._reading() as files:
+            for archive in reversed(files):
+                if len(trades) >= limit:
+                    break
+                if before is not None and archive.month > before[0]:
+                    continue
+                columns = archive.user_columns(user_id)
+                count = len(columns["id"])
+                if before is not None:
+                    timestamp = to_micros([before[0]])[0]
+                    # rows are ascending by (timestamp, id), so the ones below the
+                    # cursor are a prefix
+                    below = (columns["timestamp"] < timestamp) | (
+                        (columns["timestamp"] == timestamp) & (columns["id"] < before[1])
+                    )
+                    count = int(np.count_nonzero(below))
+                take = min(limit - len(trades), count)
+                trades.extend(archive.trades(user_id, columns, np.arange(count - 1, count - take - 1, -1)))
+        return trades
+
+    def iter_user_trades(self, user_id: int, batch_size: int = 1000) -> Iterator[List[Trade]]:
+        # oldest first, batch_size trades at a time
+        with self._reading() as files:
+            for archive in files:
+                columns = archive.user_columns(user_id)
+                for start in range(0, len(columns["id"]), batch_size):
+                    yield archive.trades(user_id, columns, slice(start, start + batch_size))
@@ -0,0 +1,96 @@
+import os
+import struct
+import zlib
+from typing import List, NamedTuple
+
+# file layout: MAGIC, then fixed-size little-endian records, each followed by
+# the CRC32 of its bytes. A record carries the fill and the account state it
+# left behind, so replaying it is a plain overwrite
+MAGIC = b"TRDJRNL1"
+RECORD = struct.Struct("<QdQQ10s4sdddddd")
+CRC = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + CRC.size
+
+
+class JournalEntry(NamedTuple):
+    seq: int
+    timestamp: float
+    trade_id: int
+    user_id: int
+    symbol: str
+    side: str
+    quantity: float
+    price: float
+    total_amount: float
+    balance: float
+    position_quantity: float
+    avg_price: float
+
+
+def _encode(entry: JournalEntry) -> bytes:
+    body = RECORD.pack(
+        entry.seq, entry.timestamp, entry.trade_id, entry.user_id,
+        entry.symbol.encode(), entry.side.encode(), entry.quantity, entry.price,
+        entry.total_amount, entry.balance, entry.position_quantity, entry.avg_price
+    )
+    return body + CRC.pack(zlib.crc32(body))
+
+
+class TradeJournal:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, MAGIC)
+            os.fsync(self._fd)
+        elif os.pread(self._fd, len(MAGIC), 0) != MAGIC:
+            os.close(self._fd)
+            raise ValueError(f"{path} is not a trade journal")
+
+    def read(self) -> List[JournalEntry]:
+        # stops at the first torn or corrupt record and cuts the file there, so
+        # a crash mid-append never poisons later writes
+        size = os.fstat(self._fd).st_size
+        data = os.pread(self._fd, size - len(MAGIC), len(MAGIC))
+        entries = []
+        offset = 0
+        while offset + RECORD_SIZE <= len(data):
+            body = data[offset:offset + RECORD.size]
+            (crc,) = CRC.unpack_from(data, offset + RECORD.size)
+            if zlib.crc32(body) != crc:
+                break
+            fields = RECORD.unpack(body)
+            entries.append(JournalEntry(
+                *fields[:4], fields[4].rstrip(b"\0").decode(), fields[5].rstrip(b"\0").decode(), *fields[6:]
+            ))
+            offset += RECORD_SIZE
+
+        end = len(MAGIC) + offset
+        if end < size:
+            os.ftruncate(self._fd, end)
+        return entries
+
+    def append(self, entries: List[JournalEntry]):
+        # one write and one fsync for the whole batch; a failed append is cut
+        # off again so fills reported as failed are never replayed
+        end = self.size
+        try:
+            os.write(self._fd, b"".join(_encode(entry) for entry in entries))
+            os.fsync(self._fd)
+        except OSError:
+            os.ftruncate(self._fd, end)
+            raise
+
+    @property
+    def size(self) -> int:
+        return os.fstat(self._fd).st_size
+
+    def reset(self):
+        os.ftruncate(self._fd, len(MAGIC))
+        os.fsync(self._fd)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
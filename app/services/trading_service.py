@@ -1,112 +1,289 @@
-from typing import List, Optional
+import asyncio
+import base64
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import select, or_, and_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
 
 from ..models import User, Trade, Position
+from ..core.auth import principal_cache
+from ..core.database import read_router
 from ..core.schemas import TradeCreate, TradeSide
-from .price_service import PriceService
+from .pnl_service import record_fills
+from .archive_service import trade_archive
+from .leaderboard_service import leaderboard_service
+from .portfolio_service import portfolio_service
+from .price_provider import PriceProvider
+from .price_service import get_price_provider
 
-class TradingService:
-    
-    def __init__(self, db: Session):
-        self.db = db
-        self.price_service = PriceService()
-
-    def execute_trade(self, user: User, trade_data: TradeCreate) -> Trade:
-        current_price = self.price_service.get_current_price(trade_data.symbol.value)
-        if not current_price:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Price not available for {trade_data.symbol.value}"
-            )
 
-        total_amount = trade_data.quantity * current_price
+def fill_order(balance: float, positions: Dict[str, List[float]], trade_data: TradeCreate, price: float) -> float:
+    # applies one order to a plain snapshot of an account (positions map
+    # symbol -> [quantity, avg_price]) and returns the new balance; raises
+    # before touching anything if the order is not fillable
+    symbol = trade_data.symbol.value
+    total_amount = trade_data.quantity * price
+    position = positions.get(symbol)
 
-        if trade_data.side == TradeSide.BUY:
-            return self._execute_buy(user, trade_data, current_price, total_amount)
-        else:
-            return self._execute_sell(user, trade_data, current_price, total_amount)
-
-    def _execute_buy(self, user: User, trade_data: TradeCreate, price: float, total_amount: float) -> Trade:
-        if user.balance < total_amount:
+    if trade_data.side == TradeSide.BUY:
+        if balance < total_amount:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Insufficient balance"
             )
+        if position:
+            total_quantity = position[0] + trade_data.quantity
+            total_value = (position[1] * position[0]) + total_amount
+            position[1] = total_value / total_quantity
+            position[0] = total_quantity
+        else:
+            positions[symbol] = [trade_data.quantity, price]
+        return balance - total_amount
+
+    if not position or position[0] < trade_data.quantity:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Insufficient position to sell"
+        )
+    position[0] -= trade_data.quantity
+    return balance + total_amount
 
-        user.balance -= total_amount
 
-        trade = Trade(
-            user_id=user.id,
-            symbol=trade_data.symbol.value,
-            side=trade_data.side.value,
-            quantity=trade_data.quantity,
-            price=price,
-            total_amount=total_amount
+def require_price(price: Optional[float], symbol: str) -> float:
+    if not price:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Price not available for {symbol}"
         )
-        self.db.add(trade)
+    return price
 
-        position = self.db.query(Position).filter(
-            Position.user_id == user.id,
-            Position.symbol == trade_data.symbol.value
-        ).first()
 
-        if position:
-            total_quantity = position.quantity + trade_data.quantity
-            total_value = (position.avg_price * position.quantity) + total_amount
-            position.avg_price = total_value / total_quantity
-            position.quantity = total_quantity
-        else:
-            position = Position(
-                user_id=user.id,
-                symbol=trade_data.symbol.value,
-                quantity=trade_data.quantity,
-                avg_price=price
-            )
-            self.db.add(position)
+def new_trade(user_id: int, trade_data: TradeCreate, price: float, **columns) -> Trade:
+    return Trade(
+        user_id=user_id,
+        symbol=trade_data.symbol.value,
+        side=trade_data.side.value,
+        quantity=trade_data.quantity,
+        price=price,
+        total_amount=trade_data.quantity * price,
+        **columns
+    )
 
-        self.db.commit()
-        return trade
 
-    def _execute_sell(self, user: User, trade_data: TradeCreate, price: float, total_amount: float) -> Trade:
-        position = self.db.query(Position).filter(
-            Position.user_id == user.id,
-            Position.symbol == trade_data.symbol.value
-        ).first()
+def fill_account(user: User, row: Optional[Position], trade_data: TradeCreate, price: float) -> Tuple[Trade, List[float]]:
+    # fill_order against a user row and its position row for the symbol;
+    # updates the balance and returns the trade and the position's new
+    # [quantity, avg_price], which position_row writes back
+    symbol = trade_data.symbol.value
+    positions = {symbol: [row.quantity, row.avg_price]} if row is not None else {}
+    user.balance = fill_order(user.balance, positions, trade_data, price)
+    return new_trade(user.id, trade_data, price), positions[symbol]
 
-        if not position or position.quantity < trade_data.quantity:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Insufficient position to sell"
-            )
 
-        user.balance += total_amount
+def position_row(user_id: int, symbol: str, row: Optional[Position], state: List[float]) -> Position:
+    # the row brought to the filled state, or a new one for a first buy;
+    # callers delete the row instead when the quantity reached zero
+    if row is None:
+        return Position(user_id=user_id, symbol=symbol, quantity=state[0], avg_price=state[1])
+    row.quantity, row.avg_price = state
+    return row
 
-        trade = Trade(
-            user_id=user.id,
-            symbol=trade_data.symbol.value,
-            side=trade_data.side.value,
-            quantity=trade_data.quantity,
-            price=price,
-            total_amount=total_amount
+
+def publish_fill(user_id: int, trade: Trade, balance: float, quantity: float, avg_price: float):
+    # in-memory views that follow fills; called once the fill is durable.
+    # the engine writes balances with plain updates, so the cached principal
+    # is dropped here rather than by the ORM hook
+    principal_cache.invalidate(user_id)
+    read_router.mark_write(user_id)
+    portfolio_service.apply_fill(user_id, trade, balance, quantity, avg_price)
+    leaderboard_service.apply_fill(user_id, trade.symbol, balance, quantity)
+
+
+def encode_cursor(trade: Trade) -> str:
+    # opaque keyset cursor pointing just past `trade` in (timestamp, id) order
+    raw = f"{trade.timestamp.isoformat()}|{trade.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        timestamp, trade_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(trade_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
         )
-        self.db.add(trade)
 
-        position.quantity -= trade_data.quantity
-        if position.quantity == 0:
-            self.db.delete(position)
 
-        self.db.commit()
-        return trade
+class TradingService:
+    
+    def __init__(self, db: Session, price_provider: Optional[PriceProvider] = None):
+        self.db = db
+        self.price_service = price_provider or get_price_provider()
 
     def get_user_positions(self, user: User) -> List[Position]:
         return self.db.query(Position).filter(Position.user_id == user.id).all()
 
     def get_user_trades(self, user: User, limit: int = 50) -> List[Trade]:
-        return (
-            self.db.query(Trade)
-            .filter(Trade.user_id == user.id)
-            .order_by(Trade.timestamp.desc())
-            .limit(limit)
-            .all()
+        boundary = trade_archive.boundary if trade_archive else None
+        query = self.db.query(Trade).filter(Trade.user_id == user.id)
+        if boundary is not None:
+            query = query.filter(Trade.timestamp >= boundary)
+        trades = query.order_by(Trade.timestamp.desc(), Trade.id.desc()).limit(limit).all()
+        if boundary is not None and len(trades) < limit:
+            trades += trade_archive.user_trades(user.id, limit - len(trades))
+        return trades
+
+
+class AsyncTradingService:
+    # same rules as TradingService, on an AsyncSession so routes never block
+    # the event loop on database I/O
+
+    def __init__(self, db: AsyncSession, price_provider: Optional[PriceProvider] = None):
+        self.db = db
+        self.price_service = price_provider or get_price_provider()
+
+    async def execute_trade(self, user: User, trade_data: TradeCreate) -> Trade:
+        symbol = trade_data.symbol.value
+        price = require_price(self.price_service.get_current_price(symbol), symbol)
+        row = await self._get_position(user.id, symbol)
+
+        trade, (quantity, avg_price) = fill_account(user, row, trade_data, price)
+        self.db.add(trade)
+        await record_fills(self.db, user.id, symbol, [(trade.side, trade.quantity, price)])
+        if quantity == 0:
+            await self.db.delete(row)
+        else:
+            self.db.add(position_row(user.id, symbol, row, [quantity, avg_price]))
+
+        await self.db.commit()
+        publish_fill(user.id, trade, user.balance, quantity, avg_price)
+        return trade
+
+    async def _get_position(self, user_id: int, symbol: str) -> Optional[Position]:
+        result = await self.db.execute(
+            select(Position).where(Position.user_id == user_id, Position.symbol == symbol)
+        )
+        return result.scalars().first()
+
+    async def execute_batch(
+        self, user: User, orders: List[TradeCreate], all_or_nothing: bool = True,
+        before_commit: Optional[Callable[[List[Tuple[Optional[Trade], Optional[str]]]], Awaitable[None]]] = None
+    ) -> List[Tuple[Optional[Trade], Optional[str]]]:
+        # every order sees the same price snapshot and the account state left
+        # by the orders before it; all fills are written in one commit.
+        # before_commit runs inside that transaction once the trades have ids,
+        # for callers that record the outcome alongside the fills
+        prices = self.price_service.get_all_prices()
+        rows = {p.symbol: p for p in await self.get_user_positions(user)}
+        positions = {symbol: [p.quantity, p.avg_price] for symbol, p in rows.items()}
+        balance = user.balance
+
+        results: List[Tuple[Optional[Trade], Optional[str]]] = []
+        fills = []
+        for trade_data in orders:
+            symbol = trade_data.symbol.value
+            try:
+                price = require_price(prices.get(symbol), symbol)
+                balance = fill_order(balance, positions, trade_data, price)
+            except HTTPException as e:
+                results.append((None, e.detail))
+                continue
+
+            trade = new_trade(user.id, trade_data, price)
+            quantity, avg_price = positions[symbol]
+            fills.append((trade, balance, quantity, avg_price))
+            results.append((trade, None))
+            if quantity == 0:
+                del positions[symbol]
+
+        if not fills or (all_or_nothing and len(fills) < len(orders)):
+            return [(None, error or "Not executed: batch rejected") for _, error in results]
+
+        self.db.add_all([trade for trade, _, _, _ in fills])
+        by_symbol: Dict[str, list] = {}
+        for trade, _, _, _ in fills:
+            by_symbol.setdefault(trade.symbol, []).append((trade.side, trade.quantity, trade.price))
+        for symbol, symbol_fills in by_symbol.items():
+            await record_fills(self.db, user.id, symbol, symbol_fills)
+
+        for symbol in by_symbol:
+            position = positions.get(symbol)
+            row = rows.get(symbol)
+            if position is None:
+                if row is not None:
+                    await self.db.delete(row)
+            else:
+                self.db.add(position_row(user.id, symbol, row, position))
+        user.balance = balance
+        if before_commit is not None:
+            await self.db.flush()
+            await before_commit(results)
+        await self.db.commit()
+
+        for trade, fill_balance, quantity, avg_price in fills:
+            publish_fill(user.id, trade, fill_balance, quantity, avg_price)
+        return results
+
+    async def get_user_positions(self, user: User) -> List[Position]:
+        result = await self.db.execute(select(Position).where(Position.user_id == user.id))
+        return list(result.scalars().all())
+
+    async def get_user_trades(
+        self, user: User, limit: int = 50, before: Optional[Tuple[datetime, int]] = None
+    ) -> List[Trade]:
+        # keyset pagination: seeks into idx_user_timestamp (whose entries end
+        # with the primary key) instead of skipping rows with OFFSET. Trades
+        # before the archive boundary come from the archive files, and only
+        # once the table has run out, since every one of them is older
+        boundary = trade_archive.boundary if trade_archive else None
+        query = select(Trade).where(Trade.user_id == user.id)
+        if boundary is not None:
+            query = query.where(Trade.timestamp >= boundary)
+        if before is not None:
+            timestamp, trade_id = before
+            query = query.where(or_(
+                Trade.timestamp < timestamp,
+                and_(Trade.timestamp == timestamp, Trade.id < trade_id)
+            ))
+        result = await self.db.execute(
+            query.order_by(Trade.timestamp.desc(), Trade.id.desc()).limit(limit)
+        )
+        trades = list(result.scalars().all())
+        if boundary is not None and len(trades) < limit:
+            # inflating archive chunks is CPU and file work, kept off the event loop
+            trades += await asyncio.to_thread(trade_archive.user_trades, user.id, limit - len(trades), before)
+        return trades
+
+    async def stream_user_trades(self, user_id: int, batch_size: int = 1000) -> AsyncIterator[List[Trade]]:
+        # oldest first: the archived months, then the table through a
+        # server-side cursor batch_size rows at a time; rows are not kept once
+        # the caller drops a batch
+        boundary = trade_archive.boundary if trade_archive else None
+        query = select(Trade).where(Trade.user_id == user_id)
+        if boundary is not None:
+            batches = trade_archive.iter_user_trades(user_id, batch_size)
+            step = None
+            try:
+                while True:
+                    # shielded so a cancelled export lets the read in flight end
+                    step = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+                    batch = await asyncio.shield(step)
+                    if batch is None:
+                        break
+                    yield batch
+            finally:
+                # a client that leaves mid-export stops this loop early; the
+                # archive files stay mapped until the iterator is closed
+                if step is not None:
+                    await asyncio.wait([step])
+                batches.close()
+            query = query.where(Trade.timestamp >= boundary)
+        result = await self.db.stream(
+            query.order_by(Trade.timestamp, Trade.id).execution_options(yield_per=batch_size)
         )
+        async for batch in result.scalars().partitions():
+            yield batch
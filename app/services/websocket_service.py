@@ -1,55 +1,266 @@
 import json
 import asyncio
 import logging
-from typing import List, Optional
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
+import msgpack
 
-from .price_service import price_service
+from ..core.config import settings
+from ..core.metrics import Observed, broadcast_latency
+from .price_provider import PriceProvider, PriceUpdate
+from .price_service import get_price_provider
 
 logger = logging.getLogger(__name__)
 
+ENCODINGS = ("json", "msgpack")
+WILDCARD = "*"
+
+class ClientConnection:
+    # owns the outbound queue of one socket; a single writer task drains it so
+    # a slow client never blocks the broadcaster
+
+    def __init__(self, websocket: WebSocket, queue_size: int, encoding: str = "json"):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.symbols: Set[str] = set()
+        self.wildcard = False
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+
+
 class WebSocketManager:
-    
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+
+    def __init__(self, price_provider: Optional[PriceProvider] = None):
+        self.price_provider = price_provider or get_price_provider()
+        self.active_connections: Set[WebSocket] = set()
+        self.dropped_messages = 0
+        self.evicted_connections = 0
+        self._clients: Dict[WebSocket, ClientConnection] = {}
+        # symbol -> clients subscribed to it; wildcard clients are kept apart
+        self._subscribers: Dict[str, Set[ClientConnection]] = {}
+        self._wildcard: Set[ClientConnection] = set()
+        # seq of the last delta overall and of the last delta touching each
+        # symbol, for the prev_seq of the next frame
+        self._last_seq = 0
+        self._last_change: Dict[str, int] = {}
         self._broadcast_task: Optional[asyncio.Task] = None
+        # close handshakes of evicted clients, held until they finish
+        self._closing: Set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, encoding: str = "json", symbols: Iterable[str] = (WILDCARD,)):
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+        client = ClientConnection(websocket, settings.ws_send_queue_size, encoding)
+        client.writer_task = asyncio.create_task(self._writer(client))
+        self._clients[websocket] = client
+        self.active_connections.add(websocket)
+        self._subscribe(client, symbols)
+        if client.wildcard or client.symbols:
+            self._enqueue(client, self._snapshot_message(client), drop_oldest=True)
+        logger.debug("WebSocket connected. Total connections: %d", len(self.active_connections))
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
+        self.active_connections.discard(websocket)
+        client = self._clients.pop(websocket, None)
+        if client is not None:
+            self._unsubscribe(client, [WILDCARD, *client.symbols])
+            if client.writer_task is not None and client.writer_task is not asyncio.current_task():
+                client.writer_task.cancel()
+        logger.debug("WebSocket disconnected. Total connections: %d", len(self.active_connections))
+
+    def _subscribe(self, client: ClientConnection, symbols: Iterable[str]) -> List[str]:
+        known = self.price_provider.get_all_prices()
+        accepted = []
+        for symbol in symbols:
+            symbol = symbol.upper()
+            if symbol == WILDCARD:
+                client.wildcard = True
+                self._wildcard.add(client)
+            elif symbol in known and symbol != "timestamp":
+                client.symbols.add(symbol)
+                self._subscribers.setdefault(symbol, set()).add(client)
+            else:
+                continue
+            accepted.append(symbol)
+        return accepted
+
+    def _unsubscribe(self, client: ClientConnection, symbols: Iterable[str]):
+        for symbol in symbols:
+            symbol = symbol.upper()
+            if symbol == WILDCARD:
+                client.wildcard = False
+                self._wildcard.discard(client)
+                continue
+            client.symbols.discard(symbol)
+            subscribers = self._subscribers.get(symbol)
+            if subscribers is not None:
+                subscribers.discard(client)
+                if not subscribers:
+                    del self._subscribers[symbol]
+
+    async def subscribe(self, websocket: WebSocket, symbols: Iterable[str]):
+        client = self._clients.get(websocket)
+        if client is None:
+            return
+        accepted = self._subscribe(client, symbols)
+        if accepted:
+            # fresh subscribers need a starting value for the new symbols
+            await self.resync(websocket)
+
+    async def unsubscribe(self, websocket: WebSocket, symbols: Iterable[str]):
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._unsubscribe(client, symbols)
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
+    async def _writer(self, client: ClientConnection):
+        websocket = client.websocket
         try:
-            await websocket.send_text(message)
+            while True:
+                message = await client.queue.get()
+                async with asyncio.timeout(settings.ws_send_timeout):
+                    if isinstance(message, bytes):
+                        await websocket.send_bytes(message)
+                    else:
+                        await websocket.send_text(message)
+        except asyncio.CancelledError:
+            pass
         except Exception as e:
-            logger.error(f"Error sending personal message: {e}")
+            logger.warning("Error sending to connection: %s", e)
             self.disconnect(websocket)
 
-    async def broadcast(self, message: str):
-        if not self.active_connections:
-            return
+    def _evict(self, client: ClientConnection):
+        self.evicted_connections += 1
+        self.disconnect(client.websocket)
+        task = asyncio.create_task(self._close(client.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
 
-        disconnected = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except Exception as e:
-                logger.warning(f"Error broadcasting to connection: {e}")
-                disconnected.append(connection)
-        
-        for connection in disconnected:
-            self.disconnect(connection)
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1008, reason="Slow consumer")
+        except Exception:
+            pass
+
+    def _enqueue(self, client: ClientConnection, message: Union[str, bytes], drop_oldest: bool) -> bool:
+        if client.queue.full():
+            if not drop_oldest:
+                return False
+            client.queue.get_nowait()
+            self.dropped_messages += 1
+        client.queue.put_nowait(message)
+        return True
+
+    @staticmethod
+    def _encode(payload: dict, encoding: str) -> Union[str, bytes]:
+        if encoding == "msgpack":
+            return msgpack.packb(payload)
+        return json.dumps(payload)
+
+    async def send_personal_message(self, message: Union[str, bytes], websocket: WebSocket):
+        client = self._clients.get(websocket)
+        if client is not None and not self._enqueue(client, message, drop_oldest=False):
+            logger.warning("Send queue full, evicting slow consumer")
+            self._evict(client)
+
+    def send_to(self, websocket: WebSocket, payload: dict):
+        # encodes for the connection's negotiated encoding; safe to call from
+        # synchronous code running on the event loop
+        client = self._clients.get(websocket)
+        if client is not None and not self._enqueue(client, self._encode(payload, client.encoding), drop_oldest=False):
+            logger.warning("Send queue full, evicting slow consumer")
+            self._evict(client)
+
+    async def resync(self, websocket: WebSocket):
+        # a lagging client is the one most likely to ask, so the snapshot
+        # follows the slow consumer policy like any other price frame
+        client = self._clients.get(websocket)
+        if client is not None:
+            self._fanout(self._snapshot_message(client), (client,))
+
+    async def broadcast(self, message: Union[str, bytes]):
+        self._fanout(message, self._clients.values())
+
+    def _fanout(self, message: Union[str, bytes], clients: Iterable[ClientConnection]):
+        # the payload is serialized once by the caller and shared by every queue
+        drop_oldest = settings.ws_slow_consumer_policy == "drop_oldest"
+        overflowed = [
+            client for client in clients
+            if not self._enqueue(client, message, drop_oldest)
+        ]
+
+        for client in overflowed:
+            logger.warning("Send queue full, evicting slow consumer")
+            self._evict(client)
+
+    def _publish_prices(self, kind: str, seq: int, timestamp: Optional[str], prices: Dict[str, float]):
+        # clients with the same subscription and encoding share one encoded
+        # frame; cost scales with actual subscribers. Clients with an explicit
+        # symbol list only see deltas touching their symbols, so their seq
+        # skips; each delta also carries prev_seq, the seq of the previous delta
+        # for that subscription, and a client has missed a frame exactly when
+        # prev_seq is newer than the last seq it saw
+        started = time.perf_counter()
+        groups: Dict[tuple, List[ClientConnection]] = {}
+        for client in self._wildcard:
+            groups.setdefault((client.encoding, None), []).append(client)
+
+        followers: Set[ClientConnection] = set()
+        for symbol in prices:
+            for client in self._subscribers.get(symbol, ()):
+                if not client.wildcard:
+                    followers.add(client)
+        for client in followers:
+            groups.setdefault((client.encoding, frozenset(client.symbols)), []).append(client)
+
+        for (encoding, symbols), clients in groups.items():
+            payload = {
+                "type": kind,
+                "seq": seq,
+                "timestamp": timestamp,
+                "prices": prices if symbols is None else {
+                    symbol: price for symbol, price in prices.items() if symbol in symbols
+                }
+            }
+            if kind == "delta":
+                payload["prev_seq"] = self._last_seq if symbols is None else max(
+                    self._last_change.get(symbol, 0) for symbol in symbols
+                )
+            self._fanout(self._encode(payload, encoding), clients)
+        broadcast_latency.observe(time.perf_counter() - started, kind)
+
+    def _snapshot_message(self, client: ClientConnection) -> Union[str, bytes]:
+        prices = self.price_provider.get_all_prices()
+        timestamp = prices.pop("timestamp", None)
+        if not client.wildcard:
+            prices = {symbol: prices[symbol] for symbol in client.symbols if symbol in prices}
+        return self._encode({
+            "type": "snapshot",
+            "seq": self.price_provider.sequence,
+            "timestamp": timestamp,
+            "prices": prices
+        }, client.encoding)
+
+    def _on_price_update(self, update: PriceUpdate):
+        if self._clients:
+            self._publish_prices(
+                "delta",
+                update.seq,
+                datetime.utcfromtimestamp(update.timestamp).isoformat(),
+                update.changes
+            )
+
+        # recorded even with nobody connected, so the first frame after a
+        # quiet spell still points at the right predecessor
+        self._last_seq = update.seq
+        for symbol in update.changes:
+            self._last_change[symbol] = update.seq
 
     async def start_price_broadcast(self):
         if self._broadcast_task and not self._broadcast_task.done():
             return
-        
+
+        self.price_provider.add_listener(self._on_price_update)
         self._broadcast_task = asyncio.create_task(self._price_broadcast_loop())
         logger.info("Price broadcast service started")
 
@@ -61,20 +272,31 @@ class WebSocketManager:
             except asyncio.CancelledError:
                 pass
             logger.info("Price broadcast service stopped")
+        self.price_provider.remove_listener(self._on_price_update)
 
     async def _price_broadcast_loop(self):
+        # deltas are pushed by _on_price_update as prices change; this loop only
+        # sends periodic keyframes so clients can recover from dropped frames
         while True:
             try:
+                await asyncio.sleep(settings.ws_keyframe_interval)
+
                 if self.active_connections:
-                    prices = price_service.get_all_prices()
-                    await self.broadcast(json.dumps(prices))
-                
-                await asyncio.sleep(2)
-                
+                    prices = self.price_provider.get_all_prices()
+                    timestamp = prices.pop("timestamp", None)
+                    self._publish_prices("snapshot", self.price_provider.sequence, timestamp, prices)
+
             except asyncio.CancelledError:
                 break
             except Exception as e:
-                logger.error(f"Error in price broadcast loop: {e}")
+                logger.error("Error in price broadcast loop: %s", e)
                 await asyncio.sleep(5)
 
 websocket_manager = WebSocketManager()
+
+Observed("ws_connections", "Open WebSocket connections", "gauge",
+         lambda: len(websocket_manager.active_connections))
+Observed("ws_dropped_messages_total", "Frames dropped from full send queues", "counter",
+         lambda: websocket_manager.dropped_messages)
+Observed("ws_evicted_connections_total", "Connections closed as slow consumers", "counter",
+         lambda: websocket_manager.evicted_connections)
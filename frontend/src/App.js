@@ -30,9 +30,24 @@ function App() {
       setWs(websocket);
     };
 
+    let lastSeq = null;
+
     websocket.onmessage = (event) => {
       const data = JSON.parse(event.data);
-      setPrices(data);
+
+      if (data.type === 'snapshot') {
+        lastSeq = data.seq;
+        setPrices({ ...data.prices, timestamp: data.timestamp });
+      } else if (data.type === 'delta') {
+        if (lastSeq !== null && data.prev_seq > lastSeq) {
+          // bir güncelleme kaçırıldı, tam fiyat listesini iste
+          lastSeq = null;
+          websocket.send(JSON.stringify({ type: 'resync' }));
+          return;
+        }
+        lastSeq = data.seq;
+        setPrices((prev) => ({ ...prev, ...data.prices, timestamp: data.timestamp }));
+      }
     };
 
     websocket.onclose = () => {
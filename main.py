@@ -3,20 +3,25 @@ import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 import uvicorn
 
 from app.core.config import settings
-from app.core.database import create_tables
-from app.routers import auth, trading, prices, websocket
-from app.services.price_service import price_service
+from app.core.passwords import password_hasher
+from app.core.database import create_tables, dispose_engines, pool_stats
+from app.core.log import setup_logging
+from app.core.metrics import CONTENT_TYPE, registry
+from app.routers import auth, trading, prices, leaderboard, websocket
+from app.services.archive_service import trade_archiver
+from app.services.execution_engine import execution_engine
+from app.services.leaderboard_service import leaderboard_service
+from app.services.order_service import order_service
+from app.services.price_distribution import price_distributor
 from app.services.websocket_service import websocket_manager
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
@@ -26,15 +31,29 @@ async def lifespan(app: FastAPI):
     create_tables()
     logger.info("Database tables created")
     
-    await price_service.start_price_updates()
+    await price_distributor.start()
     await websocket_manager.start_price_broadcast()
+    if settings.execution_engine_enabled:
+        await execution_engine.start()
+    await order_service.start()
+    await leaderboard_service.start()
+    if trade_archiver:
+        await trade_archiver.start()
     logger.info("Background services started")
     
     yield
     
     logger.info("Shutting down Trading Simulator...")
-    await price_service.stop_price_updates()
+    if trade_archiver:
+        await trade_archiver.stop()
+    await leaderboard_service.stop()
+    await order_service.stop()
+    if settings.execution_engine_enabled:
+        await execution_engine.stop()
+    await price_distributor.stop()
     await websocket_manager.stop_price_broadcast()
+    password_hasher.shutdown()
+    await dispose_engines()
     logger.info("Background services stopped")
 
 app = FastAPI(
@@ -60,6 +79,7 @@ app.add_middleware(
 app.include_router(auth.router, prefix=settings.api_v1_str)
 app.include_router(trading.router, prefix=settings.api_v1_str)
 app.include_router(prices.router, prefix=settings.api_v1_str)
+app.include_router(leaderboard.router, prefix=settings.api_v1_str)
 app.include_router(websocket.router)
 
 @app.get("/")
@@ -75,10 +95,15 @@ async def health_check():
     return {
         "status": "healthy",
         "database": "connected",
+        "database_pool": pool_stats(),
         "price_service": "running",
         "websocket_connections": len(websocket_manager.active_connections)
     }
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     logger.info("Starting server...")
     uvicorn.run(
@@ -86,5 +111,7 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        # leave uvicorn's loggers to propagate into the queued root handler
+        log_config=None
     )
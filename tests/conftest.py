@@ -0,0 +1,72 @@
+import os
+import tempfile
+import uuid
+
+# settings are read once at import, so the environment is fixed before any
+# app module loads. TEST_DATABASE_URL runs the suite against another backend
+_data_dir = tempfile.mkdtemp(prefix="trading-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL", f"sqlite:///{_data_dir}/app.db")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("PRICE_UPDATE_INTERVAL", "1000")
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    # session-scoped, so every test shares one event loop and the pooled
+    # async connections stay usable from test to test
+    return "asyncio"
+
+
+@pytest.fixture
+def data_dir() -> str:
+    return _data_dir
+
+
+@pytest.fixture(scope="session", autouse=True)
+def tables():
+    # the models register their tables on import
+    import app.models  # noqa: F401
+    from app.core.database import create_tables
+    create_tables()
+
+
+@pytest.fixture(scope="session")
+async def engines(anyio_backend):
+    # pooled aiosqlite connections keep worker threads that would hold the
+    # process open after the run
+    from app.core.database import dispose_engines
+    yield
+    await dispose_engines()
+
+
+@pytest.fixture
+async def user(engines):
+    # a fresh funded account per test, so tests never share balances
+    from app.core.database import AsyncSessionLocal
+    from app.models import User
+
+    async with AsyncSessionLocal() as db:
+        account = User(username=f"user-{uuid.uuid4().hex[:12]}", hashed_password="x")
+        db.add(account)
+        await db.commit()
+        return account
+
+
+@pytest.fixture
+async def client(engines):
+    # requests go straight to the ASGI app; the lifespan, and with it the
+    # price feed and background services, never starts
+    import httpx
+    from main import app
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://localhost") as client:
+        yield client
+
+
+@pytest.fixture
+def auth_headers(user) -> dict:
+    from app.core.auth import AuthService
+    return {"Authorization": f"Bearer {AuthService.create_user_token(user)}"}
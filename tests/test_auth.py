@@ -0,0 +1,64 @@
+import jwt
+import pytest
+
+from app.core.auth import AuthService, Generations, PrincipalCache, principal_cache, token_cache
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models import User
+
+pytestmark = pytest.mark.anyio
+
+
+def test_token_without_expiry_decodes():
+    token = jwt.encode({"sub": "someone"}, settings.secret_key, algorithm=settings.algorithm)
+
+    assert AuthService.decode_token(token) == {"sub": "someone"}
+    # answered from the cache the second time
+    assert AuthService.decode_token(token) == {"sub": "someone"}
+    token_cache.invalidate(token)
+
+
+async def test_principal_dropped_after_commit(user):
+    async with AsyncSessionLocal() as db:
+        account = await db.get(User, user.id)
+        account.balance = 5000.0
+        await db.flush()
+        # a concurrent request caching the row between flush and commit
+        principal_cache.set(user.id, {"id": user.id, "balance": 10000.0})
+        await db.commit()
+
+    assert principal_cache.get(user.id) is None
+
+
+async def test_rollback_leaves_no_pending_invalidation(user):
+    async with AsyncSessionLocal() as db:
+        account = await db.get(User, user.id)
+        account.balance = 5000.0
+        await db.flush()
+        await db.rollback()
+        assert "changed_users" not in db.sync_session.info
+
+
+def test_invalidation_reaches_other_workers(tmp_path):
+    path = str(tmp_path / "generations")
+    # two workers' caches over the same file
+    first, second = PrincipalCache(10, 60.0, Generations(path)), PrincipalCache(10, 60.0, Generations(path))
+    first.set(7, {"balance": 1.0})
+    second.set(7, {"balance": 1.0})
+
+    first.invalidate(7)
+    assert second.get(7) is None
+    assert (second.hits, second.misses) == (0, 1)
+
+    second.set(7, {"balance": 2.0})
+    assert second.get(7) == {"balance": 2.0}
+
+
+def test_change_during_load_outdates_the_entry(tmp_path):
+    cache = PrincipalCache(10, 60.0, Generations(str(tmp_path / "generations")))
+    generation = cache.generation(7)
+    # another worker commits and invalidates while this one reads the old row
+    Generations(str(tmp_path / "generations")).bump(7)
+    cache.set(7, {"balance": 1.0}, generation=generation)
+
+    assert cache.get(7) is None
@@ -0,0 +1,136 @@
+import httpx
+import pytest
+
+from app.services import coingecko_client
+from app.services.coingecko_client import CircuitOpenError, CoinGeckoClient, UpstreamUnavailableError
+
+pytestmark = pytest.mark.anyio
+
+QUOTES = {"pax-gold": {"usd": 2400.5}, "kinesis-silver": {"usd": 29.1}}
+
+
+class Upstream:
+    # stub CoinGecko answering with the queued responses in order
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(coingecko_client.asyncio, "sleep", sleep)
+    return delays
+
+
+def make_client(upstream: Upstream, **kwargs) -> CoinGeckoClient:
+    kwargs.setdefault("max_retries", 2)
+    kwargs.setdefault("backoff_base", 0.5)
+    return CoinGeckoClient(base_url="http://upstream.test/price", transport=httpx.MockTransport(upstream), **kwargs)
+
+
+async def test_returns_quotes_for_requested_ids(sleeps):
+    upstream = Upstream(httpx.Response(200, json=QUOTES))
+    client = make_client(upstream)
+
+    quotes = await client.fetch_prices(["pax-gold", "kinesis-silver", "pax-gold"])
+
+    assert quotes == {"pax-gold": 2400.5, "kinesis-silver": 29.1}
+    assert upstream.requests[0].url.params["ids"] == "pax-gold,kinesis-silver"
+    assert sleeps == []
+    assert client.breaker.state == "closed"
+
+
+async def test_retries_server_errors_with_exponential_backoff(sleeps):
+    upstream = Upstream(
+        httpx.Response(503),
+        httpx.ConnectError("refused"),
+        httpx.Response(200, json=QUOTES),
+    )
+    client = make_client(upstream)
+
+    quotes = await client.fetch_prices(["pax-gold"])
+
+    assert quotes["pax-gold"] == 2400.5
+    assert len(upstream.requests) == 3
+    assert sleeps == [0.5, 1.0]
+    assert client.breaker.failures == 0
+
+
+async def test_client_errors_are_not_retried(sleeps):
+    upstream = Upstream(httpx.Response(404))
+    client = make_client(upstream)
+
+    with pytest.raises(UpstreamUnavailableError):
+        await client.fetch_prices(["pax-gold"])
+
+    assert len(upstream.requests) == 1
+    assert sleeps == []
+    assert client.breaker.failures == 1
+
+
+async def test_rate_limits_are_retried(sleeps):
+    upstream = Upstream(httpx.Response(429), httpx.Response(200, json=QUOTES))
+    client = make_client(upstream)
+
+    await client.fetch_prices(["pax-gold"])
+
+    assert len(upstream.requests) == 2
+    assert sleeps == [0.5]
+
+
+async def test_breaker_opens_after_threshold_and_recovers_through_half_open(sleeps):
+    upstream = Upstream(*[httpx.Response(500)] * 3)
+    client = make_client(upstream, max_retries=0)
+    client.breaker.failure_threshold = 3
+    client.breaker.reset_timeout = 10.0
+
+    for _ in range(3):
+        with pytest.raises(UpstreamUnavailableError):
+            await client.fetch_prices(["pax-gold"])
+    assert client.breaker.state == "open"
+
+    # open: rejected without touching the upstream
+    with pytest.raises(CircuitOpenError):
+        await client.fetch_prices(["pax-gold"])
+    assert len(upstream.requests) == 3
+
+    # the cool-down passes and a single probe is let through
+    client.breaker.opened_at -= client.breaker.current_timeout
+    assert client.breaker.state == "half-open"
+    upstream.responses.append(httpx.Response(200, json=QUOTES))
+    assert await client.fetch_prices(["pax-gold"]) == {"pax-gold": 2400.5, "kinesis-silver": 29.1}
+    assert client.breaker.state == "closed"
+
+
+async def test_failed_probe_reopens_with_doubled_cool_down(sleeps):
+    upstream = Upstream(*[httpx.Response(500)] * 4)
+    client = make_client(upstream, max_retries=0)
+    client.breaker.failure_threshold = 3
+    client.breaker.reset_timeout = 10.0
+    client.breaker.max_reset_timeout = 15.0
+
+    for _ in range(3):
+        with pytest.raises(UpstreamUnavailableError):
+            await client.fetch_prices(["pax-gold"])
+    assert client.breaker.current_timeout == 10.0
+
+    client.breaker.opened_at -= client.breaker.current_timeout
+    with pytest.raises(UpstreamUnavailableError):
+        await client.fetch_prices(["pax-gold"])
+
+    assert client.breaker.state == "open"
+    # doubled, then capped at max_reset_timeout
+    assert client.breaker.current_timeout == 15.0
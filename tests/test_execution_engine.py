@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+
+from app.core.auth import principal_cache
+from app.core.database import AsyncSessionLocal, read_router, statement_time
+from app.core.schemas import OrderStatus, TradeCreate
+from app.models import Order, Position, Trade, User
+from app.services.execution_engine import ExecutionEngine
+from app.services.price_provider import InMemoryPriceProvider
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def engine():
+    engine = ExecutionEngine(InMemoryPriceProvider({"GOLD": 100.0}), journal_path="")
+    await engine.start()
+    yield engine
+    await engine.stop()
+
+
+async def stored(user_id: int):
+    async with AsyncSessionLocal() as db:
+        balance = (await db.get(User, user_id)).balance
+        trades = (await db.execute(select(func.count(Trade.id)).where(Trade.user_id == user_id))).scalar()
+        positions = (await db.execute(select(Position).where(Position.user_id == user_id))).scalars().all()
+        return balance, trades, {p.symbol: p.quantity for p in positions}
+
+
+async def test_fills_are_committed(engine, user):
+    trade = await engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=2))
+
+    assert trade.total_amount == 200.0
+    assert await stored(user.id) == (9800.0, 1, {"GOLD": 2.0})
+
+
+async def test_account_load_is_not_counted_as_request_time(engine, user):
+    timer = [0.0]
+    token = statement_time.set(timer)
+    try:
+        # the first order loads the account, from the drain task
+        await engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1))
+    finally:
+        statement_time.reset(token)
+    assert timer == [0.0]
+
+
+async def test_failed_commit_fails_fills_queued_behind_it(engine, user, monkeypatch):
+    started, release = asyncio.Event(), asyncio.Event()
+    persist = engine._persist
+
+    async def failing_persist(entries, orders=()):
+        started.set()
+        await release.wait()
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(engine, "_persist", failing_persist)
+    first = asyncio.create_task(engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=10)))
+    await started.wait()
+    # executed on top of the in-flight fill while its commit is pending
+    second = asyncio.create_task(engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=5)))
+    await asyncio.sleep(0.01)
+    assert len(engine._pending) == 1
+
+    # only the in-flight commit fails; the next one would succeed
+    release.set()
+    monkeypatch.setattr(engine, "_persist", persist)
+    for request in (first, second):
+        with pytest.raises(RuntimeError):
+            await request
+    assert engine._pending == []
+    assert await stored(user.id) == (10000.0, 0, {})
+
+    await engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1))
+    # reloaded from the database: neither failed order left a trace
+    assert await stored(user.id) == (9900.0, 1, {"GOLD": 1.0})
+
+
+async def test_failed_commit_stops_the_old_accounts_drain(engine, user, monkeypatch):
+    started, release = asyncio.Event(), asyncio.Event()
+    persist = engine._persist
+
+    async def failing_persist(entries, orders=()):
+        started.set()
+        await release.wait()
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(engine, "_persist", failing_persist)
+    first = asyncio.create_task(engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=10)))
+    await started.wait()
+    account = engine._accounts[user.id]
+    # submitted in the same loop pass the commit fails in, so its drain task
+    # is scheduled on the old account but has not run yet
+    second = asyncio.create_task(engine.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=5)))
+    release.set()
+    monkeypatch.setattr(engine, "_persist", persist)
+
+    for request in (first, second):
+        with pytest.raises(RuntimeError):
+            await request
+    await asyncio.sleep(0.01)
+    assert account.task is None and not account.requests
+    assert engine._pending == []
+    assert await stored(user.id) == (10000.0, 0, {})
+
+
+@pytest.fixture
+async def journaled(tmp_path):
+    engine = ExecutionEngine(InMemoryPriceProvider({"GOLD": 100.0}), journal_path=str(tmp_path / "trades.journal"))
+    await engine.start()
+    # no background writer, so journaled fills stay out of the database
+    # until a test copies them in
+    engine._writer_task.cancel()
+    yield engine
+    await engine.stop()
+
+
+async def test_journaled_order_fill_is_in_the_database_when_resolved(journaled, user):
+    await journaled.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1))
+    assert len(journaled._unpersisted) == 1
+
+    async with AsyncSessionLocal() as db:
+        order = Order(user_id=user.id, symbol="GOLD", side="buy", order_type="limit", quantity=2,
+                      trigger_price=100.0, status=OrderStatus.TRIGGERED.value)
+        db.add(order)
+        await db.commit()
+    [(trade, error)] = await journaled.submit_batch(
+        user, [TradeCreate(symbol="GOLD", side="buy", quantity=2)], all_or_nothing=False, order_ids=[order.id]
+    )
+
+    assert error is None and journaled._unpersisted == []
+    assert await stored(user.id) == (9700.0, 2, {"GOLD": 3.0})
+    async with AsyncSessionLocal() as db:
+        order = await db.get(Order, order.id)
+        assert (order.status, order.trade_id) == (OrderStatus.FILLED.value, trade.id)
+
+
+async def test_reload_waits_for_the_writer(journaled, user):
+    await journaled.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1))
+    journaled._accounts.pop(user.id)
+
+    reload = asyncio.create_task(journaled.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1)))
+    await asyncio.sleep(0.01)
+    assert not reload.done()
+
+    await journaled._write_behind()
+    await reload
+    assert journaled.get_account(user.id).balance == 9800.0
+
+
+async def test_written_behind_fills_refresh_caches(journaled, user):
+    await journaled.submit(user, TradeCreate(symbol="GOLD", side="buy", quantity=1))
+    # a lookup between the ack and the write-behind caches the old row, and the
+    # read window opened at the ack has run out
+    principal_cache.set(user.id, {"id": user.id, "balance": 10000.0})
+    read_router._recent.pop(user.id, None)
+
+    await journaled._write_behind()
+    assert principal_cache.get(user.id) is None
+    assert read_router.use_primary(user.id)
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.core.database import AsyncSessionLocal
+from app.models import Position
+from app.services.leaderboard_service import LeaderboardService
+from app.services.price_provider import InMemoryPriceProvider
+
+
+def test_ranking_by_equity():
+    provider = InMemoryPriceProvider({"GOLD": 100.0, "SILVER": 10.0})
+    service = LeaderboardService(provider, manager=object(), session_factory=object())
+    service.add_account(1, 1000.0)
+    service.apply_fill(2, "GOLD", 500.0, 10)
+    service.apply_fill(3, "SILVER", 900.0, 50)
+
+    assert service.book.rank(3) == [(2, 1500.0), (3, 1400.0), (1, 1000.0)]
+
+    provider.set_price("GOLD", 40.0)
+    service.book.mark({"GOLD": 40.0})
+    assert service.book.rank(2) == [(3, 1400.0), (1, 1000.0)]
+    # a closed position drops out of the sum
+    service.apply_fill(3, "SILVER", 1400.0, 0)
+    assert service.book.rank(1) == [(3, 1400.0)]
+
+
+@pytest.mark.anyio
+async def test_changes_during_a_reload_reach_the_new_book(user):
+    async with AsyncSessionLocal() as db:
+        db.add(Position(user_id=user.id, symbol="GOLD", quantity=1, avg_price=100.0))
+        await db.commit()
+
+    provider = InMemoryPriceProvider({"GOLD": 100.0})
+    started, release = asyncio.Event(), asyncio.Event()
+    newcomer = 10 ** 9
+
+    class Paused:
+        # holds the reload before it reads the database, and ticks the price
+        # once it has, before the new book replaces the old one
+        async def __aenter__(self):
+            started.set()
+            await release.wait()
+            self.db = AsyncSessionLocal()
+            return await self.db.__aenter__()
+
+        async def __aexit__(self, *exc):
+            provider.set_price("GOLD", 300.0)
+            return await self.db.__aexit__(*exc)
+
+    service = LeaderboardService(provider, manager=object(), session_factory=Paused)
+    provider.add_listener(service._on_price_update)
+    reload = asyncio.create_task(service._load())
+    await started.wait()
+    # not in the database the reload reads
+    service.add_account(newcomer, 5000.0)
+    service.apply_fill(newcomer, "GOLD", 4000.0, 2)
+    release.set()
+    await reload
+
+    equity = service.book.equity()
+    assert equity[service.book.rows[newcomer]] == 4000.0 + 2 * 300.0
+    assert equity[service.book.rows[user.id]] == 10000.0 + 300.0
@@ -0,0 +1,60 @@
+import json
+import logging
+import queue
+
+from app.core import log
+from app.core.log import JsonFormatter, NonBlockingQueueHandler, SamplingFilter
+
+
+def record(name: str, level: int = logging.INFO, msg: str = "tick %s", args=(1,)) -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, args, None)
+
+
+def test_sampling_uses_the_longest_prefix_and_spares_warnings(monkeypatch):
+    rolls = iter([0.4, 0.6, 0.0])
+    monkeypatch.setattr(log.random, "random", lambda: next(rolls))
+    sampling = SamplingFilter({"app": 0.5, "app.quiet": 0.0, "app.quiet.kept": 1.0}, {})
+
+    assert sampling.filter(record("app.feed"))
+    assert not sampling.filter(record("app.feed"))
+    assert not sampling.filter(record("app.quiet.worker"))
+    assert sampling.filter(record("app.quiet.kept"))
+    assert sampling.filter(record("app.quiet", logging.WARNING))
+    # a prefix only matches whole name segments
+    assert sampling.filter(record("application"))
+
+
+def test_rate_limit_counts_suppressed_records_onto_the_next(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(log.time, "monotonic", lambda: now[0])
+    limited = SamplingFilter({}, {"app.ws": 2.0})
+
+    records = [record("app.ws.client") for _ in range(5)]
+    assert [limited.filter(r) for r in records] == [True, True, False, False, False]
+    # the bucket is shared by the whole prefix, warnings included
+    assert not limited.filter(record("app.ws", logging.WARNING))
+
+    now[0] += 0.5
+    passed = record("app.ws.client")
+    assert limited.filter(passed)
+    assert passed.suppressed == 4
+    assert not limited.filter(record("app.ws.client"))
+    assert limited.filter(record("app.other"))
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    handler.handle(record("app"))
+    handler.handle(record("app"))
+
+    assert (handler.queue.qsize(), handler.dropped) == (1, 1)
+
+
+def test_json_lines_carry_extra_fields():
+    entry = record("app.routers.auth")
+    entry.username = "alice"
+    line = json.loads(JsonFormatter().format(entry))
+
+    assert (line["level"], line["logger"], line["message"], line["username"]) == (
+        "INFO", "app.routers.auth", "tick 1", "alice"
+    )
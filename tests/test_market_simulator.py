@@ -0,0 +1,40 @@
+import numpy as np
+
+from app.core.config import settings
+from app.core.symbols import Instrument, SymbolUniverse
+from app.services.market_simulator import MarketSimulator
+from app.services.price_service import PriceService
+
+UNIVERSE = SymbolUniverse(
+    instruments=[
+        Instrument(symbol="GOLD", price=2000.0, drift=0.0001, volatility=0.002),
+        Instrument(symbol="SILVER", price=25.0, volatility=0.003),
+        Instrument(symbol="OIL", price=80.0, volatility=0.004),
+    ],
+    correlations=[("GOLD", "SILVER", 0.8)],
+)
+
+
+def test_seeded_step_is_gbm_with_correlated_shocks():
+    simulator = MarketSimulator(UNIVERSE, seed=42)
+    shocks = np.random.default_rng(42).standard_normal(3)
+    # only GOLD and SILVER are correlated; OIL keeps its own shock
+    shocks[:2] = np.linalg.cholesky(np.array([[1.0, 0.8], [0.8, 1.0]])) @ shocks[:2]
+    drift = np.array([0.0001, 0.0, 0.0])
+    volatility = np.array([0.002, 0.003, 0.004])
+    expected = np.array([2000.0, 25.0, 80.0]) * np.exp(drift - 0.5 * volatility ** 2 + volatility * shocks)
+
+    np.testing.assert_allclose(simulator.step(), expected)
+
+
+def seeded_prices(monkeypatch, seed: int) -> dict:
+    monkeypatch.setattr(settings, "simulation_seed", seed)
+    service = PriceService(upstream=object())
+    for _ in range(20):
+        service._apply_micro_fluctuations()
+    return service.prices
+
+
+def test_simulation_seed_fixes_the_path(monkeypatch):
+    assert seeded_prices(monkeypatch, 7) == seeded_prices(monkeypatch, 7)
+    assert seeded_prices(monkeypatch, 7) != seeded_prices(monkeypatch, 8)
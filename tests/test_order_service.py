@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from app.core.database import AsyncSessionLocal
+from app.core.schemas import OrderStatus
+from app.models import Order, Trade, User
+from app.services.order_service import OrderService
+from app.services.price_provider import InMemoryPriceProvider
+from app.services.trading_service import AsyncTradingService
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def service(engines):
+    service = OrderService(InMemoryPriceProvider({"GOLD": 100.0}))
+    yield service
+    await service.stop()
+
+
+async def add_order(user: User, status: str = OrderStatus.OPEN.value, quantity: float = 1.0) -> Order:
+    async with AsyncSessionLocal() as db:
+        order = Order(user_id=user.id, symbol="GOLD", side="buy", order_type="limit", quantity=quantity,
+                      trigger_price=100.0, status=status)
+        db.add(order)
+        await db.commit()
+        return order
+
+
+def triggered(*orders: Order):
+    return [(order.id, (order.symbol, order.side, order.order_type, order.trigger_price)) for order in orders]
+
+
+def fired(service: OrderService):
+    return [order_id for order_id, _ in service.index.crossed("GOLD", 100.0)]
+
+
+async def state(order: Order):
+    async with AsyncSessionLocal() as db:
+        stored = await db.get(Order, order.id)
+        trades = (await db.execute(select(func.count(Trade.id)).where(Trade.user_id == order.user_id))).scalar()
+        return stored.status, stored.trade_id is not None, trades
+
+
+async def test_failed_execution_reopens_only_that_users_orders(service, user, monkeypatch):
+    async with AsyncSessionLocal() as db:
+        other = User(username=f"{user.username}-b", hashed_password="x")
+        db.add(other)
+        await db.commit()
+    failing, filling = await add_order(user), await add_order(other)
+    execute_batch = AsyncTradingService.execute_batch
+
+    async def flaky(self, account, orders, **kwargs):
+        if account.id == user.id:
+            raise RuntimeError("database is locked")
+        return await execute_batch(self, account, orders, **kwargs)
+
+    monkeypatch.setattr(AsyncTradingService, "execute_batch", flaky)
+    await service._fill(triggered(failing, filling))
+
+    assert await state(failing) == (OrderStatus.OPEN.value, False, 0)
+    assert await state(filling) == (OrderStatus.FILLED.value, True, 1)
+    # back in the index, so the next crossing tick fires it again
+    assert fired(service) == [failing.id]
+
+
+async def test_fill_and_status_share_a_commit(service, user, monkeypatch):
+    order = await add_order(user)
+    settle = service._settle
+
+    async def failing_settle(db, orders, results, claimed=False):
+        if claimed:
+            raise RuntimeError("lost connection")
+        await settle(db, orders, results, claimed)
+
+    monkeypatch.setattr(service, "_settle", failing_settle)
+    await service._fill(triggered(order))
+
+    # the status write failed, so the trade rolled back with it
+    assert await state(order) == (OrderStatus.OPEN.value, False, 0)
+
+
+async def test_unfillable_orders_are_rejected(service, user):
+    order = await add_order(user, quantity=1000.0)
+    await service._fill(triggered(order))
+
+    async with AsyncSessionLocal() as db:
+        stored = await db.get(Order, order.id)
+    assert (stored.status, stored.reason) == (OrderStatus.REJECTED.value, "Insufficient balance")
+
+
+async def test_start_reopens_triggered_orders(service, user):
+    order = await add_order(user, status=OrderStatus.TRIGGERED.value)
+    await service.start()
+
+    assert await state(order) == (OrderStatus.OPEN.value, False, 0)
+    assert order.id in fired(service)
+
+
+async def test_failed_claim_keeps_the_order_indexed(service, user, monkeypatch):
+    order = await add_order(user)
+    service.index.add(order.id, order.symbol, order.side, order.order_type, order.trigger_price)
+    session_factory = service.session_factory
+
+    class Locked:
+        async def __aenter__(self):
+            raise OperationalError("UPDATE orders", {}, Exception("database is locked"))
+
+        async def __aexit__(self, *exc):
+            return False
+
+    monkeypatch.setattr(service, "session_factory", Locked)
+    with pytest.raises(OperationalError):
+        await service._fill(service.index.crossed("GOLD", 100.0))
+    assert await state(order) == (OrderStatus.OPEN.value, False, 0)
+
+    # the next crossing fires it again and, with the database back, fills it
+    monkeypatch.setattr(service, "session_factory", session_factory)
+    await service._fill(service.index.crossed("GOLD", 100.0))
+    assert await state(order) == (OrderStatus.FILLED.value, True, 1)
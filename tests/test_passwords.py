@@ -0,0 +1,62 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.passwords import PasswordHasher, password_hasher, pwd_context
+from app.models import User
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def hasher():
+    yield password_hasher
+    password_hasher.shutdown()
+
+
+async def login(client, username: str, password: str):
+    return await client.post("/api/v1/auth/login", data={"username": username, "password": password})
+
+
+async def test_register_then_login(client, hasher):
+    username = f"user-{uuid.uuid4().hex[:12]}"
+    response = await client.post("/api/v1/auth/register", json={"username": username, "password": "secret1"})
+    assert response.status_code == 200
+
+    assert (await login(client, username, "secret1")).status_code == 200
+    assert (await login(client, username, "secret2")).status_code == 401
+
+
+async def test_login_rehashes_at_the_configured_cost(client, engines, hasher):
+    old_hash = bcrypt.using(rounds=settings.bcrypt_rounds + 1).hash("secret1")
+    async with AsyncSessionLocal() as db:
+        user = User(username=f"user-{uuid.uuid4().hex[:12]}", hashed_password=old_hash)
+        db.add(user)
+        await db.commit()
+
+    assert (await login(client, user.username, "secret1")).status_code == 200
+
+    async with AsyncSessionLocal() as db:
+        new_hash = (await db.get(User, user.id)).hashed_password
+    assert new_hash != old_hash and not pwd_context.needs_update(new_hash)
+    assert pwd_context.verify("secret1", new_hash)
+
+
+async def test_requests_beyond_the_queue_limit_are_turned_away():
+    hasher = PasswordHasher(workers=1, queue_limit=1)
+    try:
+        first = asyncio.create_task(hasher.hash("secret1"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as busy:
+            await hasher.hash("secret2")
+        assert (busy.value.status_code, busy.value.headers) == (503, {"Retry-After": "1"})
+
+        assert pwd_context.verify("secret1", await first)
+        assert hasher.pending == 0
+    finally:
+        hasher.shutdown()
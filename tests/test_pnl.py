@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.core.database import AsyncSessionLocal
+from app.core.schemas import TradeCreate
+from app.models import Lot, PnlSummary, Position, User
+from app.services.execution_engine import ExecutionEngine
+from app.services.pnl_service import record_fills
+from app.services.price_provider import InMemoryPriceProvider
+from app.services.price_service import get_price_provider
+from app.services.trading_service import AsyncTradingService
+from main import app
+
+pytestmark = pytest.mark.anyio
+
+# buy 2 @ 100, buy 2 @ 200, sell 3 @ 150: the sell takes the whole first lot
+# (+100) and one of the second (-50), leaving 1 @ 200 open
+SEQUENCE = [("buy", 2, 100.0), ("buy", 2, 200.0), ("sell", 3, 150.0)]
+
+
+async def summary(user_id: int, symbol: str = "GOLD"):
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(
+            select(PnlSummary).where(PnlSummary.user_id == user_id, PnlSummary.symbol == symbol)
+        )).scalars().one()
+        lots = (await db.execute(
+            select(Lot).where(Lot.user_id == user_id, Lot.symbol == symbol).order_by(Lot.id)
+        )).scalars().all()
+        return row.realized_pnl, row.cost_basis, [(lot.quantity, lot.price) for lot in lots]
+
+
+async def test_fifo_through_the_trading_service(user):
+    provider = InMemoryPriceProvider()
+    for side, quantity, price in SEQUENCE:
+        provider.set_price("GOLD", price)
+        async with AsyncSessionLocal() as db:
+            account = await db.get(User, user.id)
+            await AsyncTradingService(db, provider).execute_trade(
+                account, TradeCreate(symbol="GOLD", side=side, quantity=quantity)
+            )
+
+    assert await summary(user.id) == (50.0, 200.0, [(1.0, 200.0)])
+
+
+async def test_fifo_through_the_engine(user):
+    provider = InMemoryPriceProvider()
+    engine = ExecutionEngine(provider, journal_path="")
+    await engine.start()
+    try:
+        for side, quantity, price in SEQUENCE:
+            provider.set_price("GOLD", price)
+            await engine.submit(user, TradeCreate(symbol="GOLD", side=side, quantity=quantity))
+    finally:
+        await engine.stop()
+
+    assert await summary(user.id) == (50.0, 200.0, [(1.0, 200.0)])
+
+
+async def test_existing_position_seeds_one_lot(user):
+    async with AsyncSessionLocal() as db:
+        db.add(Position(user_id=user.id, symbol="GOLD", quantity=4, avg_price=50.0))
+        await db.commit()
+
+    async with AsyncSessionLocal() as db:
+        account = await db.get(User, user.id)
+        await AsyncTradingService(db, InMemoryPriceProvider({"GOLD": 100.0})).execute_trade(
+            account, TradeCreate(symbol="GOLD", side="sell", quantity=1)
+        )
+
+    assert await summary(user.id) == (50.0, 150.0, [(3.0, 50.0)])
+
+
+async def test_concurrent_first_fills_share_one_summary(user):
+    async with AsyncSessionLocal() as first, AsyncSessionLocal() as second:
+        await record_fills(first, user.id, "GOLD", [("buy", 1, 100.0)])
+
+        async def other():
+            # finds no summary yet, then loses the insert to the first
+            await record_fills(second, user.id, "GOLD", [("buy", 1, 120.0)])
+            await second.commit()
+
+        waiting = asyncio.create_task(other())
+        await asyncio.sleep(0.05)
+        await first.commit()
+        await waiting
+
+    assert await summary(user.id) == (0.0, 220.0, [(1.0, 100.0), (1.0, 120.0)])
+
+
+async def test_pnl_endpoint(client, auth_headers, user):
+    provider = InMemoryPriceProvider()
+    for side, quantity, price in SEQUENCE:
+        provider.set_price("GOLD", price)
+        async with AsyncSessionLocal() as db:
+            account = await db.get(User, user.id)
+            await AsyncTradingService(db, provider).execute_trade(
+                account, TradeCreate(symbol="GOLD", side=side, quantity=quantity)
+            )
+    provider.set_price("GOLD", 260.0)
+
+    app.dependency_overrides[get_price_provider] = lambda: provider
+    try:
+        response = await client.get("/api/v1/trading/pnl", headers=auth_headers)
+    finally:
+        app.dependency_overrides.pop(get_price_provider)
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["realized_pnl"], body["unrealized_pnl"], body["total_pnl"]) == (50.0, 60.0, 110.0)
+    [gold] = body["symbols"]
+    assert (gold["symbol"], gold["quantity"], gold["cost_basis"]) == ("GOLD", 1.0, 200.0)
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from app.services.coingecko_client import UpstreamUnavailableError
+from app.services.price_distribution import PriceDistributor
+from app.services.price_service import PriceService
+
+pytestmark = pytest.mark.anyio
+
+
+class OfflineUpstream:
+    # ticks in these tests only come from the test itself
+
+    async def fetch_prices(self, coin_ids):
+        raise UpstreamUnavailableError("offline")
+
+    async def close(self):
+        pass
+
+
+async def eventually(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+async def test_one_producer_and_a_mirror_that_takes_over(tmp_path):
+    path = str(tmp_path / "feed.sock")
+    first, second = PriceService(upstream=OfflineUpstream()), PriceService(upstream=OfflineUpstream())
+    producer, mirror = PriceDistributor(first, path), PriceDistributor(second, path)
+    try:
+        await producer.start()
+        await eventually(lambda: producer.is_producer)
+        await mirror.start()
+
+        for _ in range(3):
+            first._apply_micro_fluctuations()
+        await eventually(lambda: second.sequence == first.sequence)
+        assert not mirror.is_producer
+        assert second.prices == first.prices
+        assert second.history.snapshot("GOLD")[1][-1] == first.prices["GOLD"]
+
+        # the producer goes away: its lock is released and the mirror takes
+        # over, carrying on from the last sequence it saw
+        sequence = first.sequence
+        await producer.stop()
+        await eventually(lambda: mirror.is_producer)
+        updates = []
+        second.add_listener(updates.append)
+        for _ in range(3):
+            second._apply_micro_fluctuations()
+        assert updates
+        assert [update.seq for update in updates] == list(range(sequence + 1, sequence + 1 + len(updates)))
+    finally:
+        await producer.stop()
+        await mirror.stop()
@@ -0,0 +1,41 @@
+from datetime import datetime
+
+import numpy as np
+
+from app.services.price_service import TickHistory
+
+# one tick a second; the buffer keeps the last five, so ticks 0-2 are gone
+PRICES = [10.0, 11.0, 9.0, 12.0, 8.0, 15.0, 7.0, 13.0]
+
+
+def wrapped_history() -> TickHistory:
+    history = TickHistory(["GOLD", "SILVER"], capacity=5)
+    for second, price in enumerate(PRICES):
+        history.append(float(second), np.array([price, price / 10]))
+    return history
+
+
+def candle(second: int, open_: float, high: float, low: float, close: float, ticks: int) -> dict:
+    return {"timestamp": datetime.utcfromtimestamp(second), "open": open_, "high": high, "low": low,
+            "close": close, "ticks": ticks}
+
+
+def test_snapshot_unrolls_the_ring_oldest_first():
+    timestamps, prices = wrapped_history().snapshot("GOLD")
+
+    assert timestamps.tolist() == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert prices.tolist() == PRICES[3:]
+
+
+def test_candles_after_the_buffer_wrapped():
+    history = wrapped_history()
+
+    assert len(history) == 5
+    # the 2-4s bucket only has its surviving tick left
+    assert history.candles("GOLD", 2, 10) == [
+        candle(2, 12.0, 12.0, 12.0, 12.0, 1),
+        candle(4, 8.0, 15.0, 8.0, 15.0, 2),
+        candle(6, 7.0, 13.0, 7.0, 13.0, 2),
+    ]
+    assert history.candles("SILVER", 2, 1) == [candle(6, 0.7, 1.3, 0.7, 1.3, 2)]
+    assert history.candles("OIL", 2, 10) == []
@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core import database
+from app.core.database import Base, ReadRouter, configure_read_only, configure_sqlite, engine_options
+from app.models import User
+
+pytestmark = pytest.mark.anyio
+
+WINDOW = 0.1
+
+
+@pytest.fixture
+async def replica(tmp_path, monkeypatch, engines):
+    # a second database file standing in for a replica that has not caught up:
+    # the schema is there, the test's user is not
+    url = f"sqlite+aiosqlite:///{tmp_path}/replica.db"
+    writer = create_async_engine(url)
+    async with writer.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    await writer.dispose()
+
+    engine = create_async_engine(url, **engine_options(url, is_async=True))
+    configure_read_only(engine.sync_engine)
+    configure_sqlite(engine.sync_engine)
+    monkeypatch.setattr(database, "AsyncReadSessionLocal", async_sessionmaker(engine, expire_on_commit=False))
+    monkeypatch.setattr(database, "read_router", ReadRouter(WINDOW))
+    yield
+    await engine.dispose()
+
+
+async def test_reads_follow_the_write_window(replica, user):
+    database.read_router.mark_write(user.id)
+    async with database.read_session(user.id) as db:
+        assert await db.get(User, user.id) is not None
+
+    await asyncio.sleep(WINDOW * 1.5)
+    async with database.read_session(user.id) as db:
+        assert await db.get(User, user.id) is None
+
+
+async def test_replica_rejects_writes(replica, user):
+    async with database.read_session(user.id) as db:
+        db.add(User(username=f"{user.username}-replica", hashed_password="x"))
+        # refused at BEGIN IMMEDIATE, which the write hook issues on the raw
+        # cursor, or by query_only at the statement itself
+        with pytest.raises((OperationalError, sqlite3.OperationalError), match="readonly"):
+            await db.commit()
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.core.database import AsyncSessionLocal
+from app.core.schemas import ExportFormat
+from app.models import Trade
+from app.routers.trading import export_trades
+from app.services import archive_service
+from app.services import trade_archive as archive_module
+from app.services import trading_service
+from app.services.archive_service import LOCK_NAME, TradeArchiver
+from app.services.trade_archive import TradeArchive, archive_name, month_end, to_micros
+from app.services.trading_service import AsyncTradingService
+
+MONTH = datetime(2024, 1, 1)
+
+
+def month_columns(ids, user_id: int = 1):
+    count = len(ids)
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "user_id": np.full(count, user_id, dtype=np.int64),
+        "timestamp": to_micros([datetime(2024, 1, 2, 0, 0, trade_id % 60) for trade_id in ids]),
+        "symbol": np.array(["GOLD"] * count, dtype=object),
+        "side": np.array(["buy"] * count, dtype=object),
+        "quantity": np.ones(count),
+        "price": np.full(count, 100.0),
+        "total_amount": np.full(count, 100.0),
+    }
+
+
+def test_boundary_is_cached(tmp_path, monkeypatch):
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, month_columns([1, 2]))
+    assert archive.boundary == datetime(2024, 2, 1)
+
+    stats = []
+    stat = os.stat
+    monkeypatch.setattr(archive_module.os, "stat", lambda path: stats.append(path) or stat(path))
+    for _ in range(100):
+        assert archive.boundary == datetime(2024, 2, 1)
+    assert stats == []
+
+    monkeypatch.setattr(archive_module, "RESCAN_INTERVAL", 0.0)
+    archive.boundary
+    assert stats == [str(tmp_path)]
+
+
+def test_merged_month_closes_the_replaced_file(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, month_columns([1, 2]))
+    [old] = archive.files()
+
+    archive.write_month(MONTH, month_columns([2, 3]))
+    [new] = archive.files()
+
+    assert old.closed and not new.closed
+    assert [trade.id for trade in archive.user_trades(1, 10)] == [3, 2, 1]
+
+
+def test_file_in_use_stays_mapped_until_the_read_ends(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, month_columns([1, 2]))
+
+    batches = archive.iter_user_trades(1, batch_size=1)
+    assert [trade.id for trade in next(batches)] == [1]
+    [old] = archive.files()
+    archive.write_month(MONTH, month_columns([3]))
+    archive.files()
+
+    assert not old.closed
+    assert [trade.id for trade in next(batches)] == [2]
+    assert next(batches, None) is None
+    assert old.closed
+
+
+@pytest.mark.anyio
+async def test_archiver_skips_the_pass_while_another_holds_the_lock(tmp_path):
+    archive = TradeArchive(str(tmp_path))
+    holder = TradeArchiver(archive)
+    fd = holder._try_lock()
+    try:
+        assert os.path.exists(tmp_path / LOCK_NAME)
+        # no session factory: reaching the database would fail the test
+        assert await TradeArchiver(archive, session_factory=object()).run_once() == 0
+    finally:
+        os.close(fd)
+    assert not (tmp_path / archive_name(MONTH)).exists()
+
+
+def test_month_is_written_a_chunk_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive_module, "CHUNK_ROWS", 4)
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, {
+        name: np.concatenate((a, b)) for (name, a), b in zip(
+            month_columns([1, 3, 5, 7, 9], user_id=1).items(), month_columns([12, 14], user_id=2).values()
+        )
+    })
+
+    writer = archive.month_writer(MONTH)
+    # the rerun sees rows already in the file again, interleaved with new ones
+    for ids, user_id in [([2, 3, 4], 1), ([6, 8, 9, 10, 11], 1), ([13], 2), ([15, 16], 3)]:
+        writer.append(month_columns(ids, user_id))
+        assert writer._buffered < 4
+    writer.commit()
+
+    [month] = archive.files()
+    assert month.rows == 16
+    assert [trade.id for trade in archive.user_trades(1, 20)] == list(range(11, 0, -1))
+    assert [trade.id for batch in archive.iter_user_trades(2) for trade in batch] == [12, 13, 14]
+    assert [trade.id for trade in archive.user_trades(3, 20)] == [16, 15]
+
+
+@pytest.mark.anyio
+async def test_archiver_streams_the_month_out_of_the_table(tmp_path, user, monkeypatch):
+    monkeypatch.setattr(archive_module, "CHUNK_ROWS", 4)
+    monkeypatch.setattr(archive_service, "RESCAN_INTERVAL", 0.0)
+    async with AsyncSessionLocal() as db:
+        db.add_all([
+            Trade(user_id=user.id, symbol="GOLD", side="buy", quantity=1, price=100.0, total_amount=100.0,
+                  timestamp=datetime(2024, 1, 2, 0, 0, second))
+            for second in range(10)
+        ])
+        await db.commit()
+
+    archive = TradeArchive(str(tmp_path))
+    assert await TradeArchiver(archive)._archive_month(MONTH, month_end(MONTH)) == 10
+
+    archived = archive.user_trades(user.id, 20)
+    assert [trade.timestamp.second for trade in archived] == list(range(9, -1, -1))
+    async with AsyncSessionLocal() as db:
+        # the newest trade in the table stays behind for the autoincrement
+        assert len((await db.execute(
+            Trade.__table__.select().where(Trade.timestamp < month_end(MONTH))
+        )).all()) == 1
+
+
+@pytest.mark.anyio
+async def test_export_releases_the_archive_when_the_client_leaves(tmp_path, user, monkeypatch):
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, month_columns(list(range(1, 2500)), user_id=user.id))
+    monkeypatch.setattr(trading_service, "trade_archive", archive)
+
+    response = await export_trades(format=ExportFormat.NDJSON, current_user=user)
+    chunks = response.body_iterator
+    assert (await chunks.__anext__()).startswith('{"id": ')
+    [month] = archive.files()
+    assert month.readers == 1
+
+    # what the server does once the client is gone
+    await chunks.aclose()
+    assert month.readers == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_export_releases_the_archive_once_the_read_ends(tmp_path, user, monkeypatch):
+    archive = TradeArchive(str(tmp_path))
+    archive.write_month(MONTH, month_columns([1, 2], user_id=user.id))
+    monkeypatch.setattr(trading_service, "trade_archive", archive)
+    reading, release = threading.Event(), threading.Event()
+    iter_user_trades = archive.iter_user_trades
+
+    def slow(user_id, batch_size):
+        batches = iter_user_trades(user_id, batch_size)
+        yield next(batches)
+        reading.set()
+        release.wait()
+        yield from batches
+
+    monkeypatch.setattr(archive, "iter_user_trades", slow)
+
+    async def export():
+        async with AsyncSessionLocal() as db:
+            async for _ in AsyncTradingService(db).stream_user_trades(user.id, batch_size=1):
+                pass
+
+    task = asyncio.create_task(export())
+    await asyncio.to_thread(reading.wait)
+    [month] = archive.files()
+    task.cancel()
+    await asyncio.sleep(0.05)
+    release.set()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert month.readers == 0
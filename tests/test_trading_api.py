@@ -0,0 +1,17 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.mark.parametrize("path", ["/api/v1/trading/trades", "/api/v1/trading/orders"])
+@pytest.mark.parametrize("limit", [0, -1, 101])
+async def test_out_of_range_limits_are_rejected(client, auth_headers, path, limit):
+    response = await client.get(path, params={"limit": limit}, headers=auth_headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("path", ["/api/v1/trading/trades", "/api/v1/trading/orders"])
+async def test_limit_bounds_are_accepted(client, auth_headers, path):
+    for limit in (1, 100):
+        response = await client.get(path, params={"limit": limit}, headers=auth_headers)
+        assert response.status_code == 200
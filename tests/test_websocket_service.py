@@ -0,0 +1,162 @@
+import asyncio
+import json
+
+import pytest
+
+from app.core.config import settings
+from app.services.price_provider import InMemoryPriceProvider
+from app.services.websocket_service import WebSocketManager
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeWebSocket:
+
+    def __init__(self):
+        self.sent = []
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.sent.append(json.loads(message))
+
+    async def send_bytes(self, message: bytes):
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = code
+
+
+def missed(frames) -> bool:
+    # the client rule: a delta whose prev_seq is newer than the last seq seen
+    last = None
+    for frame in frames:
+        if frame["type"] == "delta" and last is not None and frame["prev_seq"] > last:
+            return True
+        last = frame["seq"]
+    return False
+
+
+async def connected(manager: WebSocketManager, symbols):
+    websocket = FakeWebSocket()
+    await manager.connect(websocket, symbols=symbols)
+    return websocket
+
+
+async def test_filtered_stream_chains_prev_seq_without_gaps():
+    provider = InMemoryPriceProvider({"GOLD": 2000.0, "SILVER": 25.0, "OIL": 80.0})
+    manager = WebSocketManager(provider)
+    provider.add_listener(manager._on_price_update)
+    everything = await connected(manager, ["*"])
+    gold = await connected(manager, ["GOLD"])
+
+    for step in range(1, 7):
+        provider.set_price("SILVER", 25.0 + step)
+        if step % 2 == 0:
+            provider.set_price("GOLD", 2000.0 + step)
+        provider.set_price("OIL", 80.0 + step)
+    await asyncio.sleep(0)
+
+    deltas = [frame for frame in gold.sent if frame["type"] == "delta"]
+    assert [set(frame["prices"]) for frame in deltas] == [{"GOLD"}] * 3
+    assert not missed(gold.sent)
+    assert not missed(everything.sent)
+    # every wildcard delta follows directly on the one before
+    wildcard = [frame for frame in everything.sent if frame["type"] == "delta"]
+    assert all(frame["prev_seq"] == frame["seq"] - 1 for frame in wildcard)
+
+
+async def test_dropped_frame_on_filtered_stream_is_detected():
+    provider = InMemoryPriceProvider({"GOLD": 2000.0, "SILVER": 25.0})
+    manager = WebSocketManager(provider)
+    provider.add_listener(manager._on_price_update)
+    gold = await connected(manager, ["GOLD"])
+
+    for step in range(1, 4):
+        provider.set_price("GOLD", 2000.0 + step)
+        provider.set_price("SILVER", 25.0 + step)
+    await asyncio.sleep(0)
+
+    snapshot, first, second, third = gold.sent
+    assert not missed([snapshot, first, second, third])
+    assert missed([snapshot, first, third])
+
+
+async def test_lagging_client_can_resync(monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "drop_oldest")
+    provider = InMemoryPriceProvider({"GOLD": 2000.0})
+    manager = WebSocketManager(provider)
+    provider.add_listener(manager._on_price_update)
+    # nothing awaits in between, so the writer never drains the queue
+    gold = await connected(manager, ["GOLD"])
+    for step in range(1, 4):
+        provider.set_price("GOLD", 2000.0 + step)
+    await manager.resync(gold)
+    await asyncio.sleep(0)
+
+    assert gold in manager.active_connections and gold.closed is None
+    snapshot = gold.sent[-1]
+    assert (snapshot["type"], snapshot["seq"], snapshot["prices"]) == ("snapshot", 3, {"GOLD": 2003.0})
+
+
+async def test_evicted_client_is_closed(monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 1)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "disconnect")
+    provider = InMemoryPriceProvider({"GOLD": 2000.0})
+    manager = WebSocketManager(provider)
+    provider.add_listener(manager._on_price_update)
+    gold = await connected(manager, ["GOLD"])
+    provider.set_price("GOLD", 2001.0)
+
+    assert gold not in manager.active_connections and manager.evicted_connections == 1
+    [closing] = manager._closing
+    await closing
+    assert gold.closed == 1008 and not manager._closing
+
+
+async def test_client_recovers_from_a_gap_with_a_resync(monkeypatch):
+    monkeypatch.setattr(settings, "ws_send_queue_size", 2)
+    monkeypatch.setattr(settings, "ws_slow_consumer_policy", "drop_oldest")
+    provider = InMemoryPriceProvider({"GOLD": 2000.0})
+    manager = WebSocketManager(provider)
+    provider.add_listener(manager._on_price_update)
+    gold = await connected(manager, ["GOLD"])
+    await asyncio.sleep(0)
+
+    # four deltas into a queue of two: the first two are dropped
+    for step in range(1, 5):
+        provider.set_price("GOLD", 2000.0 + step)
+    await asyncio.sleep(0)
+    assert [frame["seq"] for frame in gold.sent] == [0, 3, 4]
+    assert missed(gold.sent)
+
+    await manager.resync(gold)
+    provider.set_price("GOLD", 2010.0)
+    await asyncio.sleep(0)
+    recovered = gold.sent[3:]
+    assert [(frame["type"], frame["seq"]) for frame in recovered] == [("snapshot", 4), ("delta", 5)]
+    assert recovered[0]["prices"] == {"GOLD": 2004.0}
+    assert not missed(recovered)
+
+
+async def test_keyframes_carry_the_current_sequence(monkeypatch):
+    monkeypatch.setattr(settings, "ws_keyframe_interval", 0.01)
+    provider = InMemoryPriceProvider({"GOLD": 2000.0, "SILVER": 25.0})
+    manager = WebSocketManager(provider)
+    everything = await connected(manager, ["*"])
+    silver = await connected(manager, ["SILVER"])
+    await manager.start_price_broadcast()
+    try:
+        provider.set_price("GOLD", 2001.0)
+        await asyncio.sleep(0.05)
+    finally:
+        await manager.stop_price_broadcast()
+
+    keyframes = [frame for frame in everything.sent[1:] if frame["type"] == "snapshot"]
+    assert keyframes and all(frame["seq"] == 1 for frame in keyframes)
+    assert keyframes[-1]["prices"] == {"GOLD": 2001.0, "SILVER": 25.0}
+    # a filtered client only gets its own symbols in a keyframe
+    assert {frozenset(frame["prices"]) for frame in silver.sent} == {frozenset({"SILVER"})}